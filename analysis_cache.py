@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import cost_engine
+import rate_catalog
+import rate_history
+import recommendations
+
+# In-memory entries kept before the least recently used ones are evicted
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))
+
+# Optional directory for analyses shared across processes and restarts
+ANALYSIS_CACHE_DIR = os.getenv("ANALYSIS_CACHE_DIR") or None
+
+# Analysis JSON files kept parsed for /view-analysis
+ANALYSIS_FILE_CACHE_SIZE = 256
+
+
+def analysis_key(bill_data, version=None):
+    """Return the memo key for a bill: its normalized usage inputs, current plan and the catalog version
+
+    Only the fields the analyzer reads are included, so re-uploads and bills with identical usage
+    share an entry, and a new catalog version never matches an entry priced at older rates.
+    """
+    catalog = rate_catalog.get_catalog().refresh()
+    plan_code = (cost_engine.rate_code(bill_data).split() or [''])[0]
+    billing_period = rate_history.parse_billing_period(bill_data.get('BillingPeriod'))
+    inputs = {
+        'peak': round(cost_engine.parse_usage(bill_data.get('PeakUsage')), 3),
+        'offPeak': round(cost_engine.parse_usage(bill_data.get('OffPeakUsage')), 3),
+        'total': round(cost_engine.parse_usage(bill_data.get('ElectricUsageThisPeriod')), 3),
+        'days': round(cost_engine.parse_usage(bill_data.get('BillingDays')), 3),
+        'period': [day.isoformat() for day in billing_period] if billing_period else str(bill_data.get('BillingPeriod') or ''),
+        'territory': str(bill_data.get('BaselineTerritory') or '').strip().upper(),
+        'plan': catalog.resolver.canonical_code(plan_code, plan_code),
+        'narratives': recommendations.narratives_enabled(),
+        'templates': recommendations.TEMPLATE_VERSION,
+        'version': version or catalog.version
+    }
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class AnalysisCache:
+    """Rate analyses memoized by analysis_key, with LRU eviction in memory and an optional directory on disk"""
+
+    def __init__(self, max_entries=ANALYSIS_CACHE_SIZE, cache_dir=ANALYSIS_CACHE_DIR):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key, version):
+        """Return a fresh copy of a cached analysis, or None"""
+        with self._lock:
+            if version != self._version:
+                # Rates changed; every entry in memory was priced with the old catalog
+                self._entries.clear()
+                self._version = version
+            raw = self._entries.get(key)
+            if raw is not None:
+                self._entries.move_to_end(key)
+
+        if raw is None and self.cache_dir:
+            try:
+                with open(self._disk_path(key), 'r') as f:
+                    raw = f.read()
+            except OSError:
+                raw = None
+            if raw is not None:
+                self._remember(key, raw)
+
+        with self._lock:
+            if raw is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        # Entries are stored serialized so callers can't modify the cached copy
+        return json.loads(raw)
+
+    def put(self, key, analysis):
+        """Store an analysis in memory and, when configured, on disk"""
+        raw = json.dumps(analysis)
+        self._remember(key, raw)
+        if self.cache_dir:
+            path = self._disk_path(key)
+            try:
+                # Write to a temporary file first so other processes never read a partial entry
+                temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(temp_path, 'w') as f:
+                    f.write(raw)
+                os.replace(temp_path, path)
+            except OSError as e:
+                print(f"Warning: Could not save cached analysis: {e}")
+
+    def _remember(self, key, raw):
+        with self._lock:
+            self._entries[key] = raw
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, bill_data, analyze):
+        """Return the memoized analysis for a bill, running analyze(bill_data) on a miss"""
+        version = rate_catalog.get_catalog().version
+        key = analysis_key(bill_data, version)
+        analysis = self.get(key, version)
+        if analysis is not None:
+            return analysis
+
+        analysis = analyze(bill_data)
+        # Failed analyses are retried next time rather than remembered
+        if analysis and 'error' not in analysis:
+            self.put(key, analysis)
+        return analysis
+
+
+class AnalysisFileCache:
+    """Parsed *_rate_analysis.json files, reloaded only when the file's mtime or size changes"""
+
+    def __init__(self, max_entries=ANALYSIS_FILE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, path):
+        """Return the parsed analysis at path (shared, so don't modify it); raises OSError or ValueError like json.load"""
+        return self.load_entry(path)[0]
+
+    def load_entry(self, path):
+        """Return (analysis, sha256 of the file's content, mtime in seconds) for the analysis at path"""
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                return entry[1]
+
+        with open(path, 'rb') as f:
+            raw = f.read()
+        loaded = (json.loads(raw), hashlib.sha256(raw).hexdigest(), stat.st_mtime)
+        with self._lock:
+            self._entries[path] = (signature, loaded)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return loaded
+
+
+_cache = None
+_file_cache = AnalysisFileCache()
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the shared analysis memo"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = AnalysisCache()
+    return _cache
+
+
+def load_analysis_file(path):
+    """Return a saved analysis, parsing the file only when it has changed since the last load"""
+    return _file_cache.load(path)
+
+
+def load_analysis_entry(path):
+    """Return (analysis, content hash, mtime) for a saved analysis, parsing the file only when it has changed"""
+    return _file_cache.load_entry(path)
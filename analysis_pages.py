@@ -0,0 +1,63 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from flask import make_response, render_template, request
+
+import analysis_cache
+
+# Rendered analysis pages kept in memory before the least recently used ones are evicted
+ANALYSIS_PAGE_CACHE_SIZE = int(os.getenv("ANALYSIS_PAGE_CACHE_SIZE", "256"))
+
+
+class RenderedPageCache:
+    """Rendered analysis pages and their ETags, keyed by template, page context and the analysis file's content hash"""
+
+    def __init__(self, max_entries=ANALYSIS_PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (html, etag) for a rendered page, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, html):
+        """Store a rendered page and return (html, etag)"""
+        entry = (html, hashlib.sha256(html.encode('utf-8')).hexdigest()[:32])
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+
+_pages = RenderedPageCache()
+
+
+def analysis_page(path, template, **context):
+    """Return a response with the analysis at path rendered by template, or a 304 when the client's copy is current
+
+    Each analysis is rendered once per content hash and the HTML reused until the file changes. The
+    ETag comes from the rendered page, so a changed template also invalidates browsers' copies.
+    """
+    analysis, digest, mtime = analysis_cache.load_analysis_entry(path)
+    key = (template, tuple(sorted(context.items())), digest)
+    entry = _pages.get(key)
+    if entry is None:
+        entry = _pages.put(key, render_template(template, analysis=analysis, **context))
+    html, etag = entry
+
+    response = make_response(html)
+    response.set_etag(etag)
+    response.last_modified = datetime.fromtimestamp(mtime, timezone.utc)
+    # Analyses are rewritten when a bill is re-processed, so browsers revalidate instead of reusing blindly
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
@@ -0,0 +1,266 @@
+import calendar
+import json
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+import cost_engine
+import rate_catalog
+import rate_history
+import tariff_model
+
+# Typical share of a PG&E residential customer's annual usage in each month (Jan-Dec)
+SEASONAL_PROFILE = np.array([0.092, 0.080, 0.079, 0.073, 0.074, 0.084, 0.096, 0.099, 0.088, 0.077, 0.076, 0.082])
+
+# Peak share assumed for months with no bill when no bill reports a peak/off-peak split
+DEFAULT_PEAK_SHARE = 0.25
+
+# Number of (month, usage, plan catalog) cost rows kept in memory
+MONTH_CACHE_SIZE = 100000
+
+
+def bill_month_usage(bill):
+    """Return (month 0-11, peak kWh, off-peak kWh, billing days) for an extracted bill, or None without a billing period"""
+    month = tariff_model.billing_month(bill.get('BillingPeriod'))
+    if month is None:
+        return None
+    peak = cost_engine.parse_usage(bill.get('PeakUsage'))
+    off_peak = cost_engine.parse_usage(bill.get('OffPeakUsage'))
+    if not peak and not off_peak:
+        # Bills without a TOU split still report total usage
+        off_peak = cost_engine.parse_usage(bill.get('ElectricUsageThisPeriod'))
+    days = cost_engine.parse_usage(bill.get('BillingDays')) or tariff_model.DEFAULT_BILLING_DAYS
+    return month - 1, peak, off_peak, days
+
+
+def bill_date(bill):
+    """Return the date at the middle of a bill's billing period, or None without a billing period"""
+    billing_period = rate_history.parse_billing_period(bill.get('BillingPeriod'))
+    if not billing_period:
+        return None
+    first_day, last_day = billing_period
+    return first_day + (last_day - first_day) / 2
+
+
+def by_billing_date(bills):
+    """Return bills oldest first by billing period, with undated bills ahead of dated ones"""
+    return sorted(bills, key=lambda bill: bill_date(bill) or date.min)
+
+
+def fill_year(bills, profile=SEASONAL_PROFILE, year=None):
+    """Build 12 months of peak/off-peak usage from a customer's bills, estimating months without a bill from the profile"""
+    months = {}
+    for bill in by_billing_date(bills):
+        usage = bill_month_usage(bill)
+        if usage:
+            # A later bill for the same month replaces an earlier one
+            months[usage[0]] = usage[1:]
+
+    # Month lengths for estimated months come from the year of the most recent bill
+    latest = max((bill_date(bill) for bill in bills if bill_date(bill)), default=None)
+    year = year or (latest or date.today()).year
+    peak = np.zeros(12)
+    off_peak = np.zeros(12)
+    days = np.array([calendar.monthrange(year, m + 1)[1] for m in range(12)], dtype=float)
+    estimated = np.ones(12, dtype=bool)
+
+    for month, (month_peak, month_off_peak, month_days) in months.items():
+        peak[month], off_peak[month], days[month] = month_peak, month_off_peak, month_days
+        estimated[month] = False
+
+    known = ~estimated
+    if known.any() and estimated.any():
+        # Scale the profile so it matches the billed months, per day so short and long bills compare
+        daily_profile = profile / days
+        known_daily = (peak + off_peak)[known] / days[known]
+        scale = known_daily.sum() / daily_profile[known].sum()
+        estimated_total = scale * daily_profile[estimated] * days[estimated]
+
+        known_total = (peak + off_peak)[known].sum()
+        peak_share = peak[known].sum() / known_total if known_total and peak[known].any() else DEFAULT_PEAK_SHARE
+        peak[estimated] = estimated_total * peak_share
+        off_peak[estimated] = estimated_total * (1 - peak_share)
+
+    return {'peak': peak, 'offPeak': off_peak, 'days': days, 'estimated': estimated}
+
+
+class AnnualAnalyzer:
+    """Price a customer's year under every plan, caching each month's plan costs so a new bill only reprices its month"""
+
+    def __init__(self, cache_size=MONTH_CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def month_costs(self, model, year_usage, territory=None):
+        """Return (12 x P) plan costs for a filled year, pricing only months not already cached"""
+        territory_row = int(model.territory_indexes([territory])[0])
+        keys = [
+            (model.version, month, round(float(year_usage['peak'][month]), 3),
+             round(float(year_usage['offPeak'][month]), 3), float(year_usage['days'][month]), territory_row)
+            for month in range(12)
+        ]
+
+        costs = np.zeros((12, len(model.codes)))
+        missing = []
+        with self._lock:
+            for month, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    costs[month] = self._cache[key]
+                else:
+                    missing.append(month)
+
+        if missing:
+            priced = model.evaluate(
+                year_usage['peak'][missing],
+                year_usage['offPeak'][missing],
+                days=year_usage['days'][missing],
+                months=missing,
+                territories=[territory_row] * len(missing)
+            )['totalCost']
+            costs[missing] = priced
+            with self._lock:
+                for row, month in enumerate(missing):
+                    self._cache[keys[month]] = priced[row]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return costs
+
+    def analyze(self, bills, territory=None, profile=SEASONAL_PROFILE):
+        """Project a customer's annual cost under every plan from their extracted bills"""
+        bills = by_billing_date(bills)
+        if not any(bill_month_usage(bill) for bill in bills):
+            return {"error": "No bills with a billing period to project from"}
+
+        model = tariff_model.get_model()
+        year_usage = fill_year(bills, profile)
+        territory = territory or next((bill.get('BaselineTerritory') for bill in bills if bill.get('BaselineTerritory')), None)
+        costs = self.month_costs(model, year_usage, territory)
+        annual = costs.sum(axis=0)
+
+        # Current plan from the most recent bill by billing date that names one
+        resolver = rate_catalog.get_catalog().resolver
+        current_code = next((resolver.canonical_code(cost_engine.rate_code(bill)) for bill in reversed(bills)
+                             if resolver.canonical_code(cost_engine.rate_code(bill))), None)
+        current_index = model.codes.index(current_code) if current_code in model.codes else -1
+        ranking = cost_engine.rank_costs(annual, current_index)
+
+        summer = np.isin(np.arange(1, 13), tariff_model.BASELINE_SUMMER_MONTHS)
+        plans = []
+        for i in ranking['order']:
+            plans.append({
+                'planCode': model.codes[i],
+                'description': model.descriptions[i],
+                'annualCost': round(float(annual[i]), 2),
+                'summerCost': round(float(costs[summer, i].sum()), 2),
+                'winterCost': round(float(costs[~summer, i].sum()), 2),
+                'monthlyCosts': [round(float(cost), 2) for cost in costs[:, i]]
+            })
+
+        best_index = int(ranking['bestIndex'])
+        return {
+            'currentPlan': model.codes[int(ranking['currentIndex'])] if current_index >= 0 else None,
+            'currentAnnualCost': round(float(ranking['currentCost']), 2),
+            'bestPlan': model.codes[best_index],
+            'bestAnnualCost': round(float(ranking['bestCost']), 2),
+            'yearlySavings': round(float(ranking['savings']), 2),
+            'months': [
+                {
+                    'month': calendar.month_abbr[m + 1],
+                    'peakUsage': round(float(year_usage['peak'][m]), 3),
+                    'offPeakUsage': round(float(year_usage['offPeak'][m]), 3),
+                    'billingDays': int(year_usage['days'][m]),
+                    'estimated': bool(year_usage['estimated'][m])
+                }
+                for m in range(12)
+            ],
+            'billedMonths': int((~year_usage['estimated']).sum()),
+            'allPlans': plans,
+            'catalogVersion': model.version
+        }
+
+
+_analyzer = AnnualAnalyzer()
+
+
+def analyze_customer_year(bills, territory=None):
+    """Project annual costs for one customer's bills using the shared month cache"""
+    return _analyzer.analyze(bills, territory)
+
+
+def yearly_costs(bill, territory=None):
+    """Return {plan code: projected annual cost} for a single bill, or {} when it has no billing period"""
+    analysis = analyze_customer_year([bill], territory)
+    return {plan['planCode']: plan['annualCost'] for plan in analysis.get('allPlans', [])}
+
+
+def project_bills(bills, model=None):
+    """Return (N x P) projected annual plan costs, each bill's year filled from that bill alone as yearly_costs does
+
+    All bills' months are priced in one call. Rows for bills without a billing period are NaN.
+    """
+    model = model or tariff_model.get_model()
+    annual = np.full((len(bills), len(model.codes)), np.nan)
+    rows, years, territories = [], [], []
+    for i, bill in enumerate(bills):
+        if bill_month_usage(bill):
+            rows.append(i)
+            years.append(fill_year([bill]))
+            territories.append(bill.get('BaselineTerritory'))
+    if rows:
+        costs = model.evaluate(
+            np.concatenate([year['peak'] for year in years]),
+            np.concatenate([year['offPeak'] for year in years]),
+            days=np.concatenate([year['days'] for year in years]),
+            months=np.tile(np.arange(12), len(rows)),
+            territories=np.repeat(model.territory_indexes(territories), 12)
+        )['totalCost']
+        annual[rows] = costs.reshape(len(rows), 12, -1).sum(axis=1)
+    return annual
+
+
+def customer_key(bill):
+    """Group bills by customer name and service address"""
+    name = re.sub(r'\s+', ' ', str(bill.get('Name') or '')).strip().upper()
+    address = re.sub(r'\s+', ' ', str(bill.get('Address') or '')).strip().upper()
+    return f"{name} | {address}"
+
+
+def main():
+    extracted_data_folder = sys.argv[1] if len(sys.argv) > 1 else 'extracted_data'
+    if not os.path.exists(extracted_data_folder):
+        print(f"Error: {extracted_data_folder} directory not found.")
+        return
+
+    customers = {}
+    for file_name in sorted(os.listdir(extracted_data_folder)):
+        if not file_name.endswith('_extracted_data.json'):
+            continue
+        try:
+            with open(os.path.join(extracted_data_folder, file_name), 'r') as f:
+                bill = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Skipping {file_name}: {e}")
+            continue
+        customers.setdefault(customer_key(bill), []).append(bill)
+
+    for customer, bills in customers.items():
+        analysis = analyze_customer_year(bills)
+        print(f"\n{customer} ({len(bills)} bills)")
+        if 'error' in analysis:
+            print(f"  {analysis['error']}")
+            continue
+        print(f"  Billed months: {analysis['billedMonths']}/12 (others estimated from the seasonal profile)")
+        print(f"  Current Plan: {analysis['currentPlan']} - ${analysis['currentAnnualCost']}/year")
+        print(f"  Best Plan: {analysis['bestPlan']} - ${analysis['bestAnnualCost']}/year")
+        print(f"  Estimated Yearly Savings: ${analysis['yearlySavings']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,9 @@ import sys
 # Add the parent directory to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+# Serverless instances share no disk, so unless the deployment names a database jobs are kept in memory
+os.environ.setdefault('JOB_STORE_PATH', ':memory:')
+
 # Import the Flask app from simple_bill_processor
 from simple_bill_processor import app as flask_app
 
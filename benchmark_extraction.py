@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import importlib
+import contextlib
+from types import SimpleNamespace
+
+import rate_code_resolver
+
+# Hand-checked bills: cached OCR text and pages plus the expected fields. Nothing in the processing pipeline
+# writes here, unlike ocr_output/ and extracted_data/, so re-extracting bills can't move the answers.
+GOLDEN_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'golden')
+BASELINE_FILE = 'benchmark_baseline.json'
+
+# Fields compared against the golden files
+GOLDEN_FIELDS = [
+    'Name', 'Address', 'RateSchedule', 'ElectricUsageThisPeriod', 'BillingDays',
+    'PeakUsage', 'PeakRate', 'PeakTotal', 'OffPeakUsage', 'OffPeakRate', 'OffPeakTotal',
+    'BillingPeriod', 'TotalAmountDue'
+]
+
+# How the snake_case extract_bill_data variants name the golden fields
+SNAKE_CASE_FIELDS = {
+    'service_address': 'Address',
+    'rate_plan': 'RateSchedule',
+    'total_kwh': 'ElectricUsageThisPeriod',
+    'billing_days': 'BillingDays',
+    'peak_kwh': 'PeakUsage',
+    'peak_rate': 'PeakRate',
+    'off_peak_kwh': 'OffPeakUsage',
+    'off_peak_rate': 'OffPeakRate',
+    'billing_period': 'BillingPeriod',
+    'total_amount': 'TotalAmountDue'
+}
+
+
+def load_corpus(folder=GOLDEN_FOLDER):
+    """Load every golden bill that has both cached OCR text and expected fields"""
+    corpus = []
+    for file_name in sorted(os.listdir(folder)):
+        if not file_name.endswith('_golden.json'):
+            continue
+        base_name = file_name[:-len('_golden.json')]
+        text_path = os.path.join(folder, f"{base_name}_ocr_text.txt")
+        json_path = os.path.join(folder, f"{base_name}_ocr_combined.json")
+        if not os.path.exists(text_path):
+            continue
+
+        with open(os.path.join(folder, file_name), 'r') as f:
+            golden = json.load(f)
+        with open(text_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        pages = []
+        if os.path.exists(json_path):
+            with open(json_path, 'r', encoding='utf-8') as f:
+                pages = json.load(f)
+
+        corpus.append({'name': base_name, 'text': text, 'pages': pages, 'golden': golden})
+    return corpus
+
+
+def normalize_value(field, value):
+    """Normalize a field value so equivalent spellings compare equal"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, dict):
+        value = value.get('Code') or value.get('code') or ''
+    if field == 'RateSchedule':
+        return rate_code_resolver.resolve_rate_code(value)['code'] or re.sub(r'\s+', ' ', str(value)).strip().upper()
+
+    text = str(value)
+    number = re.sub(r'[\$,\s]|/kWh|kWh', '', text)
+    try:
+        return round(float(number), 4)
+    except ValueError:
+        return re.sub(r'[\s,]+', ' ', text).strip().upper()
+
+
+def compare_fields(extracted, golden):
+    """Return {field: True/False} for every golden field the extractor reports"""
+    results = {}
+    for field in GOLDEN_FIELDS:
+        if field not in extracted:
+            continue
+        expected = normalize_value(field, golden.get(field))
+        if expected is None:
+            continue
+        actual = normalize_value(field, extracted.get(field))
+        if isinstance(expected, float) and isinstance(actual, float):
+            results[field] = abs(expected - actual) <= max(0.01, abs(expected) * 1e-4)
+        else:
+            results[field] = expected == actual
+    return results
+
+
+def run_format_ocr_results(module, document):
+    """Run format_ocr_results on the cached OCR.space pages"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_file = os.path.join(temp_dir, 'combined.json')
+        with open(input_file, 'w') as f:
+            json.dump({'ChunkResults': document['pages'], 'CombinedText': document['text']}, f)
+        formatted = module.format_ocr_results(input_file=input_file, output_file=os.path.join(temp_dir, 'formatted.json'))
+
+    service = formatted.get('serviceInfo', {})
+    usage = formatted.get('usageInfo', {})
+    energy = formatted.get('energyCharges', {})
+    peak = energy.get('peak', {})
+    off_peak = energy.get('offPeak', {})
+    period = usage.get('billingPeriod')
+    return {
+        'Name': service.get('customerName'),
+        'Address': ', '.join(part for part in [service.get('serviceAddress'), service.get('cityStateZip')] if part),
+        'RateSchedule': formatted.get('rateInfo', {}).get('rateCode'),
+        'ElectricUsageThisPeriod': energy.get('totalUsage'),
+        'BillingDays': usage.get('billingDays'),
+        'PeakUsage': peak.get('kWh'),
+        'PeakRate': peak.get('rate'),
+        'PeakTotal': peak.get('total'),
+        'OffPeakUsage': off_peak.get('kWh'),
+        'OffPeakRate': off_peak.get('rate'),
+        'OffPeakTotal': off_peak.get('total'),
+        'BillingPeriod': f"{period['startDate']} - {period['endDate']}" if isinstance(period, dict) else period,
+        'TotalAmountDue': formatted.get('billingInfo', {}).get('totalAmountDue')
+    }
+
+
+def run_snake_case_extractor(module, document):
+    """Run a module-level extract_bill_data(text) variant"""
+    data = module.extract_bill_data(document['text'])
+    return {SNAKE_CASE_FIELDS[key]: value for key, value in data.items() if key in SNAKE_CASE_FIELDS}
+
+
+def run_pge_bill_analyzer(module, document):
+    """Run PGEBillAnalyzer.extract_bill_data without constructing the Vision and Supabase clients"""
+    data = module.PGEBillAnalyzer.extract_bill_data(None, {'full_text': document['text']})
+    return {SNAKE_CASE_FIELDS[key]: value for key, value in data.items() if key in SNAKE_CASE_FIELDS}
+
+
+def run_find_value_after_header(module, document):
+    """Read the amount due with find_value_after_header"""
+    return {'TotalAmountDue': module.find_value_after_header(document['text'], 'Total Amount Due')}
+
+
+def run_llm_replay(module, document):
+    """Run the streaming LLM path against a fake client that replays the recorded response"""
+    recorded = json.dumps(document['golden'], indent=4)
+
+    def create(**kwargs):
+        if kwargs.get('stream'):
+            return [
+                SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=recorded[i:i + 16]))])
+                for i in range(0, len(recorded), 16)
+            ]
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content='{}'))])
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return module.stream_bill_fields(document['text'], client=client)
+
+
+# (name, module, runner)
+EXTRACTORS = [
+    ('format_ocr_results', 'format_ocr_results', run_format_ocr_results),
+    ('llm_replay', 'llm_extraction', run_llm_replay),
+    ('pge_bill_analyzer.extract_bill_data', 'pge_bill_analyzer', run_pge_bill_analyzer),
+    ('process_bills.extract_bill_data', 'process_bills', run_snake_case_extractor),
+    ('process_bills_pypdf.extract_bill_data', 'process_bills_pypdf', run_snake_case_extractor),
+    ('process_bills_simple.extract_bill_data', 'process_bills_simple', run_snake_case_extractor),
+    ('process_bills_textract.extract_bill_data', 'process_bills_textract', run_snake_case_extractor),
+    ('process_bills_vision.extract_bill_data', 'process_bills_vision', run_snake_case_extractor),
+    ('process_bills_vision.find_value_after_header', 'process_bills_vision', run_find_value_after_header),
+    ('process_local_bills.extract_bill_data', 'process_local_bills', run_snake_case_extractor),
+    ('process_local_bills_simple.extract_bill_data', 'process_local_bills_simple', run_snake_case_extractor),
+    ('cloud_function.main.extract_bill_data', 'cloud_function.main', run_snake_case_extractor),
+]
+
+
+# Harness self-checks rather than extractors: llm_replay feeds the golden JSON back through the streaming
+# parser, so it must score 100% by construction. They are never stored in the baseline.
+SELF_CHECKS = {'llm_replay'}
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def benchmark_extractor(name, module_name, runner, corpus, repeat):
+    """Time one extractor over the corpus and score it against the golden data"""
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            module = importlib.import_module(module_name)
+    except ImportError as e:
+        return {'name': name, 'skipped': f"missing dependency: {e}"}
+
+    latencies = []
+    field_hits = {}
+    errors = 0
+    for document in corpus:
+        extracted = {}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                # Extractors print progress; keep it out of the report and the timings comparable
+                with contextlib.redirect_stdout(io.StringIO()):
+                    extracted = runner(module, document)
+            except Exception as e:
+                print(f"  {name} failed on {document['name']}: {e}", file=sys.stderr)
+                extracted = {}
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        for field, correct in compare_fields(extracted, document['golden']).items():
+            field_hits.setdefault(field, []).append(correct)
+
+    total_seconds = sum(latencies) / 1000
+    accuracy = {field: round(sum(hits) / len(hits), 4) for field, hits in field_hits.items()}
+    all_hits = [hit for hits in field_hits.values() for hit in hits]
+    return {
+        'name': name,
+        'documents': len(corpus),
+        'errors': errors,
+        'fieldAccuracy': accuracy,
+        'overallAccuracy': round(sum(all_hits) / len(all_hits), 4) if all_hits else 0.0,
+        'docsPerSecond': round(len(latencies) / total_seconds, 2) if total_seconds else 0.0,
+        'p50Ms': round(percentile(latencies, 0.50), 3),
+        'p95Ms': round(percentile(latencies, 0.95), 3)
+    }
+
+
+def find_regressions(results, baseline, latency_tolerance):
+    """Compare results to the stored baseline and describe every regression"""
+    regressions = []
+    for result in results:
+        if 'skipped' in result:
+            continue
+        if result['name'] in SELF_CHECKS:
+            if result['overallAccuracy'] < 1.0 or result['errors']:
+                regressions.append(f"{result['name']}: self-check scored {result['overallAccuracy']:.2%} "
+                                   f"with {result['errors']} errors; the benchmark harness itself is broken")
+            continue
+
+        expected = baseline.get(result['name'])
+        if not expected:
+            # An extractor without a baseline is unguarded, which must not pass silently
+            regressions.append(f"{result['name']}: no baseline entry; run with --update-baseline to record one")
+            continue
+        if 'skipped' in expected:
+            continue
+
+        for field, accuracy in expected.get('fieldAccuracy', {}).items():
+            current = result['fieldAccuracy'].get(field, 0.0)
+            if current < accuracy:
+                regressions.append(f"{result['name']}: {field} accuracy {current:.2%} < baseline {accuracy:.2%}")
+
+        allowed_p95 = expected['p95Ms'] * (1 + latency_tolerance)
+        if result['p95Ms'] > allowed_p95:
+            regressions.append(f"{result['name']}: p95 {result['p95Ms']:.2f}ms > {allowed_p95:.2f}ms "
+                               f"(baseline {expected['p95Ms']:.2f}ms + {latency_tolerance:.0%})")
+    return regressions
+
+
+def print_report(results):
+    """Print a summary table and the per-field accuracy of each extractor"""
+    print(f"\n{'Extractor':<48} {'Acc':>7} {'Docs/s':>10} {'p50 ms':>9} {'p95 ms':>9}")
+    print('-' * 87)
+    for result in results:
+        if 'skipped' in result:
+            print(f"{result['name']:<48} skipped ({result['skipped']})")
+            continue
+        label = f"{result['name']} (self-check)" if result['name'] in SELF_CHECKS else result['name']
+        print(f"{label:<48} {result['overallAccuracy']:>7.1%} {result['docsPerSecond']:>10.1f} "
+              f"{result['p50Ms']:>9.3f} {result['p95Ms']:>9.3f}")
+
+    for result in results:
+        if result.get('fieldAccuracy'):
+            print(f"\n{result['name']}:")
+            for field, accuracy in result['fieldAccuracy'].items():
+                print(f"  {field:<26} {accuracy:.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bill extractors against the golden bill corpus")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per document for latency percentiles")
+    parser.add_argument('--only', action='append', help="benchmark only extractors whose name contains this")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="baseline file to compare against")
+    parser.add_argument('--update-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--latency-tolerance', type=float, default=0.5,
+                        help="allowed p95 slowdown relative to the baseline (0.5 = 50%%)")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    if not corpus:
+        print(f"No bills with both OCR text and golden data in {GOLDEN_FOLDER}.")
+        return 1
+    print(f"Benchmarking {len(corpus)} bills x {args.repeat} runs")
+
+    results = []
+    for name, module_name, runner in EXTRACTORS:
+        if args.only and not any(fragment in name for fragment in args.only):
+            continue
+        results.append(benchmark_extractor(name, module_name, runner, corpus, args.repeat))
+
+    print_report(results)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        baseline.update({result['name']: result for result in results
+                         if 'skipped' not in result and result['name'] not in SELF_CHECKS})
+        for name in SELF_CHECKS:
+            baseline.pop(name, None)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=4)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"\nNo baseline at {args.baseline}; run with --update-baseline to create one.")
+        return 0
+
+    regressions = find_regressions(results, baseline, args.latency_tolerance)
+    if regressions:
+        print("\nREGRESSIONS:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+
+    print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+
+# Modules a cold start imports: the Vercel entry point and the standalone web app
+ENTRY_POINTS = ['api.index', 'bill_processing_web']
+
+# Heavy modules that should only be imported once a bill is actually processed
+LAZY_MODULES = ['fitz', 'openai', 'google.cloud.vision']
+
+# Cold start budget per entry point, in milliseconds
+DEFAULT_BUDGET_MS = 500
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def project_files():
+    """Return {name: modification time} for the files and folders at the top of the project, bytecode caches aside"""
+    with os.scandir(PROJECT_DIR) as entries:
+        return {entry.name: entry.stat().st_mtime_ns for entry in entries if entry.name != '__pycache__'}
+
+
+def time_import(module_name):
+    """Import a module in a fresh interpreter, with the app's own configuration, and return (total ms, {module: cumulative ms}, files written)
+
+    Files the import creates or changes in the project (a job database, working folders) are returned
+    so they can be reported; importing an entry point should write nothing.
+    """
+    before = project_files()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module_name}"],
+                               capture_output=True, text=True, cwd=PROJECT_DIR)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'import failed')
+    after = project_files()
+    written = sorted(name for name, mtime in after.items() if before.get(name) != mtime)
+
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            cumulative[match.group(4)] = int(match.group(2)) / 1000
+    return cumulative.get(module_name, 0.0), cumulative, written
+
+
+def benchmark_entry_point(module_name, repeat):
+    """Import an entry point repeatedly in fresh interpreters and summarize the timings"""
+    try:
+        runs = [time_import(module_name) for _ in range(repeat)]
+    except RuntimeError as e:
+        return {'name': module_name, 'skipped': str(e)}
+
+    totals = [total for total, _, _ in runs]
+    # Report the slowest imports from the median run so one noisy run doesn't skew them
+    _, cumulative, _ = sorted(runs, key=lambda run: run[0])[len(runs) // 2]
+    slowest = sorted(((name, ms) for name, ms in cumulative.items() if name != module_name and '.' not in name),
+                     key=lambda item: -item[1])[:10]
+    return {
+        'name': module_name,
+        'medianMs': round(statistics.median(totals), 1),
+        'maxMs': round(max(totals), 1),
+        'slowest': slowest,
+        'eagerHeavyModules': [name for name in LAZY_MODULES if name in cumulative],
+        'filesWritten': sorted({name for _, _, written in runs for name in written})
+    }
+
+
+def print_report(results):
+    """Print a table of import times and each entry point's slowest top-level imports"""
+    print(f"\n{'Entry point':<32} {'median ms':>10} {'max ms':>10}")
+    print('-' * 54)
+    for result in results:
+        if 'skipped' in result:
+            print(f"{result['name']:<32} skipped ({result['skipped']})")
+            continue
+        print(f"{result['name']:<32} {result['medianMs']:>10.1f} {result['maxMs']:>10.1f}")
+
+    for result in results:
+        if 'skipped' in result:
+            continue
+        print(f"\n{result['name']} slowest imports:")
+        for name, ms in result['slowest']:
+            print(f"  {name:<30} {ms:>8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold start import time of the web entry points")
+    parser.add_argument('--repeat', type=int, default=5, help="fresh interpreters per entry point")
+    parser.add_argument('--only', action='append', help="benchmark only entry points whose name contains this")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS,
+                        help="median import time allowed per entry point")
+    args = parser.parse_args()
+
+    results = []
+    for module_name in ENTRY_POINTS:
+        if args.only and not any(fragment in module_name for fragment in args.only):
+            continue
+        results.append(benchmark_entry_point(module_name, args.repeat))
+
+    print_report(results)
+
+    problems = []
+    for result in results:
+        if 'skipped' in result:
+            continue
+        if result['medianMs'] > args.budget_ms:
+            problems.append(f"{result['name']}: median import {result['medianMs']} ms exceeds {args.budget_ms:g} ms")
+        for name in result['eagerHeavyModules']:
+            problems.append(f"{result['name']}: imports {name} at startup")
+        for name in result['filesWritten']:
+            problems.append(f"{result['name']}: writes {name} at startup")
+
+    if problems:
+        print("\nSTARTUP REGRESSIONS:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+
+    print(f"\nAll entry points start within {args.budget_ms:g} ms without writing files.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
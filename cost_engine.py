@@ -0,0 +1,66 @@
+import numpy as np
+
+# Shared helpers for reading usage from extracted bills and ranking plan costs; plans themselves are priced
+# by tariff_model
+
+# Usage periods priced by two-period plans, in column order
+PERIODS = ('peak', 'offPeak')
+PERIOD_USAGE_FIELDS = ('PeakUsage', 'OffPeakUsage')
+
+
+def parse_usage(value):
+    """Turn an extracted usage value such as '70.616 kWh' or '1,234' into a float (0 when missing)"""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).replace(',', '').replace('kWh', '').strip()
+    try:
+        return float(text)
+    except ValueError:
+        return 0.0
+
+
+def usage_matrix(bills):
+    """Build an (N bills x K periods) usage matrix from extracted bill data"""
+    return np.array(
+        [[parse_usage(bill.get(field)) for field in PERIOD_USAGE_FIELDS] for bill in bills],
+        dtype=float
+    ).reshape(len(bills), len(PERIODS))
+
+
+def rank_costs(costs, current_plans=None):
+    """Rank a (..., P) cost array and return the ranking, best plan and savings as arrays"""
+    costs = np.asarray(costs, dtype=float)
+    order = np.argsort(costs, axis=-1, kind='stable')
+    best_index = order[..., 0]
+    best_cost = np.take_along_axis(costs, best_index[..., np.newaxis], axis=-1)[..., 0]
+
+    if current_plans is None:
+        current_index = np.full(best_index.shape, -1, dtype=int)
+    else:
+        current_index = np.broadcast_to(np.asarray(current_plans, dtype=int), best_index.shape)
+
+    # Bills on an unknown plan are treated as already on the best one, as analyze_rate_plans does
+    known = current_index >= 0
+    current_index = np.where(known, current_index, best_index)
+    current_cost = np.take_along_axis(costs, current_index[..., np.newaxis], axis=-1)[..., 0]
+
+    return {
+        'costs': costs,
+        'order': order,
+        'bestIndex': best_index,
+        'bestCost': best_cost,
+        'currentIndex': current_index,
+        'currentKnown': known,
+        'currentCost': current_cost,
+        'savings': current_cost - best_cost
+    }
+
+
+def rate_code(bill):
+    """Return the raw rate schedule code of an extracted bill"""
+    rate_schedule = bill.get('RateSchedule') or ''
+    if isinstance(rate_schedule, dict):
+        rate_schedule = rate_schedule.get('Code') or ''
+    return str(rate_schedule)
@@ -1,6 +1,7 @@
 import os
 import json
 import openai
+import llm_extraction
 from dotenv import load_dotenv
 
 # Load environment variables from .env file (for API key)
@@ -9,66 +10,25 @@ load_dotenv()
 # Set up OpenAI API key
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+# Fields extracted by this script (the full pipeline also asks for BillingPeriod and TotalAmountDue)
+EXTRACTED_FIELDS = [
+    "Name", "Address", "RateSchedule", "ElectricUsageThisPeriod", "BillingDays",
+    "PeakUsage", "PeakRate", "PeakTotal", "OffPeakUsage", "OffPeakRate", "OffPeakTotal"
+]
+
 def extract_bill_data_with_openai(ocr_text_file):
     """Extract specific bill data using OpenAI API"""
     # Read the OCR text file
     with open(ocr_text_file, 'r') as f:
         ocr_text = f.read()
     
-    # Create a prompt for OpenAI
-    prompt = f"""
-    Extract the following information from this PG&E bill OCR text. Return the results as a JSON object with these fields:
-    1. Name (the customer name)
-    2. Address (full service address including city, state, zip)
-    3. RateSchedule (the rate schedule code and description)
-    4. ElectricUsageThisPeriod (total kWh used in the billing period)
-    5. BillingDays (number of days in the billing period)
-    6. PeakUsage (peak usage in kWh)
-    7. PeakRate (the rate charged for peak usage, e.g. $0.49378/kWh)
-    8. PeakTotal (total amount charged for peak usage, e.g. $85.82)
-    9. OffPeakUsage (off-peak usage in kWh)
-    10. OffPeakRate (the rate charged for off-peak usage, e.g. $0.46378/kWh)
-    11. OffPeakTotal (total amount charged for off-peak usage, e.g. $224.97)
-    
-    Look for the 'Energy Charges' section of the bill, which typically contains the peak and off-peak usage information.
-    If any field cannot be found, return null for that field.
-    
-    OCR Text:
-    {ocr_text}
-    """
-    
-    # Call OpenAI API
-    response = openai.chat.completions.create(
+    # Stream a JSON-mode completion and print fields as they arrive
+    return llm_extraction.stream_bill_fields(
+        ocr_text,
+        fields=EXTRACTED_FIELDS,
         model="gpt-3.5-turbo",  # Using gpt-3.5-turbo which is more widely available
-        messages=[
-            {"role": "system", "content": "You are a utility bill data extraction assistant. Extract the requested information accurately from the OCR text of a PG&E bill. Return your response as a valid JSON object."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.0  # Use low temperature for more deterministic results
+        on_field=lambda name, value: print(f"Received {name}: {value}")
     )
-    
-    # Extract and parse the response
-    result = response.choices[0].message.content
-    
-    # Print raw response for debugging
-    print("\nRaw OpenAI API Response:")
-    print(result)
-    
-    # Clean the response - remove markdown code block markers if present
-    cleaned_result = result
-    if result.startswith("```json") and result.endswith("```"):
-        cleaned_result = result[7:-3].strip()  # Remove ```json and ``` markers
-    elif result.startswith("```") and result.endswith("```"):
-        cleaned_result = result[3:-3].strip()  # Remove ``` markers
-    
-    # Parse JSON response
-    try:
-        parsed_result = json.loads(cleaned_result)
-        return parsed_result
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON response: {e}")
-        print(f"Cleaned result: {cleaned_result}")
-        return {"error": "Failed to parse API response"}
 
 def main():
     # Path to OCR text file
@@ -1,6 +1,9 @@
 import json
 import re
 import os
+import ocr_numbers
+import rate_code_resolver
+import rate_catalog
 
 def format_ocr_results(input_file='ocr_result_combined.json', output_file='ocr_result_formatted.json'):
     """Format OCR results to be more legible and structured according to user preferences"""
@@ -318,13 +321,15 @@ def format_ocr_results(input_file='ocr_result_combined.json', output_file='ocr_r
         rate_code = rate_schedule_match.group(1)
         rate_description = rate_schedule_match.group(2).strip()
         
-        # Check if the rate code needs correction (ETOIJ3 should be ETOUB)
-        if 'ETOIJ3' in rate_code:
-            rate_code = 'ETOUB'
+        # Correct OCR misreads of the rate code (e.g. ETOIJ3 -> ETOUB)
+        rate_match = rate_code_resolver.resolve_rate_code(rate_code)
+        if rate_match['code']:
+            rate_code = rate_match['code']
             
         formatted_data["rateInfo"] = {
             "rateCode": rate_code,
             "rateDescription": rate_description,
+            "rateMatchConfidence": rate_match['confidence'],
             "rateDetails": get_rate_details(rate_code)
         }
     
@@ -380,6 +385,138 @@ def format_ocr_results(input_file='ocr_result_combined.json', output_file='ocr_r
             
             formatted_data["electricDetails"]["lineItems"] = line_items
     
+    # Rebuild the energy charge numbers so that usage x rate matches each row total
+    # and the rows add up to the printed totals; fall back to pattern matching otherwise
+    reconstructed = ocr_numbers.reconstruct_energy_charges(combined_text)
+    if reconstructed["peak"] and reconstructed["offPeak"]:
+        formatted_data["energyCharges"]["peak"] = reconstructed["peak"]
+        formatted_data["energyCharges"]["offPeak"] = reconstructed["offPeak"]
+        formatted_data["energyCharges"]["reconstructed"] = reconstructed["consistent"]
+        print(f"Reconstructed energy charges: peak {reconstructed['peak']}, off-peak {reconstructed['offPeak']}")
+    else:
+        extract_energy_charges_with_patterns(formatted_data, combined_text)
+    
+    # Calculate the off-peak total if we have kWh and rate but not total
+    if "kWh" in formatted_data["energyCharges"]["offPeak"] and "rate" in formatted_data["energyCharges"]["offPeak"] and "total" not in formatted_data["energyCharges"]["offPeak"]:
+        off_peak_kwh = formatted_data["energyCharges"]["offPeak"]["kWh"]
+        off_peak_rate = formatted_data["energyCharges"]["offPeak"]["rate"]
+        formatted_data["energyCharges"]["offPeak"]["total"] = round(off_peak_kwh * off_peak_rate, 2)
+        print(f"Calculated off-peak total from kWh and rate: ${formatted_data['energyCharges']['offPeak']['total']}")
+        
+    # Calculate total energy usage if we have both peak and off-peak values
+    if "kWh" in formatted_data["energyCharges"]["peak"] and "kWh" in formatted_data["energyCharges"]["offPeak"]:
+        peak_kwh = formatted_data["energyCharges"]["peak"]["kWh"]
+        off_peak_kwh = formatted_data["energyCharges"]["offPeak"]["kWh"]
+        total_kwh = peak_kwh + off_peak_kwh
+        formatted_data["energyCharges"]["totalUsage"] = round(total_kwh, 2)
+        print(f"Calculated total usage from peak and off-peak: {formatted_data['energyCharges']['totalUsage']} kWh")
+    else:
+        # Try to get the total usage directly from the OCR text
+        total_usage_match = re.search(r'Electric Usage This Period:\s*(\d+\.\d+)\s*kWh', combined_text)
+        if total_usage_match:
+            try:
+                total_usage = float(total_usage_match.group(1))
+                formatted_data["energyCharges"]["totalUsage"] = total_usage
+                print(f"Extracted total usage directly: {total_usage} kWh")
+            except (ValueError, IndexError) as e:
+                print(f"Error extracting total usage: {e}")
+    
+    # Make sure we have a totalUsage field for compatibility
+    if "totalUsage" in formatted_data["energyCharges"]:
+        formatted_data["energyCharges"]["totalKWh"] = formatted_data["energyCharges"]["totalUsage"]
+    
+    
+    # Calculate total kWh if we have both peak and off-peak values
+    if "kWh" in formatted_data["energyCharges"]["peak"] and "kWh" in formatted_data["energyCharges"]["offPeak"]:
+        peak_kwh = formatted_data["energyCharges"]["peak"]["kWh"]
+        off_peak_kwh = formatted_data["energyCharges"]["offPeak"]["kWh"]
+        formatted_data["energyCharges"]["totalKWh"] = peak_kwh + off_peak_kwh
+        print(f"Calculated total kWh: {formatted_data['energyCharges']['totalKWh']} kWh")
+    
+    # Extract total electric delivery charges
+    # Look for the pattern in the OCR text
+    total_electric_pattern = r'Total PG&E Electric Delivery Charges\s*\$?(\d+\.\d+)'
+    total_electric_match = re.search(total_electric_pattern, combined_text)
+    
+    if total_electric_match:
+        try:
+            total_delivery = float(total_electric_match.group(1))
+            formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
+            print(f"Found total delivery charges in OCR: ${total_delivery}")
+        except (ValueError, IndexError) as e:
+            print(f"Error extracting total delivery charges: {e}")
+    else:
+        # Try alternative patterns that might match the OCR text format
+        # Pattern for $XXX.XX format
+        alt_total_pattern1 = r'Total PG&E Electric Delivery Charges\s*\$?\s*(\d+)\.(\d+)'
+        # Pattern for $XXX XX format (space instead of decimal)
+        alt_total_pattern2 = r'Total PG&E Electric Delivery Charges\s*\$?\s*(\d+)\s+(\d+)'
+        
+        alt_total_match = re.search(alt_total_pattern1, combined_text)
+        if alt_total_match:
+            try:
+                dollars = alt_total_match.group(1)
+                cents = alt_total_match.group(2)
+                total_delivery = float(f"{dollars}.{cents}")
+                formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
+                print(f"Found total delivery charges with alternative pattern 1: ${total_delivery}")
+            except (ValueError, IndexError) as e:
+                print(f"Error extracting total delivery charges with alternative pattern 1: {e}")
+        else:
+            # Try the space-separated pattern
+            alt_total_match2 = re.search(alt_total_pattern2, combined_text)
+            if alt_total_match2:
+                try:
+                    dollars = alt_total_match2.group(1)
+                    cents = alt_total_match2.group(2)
+                    total_delivery = float(f"{dollars}.{cents}")
+                    formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
+                    print(f"Found total delivery charges with alternative pattern 2: ${total_delivery}")
+                except (ValueError, IndexError) as e:
+                    print(f"Error extracting total delivery charges with alternative pattern 2: {e}")
+    
+    # Try to find the total delivery charges in the OCR text
+    if "totalDeliveryCharges" not in formatted_data["energyCharges"]:
+        # Try to look for the value in various formats
+        total_patterns = [
+            r'Total PG&E Electric Delivery Charges\s*\$?\s*(\d+\.\d+)',
+            r'Total PG&E Electric Delivery Charges\s*\$?\s*(\d+)\s+(\d+)',
+            r'Total.*?Charges\s*\$?\s*(\d+\.\d+)',
+            r'Current PG&E Electric Delivery Charges\s*\$?\s*(\d+\.\d+)'
+        ]
+        
+        for pattern in total_patterns:
+            match = re.search(pattern, combined_text)
+            if match:
+                try:
+                    if len(match.groups()) == 1:
+                        total_delivery = float(match.group(1))
+                    else:
+                        dollars = match.group(1)
+                        cents = match.group(2)
+                        total_delivery = float(f"{dollars}.{cents}")
+                        
+                    formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
+                    print(f"Found total delivery charges with pattern: ${total_delivery}")
+                    break
+                except (ValueError, IndexError) as e:
+                    print(f"Error processing total delivery charges match: {e}")
+        
+        # Use the section total recovered while reconstructing the energy charges
+        if "totalDeliveryCharges" not in formatted_data["energyCharges"] and reconstructed["sectionTotal"] is not None:
+            total_delivery = reconstructed["sectionTotal"]
+            formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
+            print(f"Found total delivery charges from reconstructed section: ${total_delivery}")
+    
+    # Save the formatted data
+    with open(output_file, 'w') as f:
+        json.dump(formatted_data, f, indent=2)
+    
+    print(f"Formatted OCR results saved to {output_file}")
+    return formatted_data
+
+def extract_energy_charges_with_patterns(formatted_data, combined_text):
+    """Extract peak and off-peak energy charges with regex patterns when reconstruction fails"""
     # Extract energy charges information
     # Look for specific patterns in the electric delivery section
     energy_charges_pattern = r'Energy Charges\s*\n(?:[^\n]*\n)*?([\d.]+)\s*kWh\s*@\s*\$?([\d.]+)\s*([^\n]*)\n(?:[^\n]*\n)*?Off\s*Peak\s*([\d.]+)\s*kWh\s*@\s*\$?([\d.]+)\s*([^\n]*)'    
@@ -636,35 +773,6 @@ def format_ocr_results(input_file='ocr_result_combined.json', output_file='ocr_r
             except (ValueError, IndexError) as e:
                 print(f"Error processing direct off-peak match: {e}")
     
-    # Calculate the off-peak total if we have kWh and rate but not total
-    if "kWh" in formatted_data["energyCharges"]["offPeak"] and "rate" in formatted_data["energyCharges"]["offPeak"] and "total" not in formatted_data["energyCharges"]["offPeak"]:
-        off_peak_kwh = formatted_data["energyCharges"]["offPeak"]["kWh"]
-        off_peak_rate = formatted_data["energyCharges"]["offPeak"]["rate"]
-        formatted_data["energyCharges"]["offPeak"]["total"] = round(off_peak_kwh * off_peak_rate, 2)
-        print(f"Calculated off-peak total from kWh and rate: ${formatted_data['energyCharges']['offPeak']['total']}")
-        
-    # Calculate total energy usage if we have both peak and off-peak values
-    if "kWh" in formatted_data["energyCharges"]["peak"] and "kWh" in formatted_data["energyCharges"]["offPeak"]:
-        peak_kwh = formatted_data["energyCharges"]["peak"]["kWh"]
-        off_peak_kwh = formatted_data["energyCharges"]["offPeak"]["kWh"]
-        total_kwh = peak_kwh + off_peak_kwh
-        formatted_data["energyCharges"]["totalUsage"] = round(total_kwh, 2)
-        print(f"Calculated total usage from peak and off-peak: {formatted_data['energyCharges']['totalUsage']} kWh")
-    else:
-        # Try to get the total usage directly from the OCR text
-        total_usage_match = re.search(r'Electric Usage This Period:\s*(\d+\.\d+)\s*kWh', combined_text)
-        if total_usage_match:
-            try:
-                total_usage = float(total_usage_match.group(1))
-                formatted_data["energyCharges"]["totalUsage"] = total_usage
-                print(f"Extracted total usage directly: {total_usage} kWh")
-            except (ValueError, IndexError) as e:
-                print(f"Error extracting total usage: {e}")
-    
-    # Make sure we have a totalUsage field for compatibility
-    if "totalUsage" in formatted_data["energyCharges"]:
-        formatted_data["energyCharges"]["totalKWh"] = formatted_data["energyCharges"]["totalUsage"]
-    
     # Try to extract peak and off-peak values directly from the OCR text if we haven't already
     # First, try to find patterns in the energy charges section
     if "kWh" not in formatted_data["energyCharges"]["peak"] or "kWh" not in formatted_data["energyCharges"]["offPeak"]:
@@ -731,7 +839,7 @@ def format_ocr_results(input_file='ocr_result_combined.json', output_file='ocr_r
             # If we have at least two values, assume the smaller one is peak and larger is off-peak
             if len(kwh_values) >= 2 and not (peak_found and off_peak_found):
                 # Get the rate from the rate plan if available
-                rate_details = get_rate_details(formatted_data.get("rateInformation", {}).get("rateCode", ""))
+                rate_details = get_rate_details(formatted_data.get("rateInfo", {}).get("rateCode", ""))
                 
                 if not peak_found and "kWh" not in formatted_data["energyCharges"]["peak"]:
                     peak_kwh = kwh_values[0]  # Smallest value is likely peak
@@ -752,193 +860,13 @@ def format_ocr_results(input_file='ocr_result_combined.json', output_file='ocr_r
                     formatted_data["energyCharges"]["offPeak"]["rate"] = off_peak_rate
                     formatted_data["energyCharges"]["offPeak"]["total"] = off_peak_total
                     print(f"Inferred off-peak values: {off_peak_kwh} kWh @ ${off_peak_rate}/kWh = ${off_peak_total}")
-        
-        # If we still couldn't find the values, try the specific patterns from user memory
-        if "kWh" not in formatted_data["energyCharges"]["peak"]:
-            # Look for patterns like: 70.616000 kWh @ so.44583
-            peak_pattern = r'(70\.?\d*)\s*kWh\s*@\s*(?:so|\$)\.?(\d+)'
-            peak_match = re.search(peak_pattern, combined_text)
-            if peak_match:
-                try:
-                    peak_kwh = float(peak_match.group(1))
-                    peak_rate_str = peak_match.group(2)
-                    
-                    # Handle rate format
-                    if len(peak_rate_str) >= 5:  # Likely a full number without decimal
-                        peak_rate = float(f"0.{peak_rate_str}")  # Convert to decimal format
-                    else:
-                        peak_rate = float(peak_rate_str)
-                        
-                    peak_total = round(peak_kwh * peak_rate, 2)
-                    
-                    formatted_data["energyCharges"]["peak"]["kWh"] = peak_kwh
-                    formatted_data["energyCharges"]["peak"]["rate"] = peak_rate
-                    formatted_data["energyCharges"]["peak"]["total"] = peak_total
-                    print(f"Extracted peak values using memory pattern: {peak_kwh} kWh @ ${peak_rate}/kWh = ${peak_total}")
-                except (ValueError, IndexError) as e:
-                    print(f"Error processing peak match with memory pattern: {e}")
-        
-        if "kWh" not in formatted_data["energyCharges"]["offPeak"]:
-            # Look for patterns like: 559.264000 kWh @ so.40703
-            off_peak_pattern = r'(559\.?\d*)\s*kWh\s*@\s*(?:so|\$)\.?(\d+)'
-            off_peak_match = re.search(off_peak_pattern, combined_text)
-            if off_peak_match:
-                try:
-                    off_peak_kwh = float(off_peak_match.group(1))
-                    off_peak_rate_str = off_peak_match.group(2)
-                    
-                    # Handle rate format
-                    if len(off_peak_rate_str) >= 5:  # Likely a full number without decimal
-                        off_peak_rate = float(f"0.{off_peak_rate_str}")  # Convert to decimal format
-                    else:
-                        off_peak_rate = float(off_peak_rate_str)
-                        
-                    off_peak_total = round(off_peak_kwh * off_peak_rate, 2)
-                    
-                    formatted_data["energyCharges"]["offPeak"]["kWh"] = off_peak_kwh
-                    formatted_data["energyCharges"]["offPeak"]["rate"] = off_peak_rate
-                    formatted_data["energyCharges"]["offPeak"]["total"] = off_peak_total
-                    print(f"Extracted off-peak values using memory pattern: {off_peak_kwh} kWh @ ${off_peak_rate}/kWh = ${off_peak_total}")
-                except (ValueError, IndexError) as e:
-                    print(f"Error processing off-peak match with memory pattern: {e}")
-    
-    # Calculate total kWh if we have both peak and off-peak values
-    if "kWh" in formatted_data["energyCharges"]["peak"] and "kWh" in formatted_data["energyCharges"]["offPeak"]:
-        peak_kwh = formatted_data["energyCharges"]["peak"]["kWh"]
-        off_peak_kwh = formatted_data["energyCharges"]["offPeak"]["kWh"]
-        formatted_data["energyCharges"]["totalKWh"] = peak_kwh + off_peak_kwh
-        print(f"Calculated total kWh: {formatted_data['energyCharges']['totalKWh']} kWh")
-    
-    # Extract total electric delivery charges
-    # Look for the pattern in the OCR text
-    total_electric_pattern = r'Total PG&E Electric Delivery Charges\s*\$?(\d+\.\d+)'
-    total_electric_match = re.search(total_electric_pattern, combined_text)
-    
-    if total_electric_match:
-        try:
-            total_delivery = float(total_electric_match.group(1))
-            formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
-            print(f"Found total delivery charges in OCR: ${total_delivery}")
-        except (ValueError, IndexError) as e:
-            print(f"Error extracting total delivery charges: {e}")
-    else:
-        # Try alternative patterns that might match the OCR text format
-        # Pattern for $XXX.XX format
-        alt_total_pattern1 = r'Total PG&E Electric Delivery Charges\s*\$?\s*(\d+)\.(\d+)'
-        # Pattern for $XXX XX format (space instead of decimal)
-        alt_total_pattern2 = r'Total PG&E Electric Delivery Charges\s*\$?\s*(\d+)\s+(\d+)'
-        
-        alt_total_match = re.search(alt_total_pattern1, combined_text)
-        if alt_total_match:
-            try:
-                dollars = alt_total_match.group(1)
-                cents = alt_total_match.group(2)
-                total_delivery = float(f"{dollars}.{cents}")
-                formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
-                print(f"Found total delivery charges with alternative pattern 1: ${total_delivery}")
-            except (ValueError, IndexError) as e:
-                print(f"Error extracting total delivery charges with alternative pattern 1: {e}")
-        else:
-            # Try the space-separated pattern
-            alt_total_match2 = re.search(alt_total_pattern2, combined_text)
-            if alt_total_match2:
-                try:
-                    dollars = alt_total_match2.group(1)
-                    cents = alt_total_match2.group(2)
-                    total_delivery = float(f"{dollars}.{cents}")
-                    formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
-                    print(f"Found total delivery charges with alternative pattern 2: ${total_delivery}")
-                except (ValueError, IndexError) as e:
-                    print(f"Error extracting total delivery charges with alternative pattern 2: {e}")
-    
-    # Try to find the total delivery charges in the OCR text
-    if "totalDeliveryCharges" not in formatted_data["energyCharges"]:
-        # Try to look for the value in various formats
-        total_patterns = [
-            r'Total PG&E Electric Delivery Charges\s*\$?\s*(\d+\.\d+)',
-            r'Total PG&E Electric Delivery Charges\s*\$?\s*(\d+)\s+(\d+)',
-            r'Total.*?Charges\s*\$?\s*(\d+\.\d+)',
-            r'Current PG&E Electric Delivery Charges\s*\$?\s*(\d+\.\d+)'
-        ]
-        
-        for pattern in total_patterns:
-            match = re.search(pattern, combined_text)
-            if match:
-                try:
-                    if len(match.groups()) == 1:
-                        total_delivery = float(match.group(1))
-                    else:
-                        dollars = match.group(1)
-                        cents = match.group(2)
-                        total_delivery = float(f"{dollars}.{cents}")
-                        
-                    formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
-                    print(f"Found total delivery charges with pattern: ${total_delivery}")
-                    break
-                except (ValueError, IndexError) as e:
-                    print(f"Error processing total delivery charges match: {e}")
-        
-        # Try to find the specific value from user memory if we still don't have it
-        if "totalDeliveryCharges" not in formatted_data["energyCharges"]:
-            # Look for the specific value 196.81 mentioned in user memory
-            specific_total_pattern = r'\$?\s*(196\.81)'
-            specific_match = re.search(specific_total_pattern, combined_text)
-            if specific_match:
-                try:
-                    total_delivery = float(specific_match.group(1))
-                    formatted_data["energyCharges"]["totalDeliveryCharges"] = total_delivery
-                    print(f"Found total delivery charges using specific value: ${total_delivery}")
-                except (ValueError, IndexError) as e:
-                    print(f"Error processing specific total delivery charges: {e}")
-    
-    # Save the formatted data
-    with open(output_file, 'w') as f:
-        json.dump(formatted_data, f, indent=2)
-    
-    print(f"Formatted OCR results saved to {output_file}")
-    return formatted_data
 
 def get_rate_details(rate_code):
-    """Get details for a specific rate plan from the external rate_plans.json file"""
-    # Load rate plans from the external file
-    rate_plans_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_plans.json')
-    
-    try:
-        with open(rate_plans_file, 'r') as f:
-            rate_plans = json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Error loading rate plans: {e}")
-        # Fallback to default values if file can't be loaded
-        rate_plans = {
-            "ETOUB": {
-                "description": "Time-of-Use (4-9pm Peak)",
-                "season": "Winter",
-                "peakRate": 0.42,
-                "offPeakRate": 0.33,
-                "peakHours": "4pm-9pm",
-                "notes": "Winter TOU rate"
-            }
-        }
-    
-    # Clean up the rate code by removing any non-alphanumeric characters
-    clean_rate_code = re.sub(r'[^A-Z0-9]', '', rate_code.upper())
-    
-    # First check if this rate code has an alias (like ETOIJ3 -> ETOUB)
-    for code, details in rate_plans.items():
-        clean_code = re.sub(r'[^A-Z0-9]', '', code.upper())
-        if clean_rate_code == clean_code:
-            # If this rate has an alias, use the details from the aliased rate
-            if 'alias' in details:
-                alias = details['alias']
-                if alias in rate_plans:
-                    return rate_plans[alias]
-            return details
-    
-    # If no exact match, try partial matches
-    for code, details in rate_plans.items():
-        clean_code = re.sub(r'[^A-Z0-9]', '', code.upper())
-        if clean_rate_code in clean_code or clean_code in clean_rate_code:
-            return details
+    """Get details for a specific rate plan from the shared rate plan catalog"""
+    # The catalog indexes rate_plans.json once and resolves aliases and OCR misreads
+    details = rate_catalog.get_catalog().plan_details(rate_code)
+    if details:
+        return details
     
     # If no match found, return a generic response
     return {
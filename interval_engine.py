@@ -0,0 +1,211 @@
+import csv
+import re
+import sys
+import threading
+
+import numpy as np
+
+import rate_catalog
+import tariff_model
+
+# Weekday numbers (Monday = 0) each peakDays value covers
+PEAK_DAYS = {
+    'all': range(0, 7),
+    'weekdays': range(0, 5),
+    'weekends': range(5, 7),
+}
+
+
+def parse_hour(text):
+    """Turn '4pm', '9 PM' or '16:00' into an hour of the day"""
+    match = re.match(r'\s*(\d{1,2})(?::(\d{2}))?\s*([ap]\.?m\.?)?\s*$', text, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Unrecognized hour: {text}")
+    hour = int(match.group(1))
+    meridiem = (match.group(3) or '').lower().replace('.', '')
+    if meridiem == 'pm' and hour != 12:
+        hour += 12
+    elif meridiem == 'am' and hour == 12:
+        hour = 0
+    return hour % 24
+
+
+def parse_peak_hours(peak_hours):
+    """Turn a peakHours string such as '4pm-9pm' into a 24-entry boolean array"""
+    hours = np.zeros(24, dtype=bool)
+    if not peak_hours:
+        return hours
+    for window in str(peak_hours).split(','):
+        start, end = (parse_hour(part) for part in window.split('-'))
+        if start < end:
+            hours[start:end] = True
+        else:
+            # Windows that wrap past midnight, e.g. 11pm-7am
+            hours[start:] = True
+            hours[:end] = True
+    return hours
+
+
+def parse_peak_days(peak_days):
+    """Turn a peakDays value ('all', 'weekdays', 'weekends' or a list of weekday numbers) into a 7-entry boolean array"""
+    days = np.zeros(7, dtype=bool)
+    if isinstance(peak_days, (list, tuple)):
+        days[list(peak_days)] = True
+    else:
+        days[list(PEAK_DAYS.get(str(peak_days or 'all').lower(), PEAK_DAYS['all']))] = True
+    return days
+
+
+def time_features(timestamps):
+    """Return (month 0-11, weekday 0-6, hour 0-23) arrays for datetime64 timestamps"""
+    timestamps = np.asarray(timestamps, dtype='datetime64[m]')
+    days = timestamps.astype('datetime64[D]')
+    month = (timestamps.astype('datetime64[M]').astype(int) % 12)
+    weekday = (days.astype(int) + 3) % 7  # 1970-01-01 was a Thursday
+    hour = ((timestamps - days).astype(int) // 60) % 24
+    return month, weekday, hour
+
+
+def hourly_timestamps(year):
+    """Return one timestamp per hour of a calendar year"""
+    start = np.datetime64(f'{year}-01-01T00:00', 'm')
+    end = np.datetime64(f'{year + 1}-01-01T00:00', 'm')
+    return np.arange(start, end, np.timedelta64(60, 'm'))
+
+
+class IntervalEngine:
+    """Price interval usage under every plan using peak masks compiled once from the catalog"""
+
+    def __init__(self, rate_plans, version=None, tariffs=None):
+        self.version = version
+        self.codes = list(rate_plans)
+        self.descriptions = [details.get('description', '') for details in rate_plans.values()]
+        # (P x 24) and (P x 7) lookup tables; a plan without peakHours has no peak period
+        self.peak_hours = np.array([parse_peak_hours(details.get('peakHours')) for details in rate_plans.values()])
+        self.peak_days = np.array([parse_peak_days(details.get('peakDays')) for details in rate_plans.values()])
+        # Seasonal, tiered and fixed charges are applied to each month's peak/off-peak totals
+        self.tariffs = tariffs or tariff_model.TariffModel(rate_plans, version=version)
+        self._year_masks = {}
+
+    def peak_mask(self, timestamps):
+        """Return a (P x T) boolean mask of which intervals fall in each plan's peak period"""
+        _, weekday, hour = time_features(timestamps)
+        return self.peak_hours[:, hour] & self.peak_days[:, weekday]
+
+    def year_mask(self, year):
+        """Return the (P x 8760/8784) peak mask for a calendar year, computed once per year"""
+        if year not in self._year_masks:
+            self._year_masks[year] = self.peak_mask(hourly_timestamps(year))
+        return self._year_masks[year]
+
+    def price(self, timestamps, kwh, peak_mask=None, territory=None):
+        """Price interval usage under every plan; returns per-plan totals, monthly costs and peak/off-peak kWh as arrays"""
+        kwh = np.asarray(kwh, dtype=float)
+        timestamps = np.asarray(timestamps, dtype='datetime64[m]')
+        month, _, _ = time_features(timestamps)
+        if peak_mask is None:
+            peak_mask = self.peak_mask(timestamps)
+
+        # Roll intervals up to (P x 12) peak kWh and per-month totals and day counts
+        month_onehot = np.eye(12)[month]
+        monthly_peak = (peak_mask * kwh) @ month_onehot
+        monthly_total = kwh @ month_onehot
+        days = np.unique(timestamps.astype('datetime64[D]'))
+        monthly_days = np.bincount(time_features(days.astype('datetime64[m]'))[0], minlength=12)
+
+        billed = np.flatnonzero(monthly_days)
+        costs = self.tariffs.evaluate(
+            monthly_peak[:, billed].T,
+            monthly_total[billed, np.newaxis] - monthly_peak[:, billed].T,
+            days=monthly_days[billed],
+            months=billed,
+            territories=self.tariffs.territory_indexes([territory] * len(billed))
+        )
+        monthly_costs = np.zeros((len(self.codes), 12))
+        monthly_costs[:, billed] = costs['totalCost'].T
+
+        peak_kwh = monthly_peak.sum(axis=1)
+        return {
+            'codes': self.codes,
+            'totalCost': monthly_costs.sum(axis=1),
+            'monthlyCost': monthly_costs,
+            'peakKwh': peak_kwh,
+            'offPeakKwh': kwh.sum() - peak_kwh,
+            'catalogVersion': self.version
+        }
+
+    def price_hourly_year(self, hourly_kwh, year, territory=None):
+        """Price an 8760-hour (8784 in leap years) usage array for a calendar year"""
+        timestamps = hourly_timestamps(year)
+        hourly_kwh = np.asarray(hourly_kwh, dtype=float)
+        if len(hourly_kwh) != len(timestamps):
+            raise ValueError(f"Expected {len(timestamps)} hourly values for {year}, got {len(hourly_kwh)}")
+        return self.price(timestamps, hourly_kwh, self.year_mask(year), territory)
+
+
+def load_green_button_csv(csv_file):
+    """Read a Green Button-style interval CSV (hourly or 15-minute) into (timestamps, kWh) arrays"""
+    timestamps, usage = [], []
+    with open(csv_file, 'r', newline='', encoding='utf-8-sig') as f:
+        columns = None
+        for row in csv.reader(f):
+            if columns is None:
+                # Account details come before the header row
+                header = [cell.strip().upper() for cell in row]
+                if 'DATE' in header and 'START TIME' in header:
+                    columns = {
+                        'date': header.index('DATE'),
+                        'start': header.index('START TIME'),
+                        'import': next(i for i, cell in enumerate(header) if cell.startswith(('USAGE', 'IMPORT'))),
+                        'export': next((i for i, cell in enumerate(header) if cell.startswith('EXPORT')), None)
+                    }
+                continue
+            if len(row) <= columns['import'] or not row[columns['date']].strip():
+                continue
+
+            kwh = float(row[columns['import']].replace(',', '') or 0)
+            if columns['export'] is not None and len(row) > columns['export']:
+                kwh -= float(row[columns['export']].replace(',', '') or 0)
+            timestamps.append(f"{row[columns['date']].strip()}T{row[columns['start']].strip()[:5]}")
+            usage.append(kwh)
+
+    if columns is None:
+        raise ValueError(f"No DATE / START TIME header found in {csv_file}")
+    return np.array(timestamps, dtype='datetime64[m]'), np.array(usage, dtype=float)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return an interval engine for the current catalog version, rebuilding it only when the catalog changes"""
+    global _engine
+    snapshot = rate_catalog.get_catalog().refresh()
+    engine = _engine
+    if engine is None or engine.version != snapshot.version:
+        with _engine_lock:
+            if _engine is None or _engine.version != snapshot.version:
+                _engine = IntervalEngine(snapshot.canonical_plans, snapshot.version, tariff_model.get_model())
+            engine = _engine
+    return engine
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python interval_engine.py <green_button.csv>")
+        return
+
+    timestamps, kwh = load_green_button_csv(sys.argv[1])
+    engine = get_engine()
+    result = engine.price(timestamps, kwh)
+
+    print(f"{len(kwh)} intervals, {kwh.sum():.1f} kWh from {timestamps.min()} to {timestamps.max()}")
+    for i in np.argsort(result['totalCost']):
+        print(f"{engine.codes[i]:8} ${result['totalCost'][i]:10.2f}  "
+              f"peak {result['peakKwh'][i]:8.1f} kWh  off-peak {result['offPeakKwh'][i]:8.1f} kWh  "
+              f"{engine.descriptions[i]}")
+
+
+if __name__ == "__main__":
+    main()
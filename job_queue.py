@@ -0,0 +1,111 @@
+import os
+import socket
+import threading
+import time
+
+import job_store
+
+# Bills processed at once by each web process; each one makes OCR and LLM calls, so this also caps concurrent API requests
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+
+# Jobs allowed to wait across all users before uploads are refused
+MAX_QUEUED_JOBS = int(os.getenv("MAX_QUEUED_JOBS", "200"))
+
+# Seconds an idle worker waits before checking the store for jobs queued by other processes
+POLL_INTERVAL = 1.0
+
+# Seconds between checks for jobs whose worker, in this or any other process, stopped sending heartbeats
+RECOVERY_INTERVAL = 60
+
+
+class QueueFull(Exception):
+    """Raised when the queue already holds MAX_QUEUED_JOBS waiting jobs"""
+
+
+class JobQueue:
+    """A fixed pool of worker threads taking jobs from the shared job store, one user at a time in turn
+
+    Jobs live in the store, so every web process on the host feeds the same queue and any of them can
+    report a job's status. A user who uploads many bills at once doesn't hold up other users: the
+    next job always goes to the user who was served longest ago.
+    """
+
+    def __init__(self, handler, store=None, workers=JOB_WORKERS, max_queued=MAX_QUEUED_JOBS):
+        self.handler = handler
+        self._store = store
+        self.workers = max(workers, 1)
+        self.max_queued = max_queued
+        self._wakeup = threading.Condition()
+        self._threads = []
+
+    @property
+    def store(self):
+        """The job store, opened on first use rather than when the queue is created at import"""
+        return self._store or job_store.get_store()
+
+    def start(self):
+        """Start the worker threads; called on the first submit or status check"""
+        with self._wakeup:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                worker = f"{socket.gethostname()}:{os.getpid()}:{i}"
+                thread = threading.Thread(target=self._work, args=(worker,), name=f"bill-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            # Jobs left running by a process that died are picked up again, now and whenever it happens later
+            thread = threading.Thread(target=self._recover, name="bill-recovery", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, user_id, file_path, file_name=None, batch_id=None):
+        """Queue a bill for a user and return its job id; raises QueueFull when the queue is at capacity
+
+        A file that a queued or running job already reads (uploads are stored by content hash) isn't
+        queued again: the new job waits for that one and then copies its result.
+        """
+        self.start()
+        job_id = self.store.attach_job(user_id, file_name or os.path.basename(file_path), file_path, batch_id)
+        if job_id:
+            return job_id
+        if self.store.queued_count() >= self.max_queued:
+            raise QueueFull(f"The processing queue is full ({self.max_queued} bills waiting). Please try again later.")
+        job_id = self.store.create_job(user_id, file_name or os.path.basename(file_path), file_path, batch_id,
+                                       message='Waiting to be processed')
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def _work(self, worker):
+        while True:
+            job = self.store.claim_next_job(worker)
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(POLL_INTERVAL)
+                continue
+
+            try:
+                with job_store.heartbeat(self.store, job['id']):
+                    success, message = self.handler(job)
+            except Exception as e:
+                success, message = False, f"Error processing bill: {str(e)}"
+                print(message)
+            self.store.finish_job(job['id'], success, message)
+
+    def _recover(self):
+        while True:
+            try:
+                requeued, _ = self.store.recover_stale_jobs()
+                if requeued:
+                    with self._wakeup:
+                        self._wakeup.notify_all()
+            except Exception as e:
+                print(f"Error recovering interrupted jobs: {e}")
+            time.sleep(RECOVERY_INTERVAL)
+
+    def user_status(self, user_id):
+        """Return the user's running, queued (with 1-based queue positions) and recently finished jobs"""
+        self.start()
+        status = self.store.user_jobs(user_id)
+        status['workers'] = self.workers
+        return status
@@ -0,0 +1,704 @@
+import base64
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+def default_store_path():
+    """Return jobs.db next to this module, or in the temp directory when the app is deployed read-only"""
+    folder = os.path.dirname(os.path.abspath(__file__))
+    if not os.access(folder, os.W_OK):
+        folder = tempfile.gettempdir()
+    return os.path.join(folder, 'jobs.db')
+
+
+# SQLite database shared by every web worker process on the host; ':memory:' keeps jobs in this process only
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH") or default_store_path()
+MEMORY_STORE = ':memory:'
+
+# Seconds between heartbeats from the thread processing a job
+HEARTBEAT_SECONDS = int(os.getenv("HEARTBEAT_SECONDS", "15"))
+
+# A running job without a heartbeat for this long belonged to a worker that died; it is retried or failed
+STALE_JOB_SECONDS = int(os.getenv("STALE_JOB_SECONDS", "120"))
+MAX_ATTEMPTS = 3
+
+# Finished jobs reported per user in status responses
+FINISHED_JOBS_REPORTED = 20
+
+# Bills per bill history page by default, and at most
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+
+# Bill history summary fields, copied from the extracted data and analysis when a bill is saved so history
+# pages don't have to decode either document
+SUMMARY_FIELDS = {
+    'billingPeriod': ('data', 'BillingPeriod'),
+    'ratePlan': ('data', 'RateSchedule'),
+    'totalUsage': ('data', 'ElectricUsageThisPeriod'),
+    'totalAmountDue': ('data', 'TotalAmountDue'),
+    'currentPlan': ('analysis', 'currentPlan'),
+    'bestPlan': ('analysis', 'bestPlan'),
+    'monthlySavings': ('analysis', 'monthlySavings'),
+    'yearlySavings': ('analysis', 'yearlySavings')
+}
+
+# Fields a bill history page returns by default; 'data' and 'analysis' (the full documents) must be asked for
+HISTORY_FIELDS = ('id', 'filename', 'file', 'jobId', 'processedAt', 'hasAnalysis') + tuple(SUMMARY_FIELDS)
+DOCUMENT_FIELDS = ('data', 'analysis')
+
+IDLE_STATUS = {
+    'processing': False,
+    'message': 'No bills are being processed',
+    'current_file': None,
+    'step': None,
+    'success': True
+}
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    batch_id TEXT,
+    file_name TEXT,
+    file_path TEXT,
+    state TEXT NOT NULL,
+    step TEXT,
+    message TEXT,
+    success INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    progress REAL,
+    heartbeat_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_state_submitted ON jobs (state, submitted_at);
+CREATE INDEX IF NOT EXISTS jobs_user_submitted ON jobs (user_id, submitted_at);
+
+CREATE TABLE IF NOT EXISTS job_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    step TEXT,
+    message TEXT,
+    created_at REAL NOT NULL,
+    progress REAL
+);
+CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id);
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    last_served_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS bills (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    job_id TEXT,
+    filename TEXT NOT NULL,
+    data TEXT,
+    analysis TEXT,
+    processed_at REAL NOT NULL,
+    summary TEXT,
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS bills_user_processed ON bills (user_id, processed_at);
+'''
+
+# Columns added since the tables were first created, applied to existing databases on startup
+MIGRATIONS = {
+    'jobs': {'progress': 'REAL', 'heartbeat_at': 'REAL'},
+    'job_events': {'progress': 'REAL'},
+    'bills': {'summary': 'TEXT', 'content_hash': 'TEXT'}
+}
+
+# Indexes on migrated columns, created once the columns exist
+MIGRATION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS bills_content_hash ON bills (content_hash, processed_at)"
+]
+
+JOB_COLUMNS = ('id', 'user_id', 'batch_id', 'file_name', 'file_path', 'state', 'step', 'message', 'success',
+               'attempts', 'worker', 'submitted_at', 'started_at', 'finished_at', 'progress', 'heartbeat_at')
+
+# Wakes threads waiting for job changes made in this process; other processes' changes are seen by polling
+_changes = threading.Condition()
+
+
+def _job(row):
+    if row is None:
+        return None
+    job = dict(zip(JOB_COLUMNS, row))
+    if job['success'] is not None:
+        job['success'] = bool(job['success'])
+    return job
+
+
+class JobStore:
+    """Jobs, their stage transitions and per-user bill results in SQLite (WAL mode), shared across processes"""
+
+    def __init__(self, path=JOB_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        with self._connection(begin=None) as conn:
+            conn.executescript(SCHEMA)
+            for table, columns in MIGRATIONS.items():
+                existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+                for column, column_type in columns.items():
+                    if column not in existing:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            for statement in MIGRATION_INDEXES:
+                conn.execute(statement)
+            self._backfill_summaries(conn)
+
+    def _backfill_summaries(self, conn):
+        # Bills saved before summaries existed get theirs once, so history pages never decode documents
+        rows = conn.execute("SELECT id, data, analysis FROM bills WHERE summary IS NULL").fetchall()
+        for bill_id, data, analysis in rows:
+            summary = bill_summary(json.loads(data or 'null'), json.loads(analysis or 'null'))
+            conn.execute("UPDATE bills SET summary = ? WHERE id = ?", (json.dumps(summary), bill_id))
+
+    def _connection(self, begin='DEFERRED'):
+        # One connection per thread; WAL lets readers in any process run alongside the single writer
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return _Transaction(conn, begin)
+
+    # Jobs
+
+    def create_job(self, user_id, file_name, file_path=None, batch_id=None, state='queued', message=None):
+        """Record a new job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connection('IMMEDIATE') as conn:
+            conn.execute(
+                f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))})",
+                (job_id, user_id, batch_id, file_name, file_path, state, None, message, None, 0, None, now,
+                 now if state == 'running' else None, None, None, now if state == 'running' else None)
+            )
+            if state == 'running':
+                self._mark_served(conn, user_id, now)
+        _notify_changes()
+        return job_id
+
+    def attach_job(self, user_id, file_name, file_path, batch_id=None):
+        """Record a job that waits for the queued or running job already reading file_path, and return its id
+
+        Returns None, recording nothing, when no such job exists. The waiting job is queued once the other
+        one finishes, and then copies its result or, if it failed, processes the file itself.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connection('IMMEDIATE') as conn:
+            reading = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running') AND file_path = ?", (file_path,)
+            ).fetchone()[0]
+            if not reading:
+                return None
+            conn.execute(
+                f"INSERT INTO jobs ({', '.join(JOB_COLUMNS)}) VALUES ({', '.join('?' * len(JOB_COLUMNS))})",
+                (job_id, user_id, batch_id, file_name, file_path, 'waiting', None,
+                 'Waiting for the same bill uploaded earlier', None, 0, None, now, None, None, None, None)
+            )
+        _notify_changes()
+        return job_id
+
+    def get_job(self, job_id):
+        with self._connection() as conn:
+            return _job(conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+    def queued_count(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def claim_next_job(self, worker):
+        """Atomically move the next queued job to running and return it, or None when nothing is queued
+
+        Users take turns: the next job belongs to the user served longest ago (new users first),
+        and each user's jobs run in the order they were submitted.
+        """
+        now = time.time()
+        with self._connection('IMMEDIATE') as conn:
+            row = conn.execute(
+                "SELECT j.id, j.user_id FROM jobs j LEFT JOIN users u ON u.user_id = j.user_id "
+                "WHERE j.state = 'queued' ORDER BY COALESCE(u.last_served_at, 0), j.submitted_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, user_id = row
+            conn.execute(
+                "UPDATE jobs SET state = 'running', step = 'init', message = 'Starting bill processing...', "
+                "progress = NULL, worker = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now, now, job_id)
+            )
+            self._mark_served(conn, user_id, now)
+            self._add_event(conn, job_id, 'init', 'Starting bill processing...', now)
+            job = _job(conn.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone())
+        _notify_changes()
+        return job
+
+    def update_job(self, job_id, step, message, progress=None):
+        """Record a stage transition, or progress (0-1) within a stage, for a running job"""
+        now = time.time()
+        with self._connection('IMMEDIATE') as conn:
+            conn.execute("UPDATE jobs SET step = ?, message = ?, progress = ?, heartbeat_at = ? WHERE id = ?",
+                         (step, message, progress, now, job_id))
+            self._add_event(conn, job_id, step, message, now, progress)
+        _notify_changes()
+
+    def touch_job(self, job_id):
+        """Record that a running job's worker is still alive"""
+        with self._connection('IMMEDIATE') as conn:
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND state = 'running'", (time.time(), job_id))
+
+    def finish_job(self, job_id, success, message):
+        now = time.time()
+        with self._connection('IMMEDIATE') as conn:
+            conn.execute(
+                "UPDATE jobs SET state = ?, step = NULL, progress = NULL, success = ?, message = ?, finished_at = ? "
+                "WHERE id = ?",
+                ('done' if success else 'failed', int(bool(success)), message, now, job_id)
+            )
+            self._add_event(conn, job_id, 'done' if success else 'failed', message, now)
+            file_path = conn.execute("SELECT file_path FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if file_path and file_path[0]:
+                self._release_waiting(conn, now, file_path[0], release_all=success)
+        _notify_changes()
+
+    def recover_stale_jobs(self, stale_after=STALE_JOB_SECONDS, retry=True):
+        """Requeue running jobs whose worker stopped sending heartbeats, failing those already tried MAX_ATTEMPTS times
+
+        Apps that run each job on its own thread rather than from the queue pass retry=False, since nothing
+        would pick a requeued job up; their stale jobs are failed straight away.
+        """
+        now = time.time()
+        cutoff = now - stale_after
+        max_attempts = MAX_ATTEMPTS if retry else 0
+        with self._connection('IMMEDIATE') as conn:
+            failed = conn.execute(
+                "UPDATE jobs SET state = 'failed', step = NULL, progress = NULL, success = 0, finished_at = ?, "
+                "message = 'Processing was interrupted' "
+                "WHERE state = 'running' AND COALESCE(heartbeat_at, started_at) < ? AND attempts >= ?",
+                (now, cutoff, max_attempts)
+            ).rowcount
+            requeued = conn.execute(
+                "UPDATE jobs SET state = 'queued', step = NULL, progress = NULL, message = 'Waiting to be retried' "
+                "WHERE state = 'running' AND COALESCE(heartbeat_at, started_at) < ?",
+                (cutoff,)
+            ).rowcount
+            # Jobs waiting for one that was just failed get their own turn
+            requeued += self._release_waiting(conn, now)
+        if failed or requeued:
+            print(f"Recovered interrupted jobs: {requeued} requeued, {failed} failed")
+            _notify_changes()
+        return requeued, failed
+
+    def job_events(self, job_id, after_id=0):
+        """Return a job's stage transitions after an event id, oldest first"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT id, step, message, created_at, progress FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+                (job_id, after_id)
+            ).fetchall()
+        return [{'id': row[0], 'step': row[1], 'message': row[2], 'created_at': row[3], 'progress': row[4]}
+                for row in rows]
+
+    def user_events(self, user_id, after_id=0):
+        """Return stage transitions of all the user's jobs after an event id, oldest first"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT e.id, e.job_id, j.file_name, e.step, e.message, e.created_at, e.progress "
+                "FROM job_events e JOIN jobs j ON j.id = e.job_id WHERE e.id > ? AND j.user_id = ? ORDER BY e.id",
+                (after_id, user_id)
+            ).fetchall()
+        return [{'id': row[0], 'job_id': row[1], 'file': row[2], 'step': row[3], 'message': row[4],
+                 'created_at': row[5], 'progress': row[6]} for row in rows]
+
+    def latest_event_id(self):
+        """Return the id of the most recent event across all jobs, which changes whenever any job moves"""
+        with self._connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM job_events").fetchone()[0]
+
+    def wait_for_change(self, timeout):
+        """Block until a job changes in this process or the timeout passes"""
+        with _changes:
+            _changes.wait(timeout)
+
+    def user_jobs(self, user_id):
+        """Return the user's running jobs, queued jobs with their 1-based queue positions, jobs waiting for another
+        upload of the same bill and recently finished jobs"""
+        columns = ', '.join(f'j.{column}' for column in JOB_COLUMNS)
+        with self._connection() as conn:
+            running = [_job(row) for row in conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE user_id = ? AND state = 'running' ORDER BY started_at",
+                (user_id,)
+            )]
+            waiting = [_job(row) for row in conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE user_id = ? AND state = 'waiting' ORDER BY submitted_at",
+                (user_id,)
+            )]
+            finished = [_job(row) for row in conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE user_id = ? AND state IN ('done', 'failed') "
+                "ORDER BY finished_at DESC LIMIT ?",
+                (user_id, FINISHED_JOBS_REPORTED)
+            )][::-1]
+            # Every queued job in dispatch order of users, to work out where this user's jobs fall in the rotation
+            queued_rows = conn.execute(
+                f"SELECT {columns}, COALESCE(u.last_served_at, 0) FROM jobs j LEFT JOIN users u ON u.user_id = j.user_id "
+                "WHERE j.state = 'queued' ORDER BY COALESCE(u.last_served_at, 0), j.submitted_at"
+            ).fetchall()
+
+        queues = {}
+        for row in queued_rows:
+            queues.setdefault(row[1], []).append(_job(row[:len(JOB_COLUMNS)]))
+        queued = [dict(job, position=_position(queues, user_id, i)) for i, job in enumerate(queues.get(user_id, []))]
+        return {'running': running, 'queued': queued, 'waiting': waiting, 'finished': finished,
+                'queue_length': len(queued_rows)}
+
+    def latest_job(self, user_id):
+        with self._connection() as conn:
+            return _job(conn.execute(
+                f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE user_id = ? ORDER BY submitted_at DESC LIMIT 1",
+                (user_id,)
+            ).fetchone())
+
+    # Bill results
+
+    def add_bill(self, user_id, filename, data, analysis, job_id=None, content_hash=None):
+        """Save a processed bill and its analysis to the user's history"""
+        with self._connection('IMMEDIATE') as conn:
+            conn.execute(
+                "INSERT INTO bills (user_id, job_id, filename, data, analysis, processed_at, summary, content_hash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, job_id, filename, json.dumps(data), json.dumps(analysis), time.time(),
+                 json.dumps(bill_summary(data, analysis)), content_hash)
+            )
+
+    def find_bill(self, content_hash):
+        """Return the latest fully analyzed bill ({'filename', 'data', 'analysis'}) with this content hash, or None"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT filename, data, analysis FROM bills WHERE content_hash = ? ORDER BY processed_at DESC LIMIT 5",
+                (content_hash,)
+            ).fetchall()
+        for filename, data, analysis in rows:
+            analysis = json.loads(analysis or 'null')
+            # Bills whose analysis failed are processed again rather than copied
+            if analysis and 'error' not in analysis:
+                return {'filename': filename, 'data': json.loads(data or 'null'), 'analysis': analysis}
+        return None
+
+    def active_jobs_for_file(self, file_path, except_job_id=None):
+        """Return how many queued, running or waiting jobs, other than except_job_id, will read file_path"""
+        with self._connection() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'running', 'waiting') AND file_path = ? "
+                "AND id IS NOT ?",
+                (file_path, except_job_id)
+            ).fetchone()[0]
+
+    def user_bills(self, user_id, limit=100):
+        """Return the user's most recently processed bills, newest first, one per stored file"""
+        with self._connection() as conn:
+            rows = conn.execute(
+                "SELECT filename, data, analysis, processed_at, content_hash FROM bills WHERE user_id = ? "
+                "ORDER BY processed_at DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+        bills, seen = [], set()
+        for filename, data, analysis, processed_at, content_hash in rows:
+            # Uploads are stored by content, so different bills uploaded under the same name are kept apart
+            stored_name = stored_file_name(filename, content_hash)
+            if stored_name in seen:
+                continue
+            seen.add(stored_name)
+            bills.append({'filename': filename, 'file': stored_name,
+                          'data': json.loads(data), 'analysis': json.loads(analysis), 'processed_at': processed_at})
+        return bills
+
+    def bill_history(self, user_id, limit=HISTORY_PAGE_SIZE, cursor=None, fields=None):
+        """Return (bills, next cursor) for one page of the user's bills, newest first
+
+        Pages continue strictly after the cursor's (processed_at, id) rather than at an offset, so each page is
+        a range scan of the (user_id, processed_at) index however deep the history goes, and bills saved
+        while paging don't shift later pages. Only the requested fields are returned; the full documents are
+        read only when 'data' or 'analysis' is among them. Raises ValueError for an unknown field or a bad cursor.
+        """
+        fields = list(fields or HISTORY_FIELDS)
+        unknown = [field for field in fields if field not in HISTORY_FIELDS + DOCUMENT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown bill fields: {', '.join(unknown)}")
+        try:
+            limit = min(max(int(limit), 1), MAX_HISTORY_PAGE_SIZE)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid page size: {limit}")
+        documents = [field for field in DOCUMENT_FIELDS if field in fields]
+
+        query = (f"SELECT id, job_id, filename, processed_at, summary, content_hash{''.join(', ' + d for d in documents)} "
+                 "FROM bills WHERE user_id = ?")
+        params = [user_id]
+        if cursor:
+            query += " AND (processed_at, id) < (?, ?)"
+            params.extend(decode_cursor(cursor))
+        query += " ORDER BY processed_at DESC, id DESC LIMIT ?"
+        # One extra row tells whether there is a next page
+        params.append(limit + 1)
+        with self._connection() as conn:
+            rows = conn.execute(query, params).fetchall()
+
+        bills = []
+        for row in rows[:limit]:
+            bill_id, job_id, filename, processed_at, summary, content_hash = row[:6]
+            values = {'id': bill_id, 'filename': filename, 'file': stored_file_name(filename, content_hash),
+                      'jobId': job_id, 'processedAt': processed_at}
+            values.update(json.loads(summary or '{}'))
+            values.update((document, json.loads(raw or 'null')) for document, raw in zip(documents, row[6:]))
+            bills.append({field: values.get(field) for field in fields})
+        next_cursor = encode_cursor(rows[limit - 1][3], rows[limit - 1][0]) if len(rows) > limit else None
+        return bills, next_cursor
+
+    def _mark_served(self, conn, user_id, now):
+        conn.execute(
+            "INSERT INTO users (user_id, last_served_at) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET last_served_at = excluded.last_served_at",
+            (user_id, now)
+        )
+
+    def _release_waiting(self, conn, now, file_path=None, release_all=False):
+        # Queue jobs waiting on a file (any file when None) that no queued or running job reads any more: all of
+        # them once it was processed, since each just copies the result, otherwise only the earliest, which the
+        # rest then wait for. Returns how many were queued.
+        rows = conn.execute(
+            "SELECT w.id, w.file_path FROM jobs w WHERE w.state = 'waiting' AND (? IS NULL OR w.file_path = ?) "
+            "AND NOT EXISTS (SELECT 1 FROM jobs a WHERE a.file_path = w.file_path AND a.state IN ('queued', 'running')) "
+            "ORDER BY w.submitted_at",
+            (file_path, file_path)
+        ).fetchall()
+        released, files = [], set()
+        for job_id, path in rows:
+            if release_all or path not in files:
+                files.add(path)
+                released.append(job_id)
+        for job_id in released:
+            conn.execute("UPDATE jobs SET state = 'queued', message = 'Waiting to be processed' WHERE id = ?", (job_id,))
+            self._add_event(conn, job_id, 'queued', 'Waiting to be processed', now)
+        return len(released)
+
+    def _add_event(self, conn, job_id, step, message, now, progress=None):
+        conn.execute("INSERT INTO job_events (job_id, step, message, created_at, progress) VALUES (?, ?, ?, ?, ?)",
+                     (job_id, step, message, now, progress))
+
+
+class MemoryJobStore:
+    """Jobs and bill results kept in this process only, for serverless instances that share no disk
+
+    Implements the part of JobStore that a single-user app running each job on its own thread needs.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._bills = []
+        self._lock = threading.Lock()
+
+    def create_job(self, user_id, file_name, file_path=None, batch_id=None, state='queued', message=None):
+        """Record a new job and return its id"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        job = dict.fromkeys(JOB_COLUMNS)
+        job.update(id=job_id, user_id=user_id, batch_id=batch_id, file_name=file_name, file_path=file_path,
+                   state=state, message=message, attempts=0, submitted_at=now)
+        if state == 'running':
+            job.update(started_at=now, heartbeat_at=now, attempts=1)
+        with self._lock:
+            self._jobs[job_id] = job
+        return job_id
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def update_job(self, job_id, step, message, progress=None):
+        """Record a stage transition, or progress (0-1) within a stage, for a running job"""
+        with self._lock:
+            self._jobs[job_id].update(step=step, message=message, progress=progress, heartbeat_at=time.time())
+
+    def touch_job(self, job_id):
+        """Record that a running job's worker is still alive"""
+        with self._lock:
+            job = self._jobs[job_id]
+            if job['state'] == 'running':
+                job['heartbeat_at'] = time.time()
+
+    def finish_job(self, job_id, success, message):
+        with self._lock:
+            self._jobs[job_id].update(state='done' if success else 'failed', step=None, progress=None,
+                                      success=bool(success), message=message, finished_at=time.time())
+
+    def recover_stale_jobs(self, stale_after=STALE_JOB_SECONDS, retry=False):
+        """Fail running jobs whose thread stopped sending heartbeats; jobs here are never retried"""
+        now = time.time()
+        with self._lock:
+            stale = [job for job in self._jobs.values() if is_stale(job, stale_after, now)]
+            for job in stale:
+                job.update(state='failed', step=None, progress=None, success=False, finished_at=now,
+                           message='Processing was interrupted')
+        if stale:
+            print(f"Recovered interrupted jobs: 0 requeued, {len(stale)} failed")
+        return 0, len(stale)
+
+    def latest_job(self, user_id):
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job['user_id'] == user_id]
+            return dict(max(jobs, key=lambda job: job['submitted_at'])) if jobs else None
+
+    def add_bill(self, user_id, filename, data, analysis, job_id=None, content_hash=None):
+        """Save a processed bill and its analysis to the user's history"""
+        with self._lock:
+            self._bills.append({'user_id': user_id, 'filename': filename, 'content_hash': content_hash,
+                                'data': data, 'analysis': analysis, 'processed_at': time.time()})
+
+    def user_bills(self, user_id, limit=100):
+        """Return the user's most recently processed bills, newest first, one per stored file"""
+        with self._lock:
+            rows = [bill for bill in reversed(self._bills) if bill['user_id'] == user_id][:limit]
+        bills, seen = [], set()
+        for bill in rows:
+            stored_name = stored_file_name(bill['filename'], bill['content_hash'])
+            if stored_name in seen:
+                continue
+            seen.add(stored_name)
+            bills.append({'filename': bill['filename'], 'file': stored_name, 'data': bill['data'],
+                          'analysis': bill['analysis'], 'processed_at': bill['processed_at']})
+        return bills
+
+
+class _Transaction:
+    """Runs a block in one transaction on an autocommit connection, committing on success and rolling back on error"""
+
+    def __init__(self, conn, begin):
+        self.conn = conn
+        self.begin = begin
+
+    def __enter__(self):
+        if self.begin:
+            self.conn.execute(f'BEGIN {self.begin}')
+        return self.conn
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.conn.in_transaction:
+            self.conn.execute('ROLLBACK' if exc_type else 'COMMIT')
+        return False
+
+
+def _position(queues, user_id, index):
+    # Jobs dispatched before the index-th queued job of user_id: up to index jobs from every user,
+    # plus one more from each user ahead of it in the rotation that has that many queued
+    position = 0
+    ahead = True
+    for other, jobs in queues.items():
+        if other == user_id:
+            ahead = False
+        position += min(len(jobs), index)
+        if ahead and len(jobs) > index:
+            position += 1
+    return position + 1
+
+
+def bill_summary(data, analysis):
+    """Return the bill history summary fields of a processed bill"""
+    documents = {'data': data or {}, 'analysis': analysis or {}}
+    summary = {name: documents[document].get(key) for name, (document, key) in SUMMARY_FIELDS.items()}
+    summary['hasAnalysis'] = bool(analysis) and 'error' not in analysis
+    return summary
+
+
+def stored_file_name(filename, content_hash):
+    """Return the name a bill's PDF, extracted data and analysis are stored under"""
+    # Bills uploaded before content addressing were stored under their upload name
+    return f"{content_hash}.pdf" if content_hash else filename
+
+
+def encode_cursor(processed_at, bill_id):
+    """Return the opaque bill history cursor that continues after a bill"""
+    return base64.urlsafe_b64encode(json.dumps([processed_at, bill_id]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Return (processed_at, id) from a bill history cursor; raises ValueError when it is malformed"""
+    try:
+        processed_at, bill_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(processed_at), int(bill_id)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid bill history cursor")
+
+
+def _notify_changes():
+    with _changes:
+        _changes.notify_all()
+
+
+def is_stale(job, stale_after=STALE_JOB_SECONDS, now=None):
+    """Return whether a job is marked running but its worker hasn't sent a heartbeat within stale_after seconds"""
+    if job is None or job['state'] != 'running':
+        return False
+    last_seen = job['heartbeat_at'] or job['started_at'] or job['submitted_at']
+    return last_seen < (now or time.time()) - stale_after
+
+
+@contextmanager
+def heartbeat(store, job_id, interval=HEARTBEAT_SECONDS):
+    """Touch a running job every interval seconds from a background thread while the block runs"""
+    stop = threading.Event()
+
+    def beat():
+        while not stop.wait(interval):
+            try:
+                store.touch_job(job_id)
+            except Exception as e:
+                print(f"Warning: Could not record heartbeat for job {job_id}: {e}")
+
+    thread = threading.Thread(target=beat, name=f"heartbeat-{job_id[:8]}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+
+
+def job_status(job):
+    """Return the legacy processing status dict ('processing', 'message', 'current_file', 'step', 'success') for a job"""
+    if job is None:
+        return dict(IDLE_STATUS)
+    active = job['state'] in ('queued', 'running', 'waiting')
+    return {
+        'processing': active,
+        'message': job['message'] or (IDLE_STATUS['message'] if not active else ''),
+        'current_file': job['file_name'] if active else None,
+        'step': job['step'] if active else None,
+        'progress': job['progress'] if active else None,
+        'success': True if job['success'] is None else job['success']
+    }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the shared job store, opening it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = MemoryJobStore() if JOB_STORE_PATH == MEMORY_STORE else JobStore()
+    return _store
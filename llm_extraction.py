@@ -0,0 +1,237 @@
+import json
+import re
+
+# Fields requested from the LLM, in the order they appear in the prompt
+BILL_FIELDS = {
+    "Name": "the customer name",
+    "Address": "full service address including city, state, zip",
+    "RateSchedule": "the rate schedule code and description",
+    "ElectricUsageThisPeriod": "total kWh used in the billing period",
+    "BillingDays": "number of days in the billing period",
+    "PeakUsage": "peak usage in kWh",
+    "PeakRate": "the rate charged for peak usage, e.g. $0.49378/kWh",
+    "PeakTotal": "total amount charged for peak usage, e.g. $85.82",
+    "OffPeakUsage": "off-peak usage in kWh",
+    "OffPeakRate": "the rate charged for off-peak usage, e.g. $0.46378/kWh",
+    "OffPeakTotal": "total amount charged for off-peak usage, e.g. $224.97",
+    "BillingPeriod": "the billing period dates, e.g. \"01/01/2025 - 01/31/2025\"",
+    "TotalAmountDue": "the total amount due on the bill"
+}
+
+SYSTEM_PROMPT = ("You are a utility bill data extraction assistant. Extract the requested information accurately "
+                 "from the OCR text of a PG&E bill. Return your response as a valid JSON object.")
+
+
+class IncrementalJSONParser:
+    """Parse a streamed JSON object and emit each top-level field as soon as its value is complete"""
+
+    def __init__(self, on_field=None):
+        self.on_field = on_field
+        self.fields = {}
+        self.broken = {}  # field name -> raw text that could not be parsed
+        self.done = False
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._segment_start = None
+        self._key = None
+
+    def feed(self, chunk):
+        """Consume the next piece of streamed text"""
+        if not chunk or self.done:
+            return
+        self._text += chunk
+
+        while self._pos < len(self._text) and not self.done:
+            char = self._text[self._pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+                if self._depth == 1:
+                    # Anything before the opening brace (code fences, prose) is ignored
+                    self._segment_start = self._pos + 1
+            elif char in '}]':
+                if self._depth == 1:
+                    self._close_segment()
+                    self.done = True
+                self._depth -= 1
+            elif self._depth == 1 and char == ':' and self._key is None:
+                self._read_key()
+            elif self._depth == 1 and char == ',':
+                self._close_segment()
+
+            self._pos += 1
+
+    def finish(self):
+        """Flush a value left open by a truncated stream"""
+        if not self.done and self._key is not None:
+            raw = self._text[self._segment_start:].strip()
+            self.broken[self._key] = raw
+            self._key = None
+        self.done = True
+        return self.fields
+
+    def _read_key(self):
+        raw = self._text[self._segment_start:self._pos].strip()
+        try:
+            self._key = json.loads(raw)
+        except json.JSONDecodeError:
+            self._key = raw.strip('"\' ')
+        self._segment_start = self._pos + 1
+
+    def _close_segment(self):
+        if self._key is None:
+            self._segment_start = self._pos + 1
+            return
+
+        raw = self._text[self._segment_start:self._pos].strip()
+        value, ok = parse_json_value(raw)
+        if ok:
+            self.fields[self._key] = value
+            self.broken.pop(self._key, None)
+            if self.on_field:
+                self.on_field(self._key, value)
+        else:
+            self.broken[self._key] = raw
+
+        self._key = None
+        self._segment_start = self._pos + 1
+
+
+def parse_json_value(raw):
+    """Parse a single JSON value, repairing the common ways LLM output goes wrong"""
+    if not raw:
+        return None, False
+    try:
+        return json.loads(raw), True
+    except json.JSONDecodeError:
+        pass
+
+    # Python literals instead of JSON literals
+    python_literals = {'None': None, 'True': True, 'False': False}
+    if raw in python_literals:
+        return python_literals[raw], True
+
+    # Single-quoted strings
+    if len(raw) >= 2 and raw[0] == "'" and raw[-1] == "'":
+        return raw[1:-1], True
+
+    # Unquoted scalars such as $0.44583/kWh
+    if not any(char in raw for char in '{}[]"'):
+        return raw, True
+
+    # Trailing commas inside nested objects or arrays
+    repaired = re.sub(r',\s*([}\]])', r'\1', raw)
+    try:
+        return json.loads(repaired), True
+    except json.JSONDecodeError:
+        return None, False
+
+
+def build_extraction_prompt(ocr_text, fields):
+    """Build the user prompt asking for the given fields"""
+    field_lines = "\n".join(
+        f"    {i}. {name} ({BILL_FIELDS.get(name, name)})" for i, name in enumerate(fields, start=1)
+    )
+    return f"""
+    Extract the following information from this PG&E bill OCR text. Return the results as a JSON object with these fields:
+{field_lines}
+
+    Look for the 'Energy Charges' section of the bill, which typically contains the peak and off-peak usage information.
+    If any field cannot be found, return null for that field.
+
+    OCR Text:
+    {ocr_text}
+    """
+
+
+def stream_bill_fields(ocr_text, fields=None, model="gpt-3.5-turbo", client=None, on_field=None):
+    """Extract bill fields with a JSON-mode streamed completion, retrying only the fields that came back broken"""
+    fields = list(fields or BILL_FIELDS)
+    if client is None:
+        # Importing openai takes most of a second, so it waits until a bill is actually extracted
+        import openai
+        client = openai
+
+    parser = IncrementalJSONParser(on_field=on_field)
+    stream_error = None
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": build_extraction_prompt(ocr_text, fields)}
+            ],
+            temperature=0.0,  # Use low temperature for more deterministic results
+            response_format={"type": "json_object"},
+            stream=True
+        )
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            parser.feed(chunk.choices[0].delta.content)
+    except Exception as e:
+        # Fields completed before the failure are kept; the rest go through the retry below
+        print(f"Error streaming bill fields: {e}")
+        stream_error = e
+    parser.finish()
+
+    result = dict(parser.fields)
+
+    # Re-ask only for the fields that were malformed or never emitted
+    retry_fields = [name for name in fields if name in parser.broken or name not in result]
+    if retry_fields:
+        print(f"Retrying broken or missing fields: {', '.join(retry_fields)}")
+        result.update(_retry_fields(ocr_text, retry_fields, parser.broken, model, client, on_field))
+
+    if not result:
+        if stream_error is not None:
+            return {"error": f"OpenAI API error: {str(stream_error)}"}
+        return {"error": "Failed to parse API response"}
+
+    for name in fields:
+        result.setdefault(name, None)
+
+    return result
+
+
+def _retry_fields(ocr_text, fields, broken, model, client, on_field):
+    """Ask for a subset of fields again in a single non-streamed JSON-mode call"""
+    prompt = build_extraction_prompt(ocr_text, fields)
+    if broken:
+        snippets = "\n".join(f"    {name}: {raw}" for name, raw in broken.items() if name in fields)
+        prompt += f"\n    The previous answer contained these malformed values:\n{snippets}\n"
+
+    try:
+        response = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.0,
+            response_format={"type": "json_object"}
+        )
+        parser = IncrementalJSONParser()
+        parser.feed(response.choices[0].message.content)
+        parser.finish()
+    except Exception as e:
+        print(f"Error retrying fields {fields}: {e}")
+        return {}
+
+    repaired = {name: value for name, value in parser.fields.items() if name in fields}
+    if on_field:
+        for name, value in repaired.items():
+            on_field(name, value)
+    return repaired
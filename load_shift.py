@@ -0,0 +1,122 @@
+import numpy as np
+
+import cost_engine
+import rate_catalog
+import tariff_model
+
+DEFAULT_STEPS = 21
+
+
+def linear_costs(model, peak_kwh, off_peak_kwh, days=None, months=None, territories=None):
+    """Return (intercept, slope) arrays so each plan's cost is intercept + slope * shifted fraction
+
+    Shifting a fraction of peak kWh to off-peak leaves total usage unchanged, so tiers, baseline
+    credits and fixed charges stay constant and every plan's cost is linear in the fraction.
+    Usage may be (N,) or (N x P) when the peak window differs by plan.
+    """
+    peak_kwh = np.asarray(peak_kwh, dtype=float)
+    off_peak_kwh = np.asarray(off_peak_kwh, dtype=float)
+    unshifted = model.evaluate(peak_kwh, off_peak_kwh, days, months, territories)['totalCost']
+    fully_shifted = model.evaluate(np.zeros_like(peak_kwh), off_peak_kwh + peak_kwh, days, months, territories)['totalCost']
+    return unshifted, fully_shifted - unshifted
+
+
+def breakevens(intercepts, slopes, codes):
+    """Return every pair of plans whose cost lines cross inside 0 < fraction < 1, with the crossing point"""
+    intercepts = np.asarray(intercepts, dtype=float)
+    slopes = np.asarray(slopes, dtype=float)
+    first, second = np.triu_indices(len(codes), k=1)
+    slope_gap = slopes[first] - slopes[second]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = (intercepts[second] - intercepts[first]) / slope_gap
+    crossing = (slope_gap != 0) & (fractions > 0) & (fractions < 1)
+
+    points = []
+    for i, j, fraction in zip(first[crossing], second[crossing], fractions[crossing]):
+        # The plan with the steeper slope gains more from shifting and is cheaper past the breakeven
+        cheaper_after = codes[i] if slopes[i] < slopes[j] else codes[j]
+        points.append({
+            'plans': [codes[i], codes[j]],
+            'fraction': round(float(fraction), 4),
+            'cost': round(float(intercepts[i] + slopes[i] * fraction), 2),
+            'cheaperAfter': cheaper_after
+        })
+    return sorted(points, key=lambda point: point['fraction'])
+
+
+def shift_curve(intercepts, slopes, codes, peak_kwh_by_plan, current_plan=None, steps=DEFAULT_STEPS):
+    """Evaluate the savings curve and best plan over a grid of shifted fractions in one broadcast"""
+    intercepts = np.asarray(intercepts, dtype=float)
+    slopes = np.asarray(slopes, dtype=float)
+    fractions = np.linspace(0.0, 1.0, steps)
+    costs = intercepts + np.outer(fractions, slopes)  # (steps x P)
+    best = costs.argmin(axis=1)
+    best_cost = costs[np.arange(steps), best]
+
+    current_index = codes.index(current_plan) if current_plan in codes else int(intercepts.argmin())
+    baseline_cost = intercepts[current_index]
+
+    return {
+        'fractions': [round(float(fraction), 4) for fraction in fractions],
+        'shiftedKwh': [round(float(fraction * peak_kwh_by_plan[current_index]), 3) for fraction in fractions],
+        'bestPlan': [codes[i] for i in best],
+        'bestCost': [round(float(cost), 2) for cost in best_cost],
+        'currentPlanCost': [round(float(cost), 2) for cost in costs[:, current_index]],
+        'savings': [round(float(baseline_cost - cost), 2) for cost in best_cost],
+        'planCosts': {code: [round(float(cost), 2) for cost in costs[:, i]] for i, code in enumerate(codes)},
+        'currentPlan': codes[current_index],
+        'breakevens': breakevens(intercepts, slopes, codes)
+    }
+
+
+def analyze_bill_shift(bill_data, steps=DEFAULT_STEPS):
+    """Savings curve for shifting peak usage to off-peak on one extracted bill"""
+    model = tariff_model.get_model()
+    usage = cost_engine.usage_matrix([bill_data])
+    month = tariff_model.billing_month(bill_data.get('BillingPeriod'))
+    intercepts, slopes = linear_costs(
+        model,
+        usage[:, 0],
+        usage[:, 1],
+        days=[cost_engine.parse_usage(bill_data.get('BillingDays')) or tariff_model.DEFAULT_BILLING_DAYS],
+        months=[(month or tariff_model.UNKNOWN_MONTH + 1) - 1],
+        territories=model.territory_indexes([bill_data.get('BaselineTerritory')])
+    )
+    current_plan = rate_catalog.get_catalog().resolver.canonical_code(cost_engine.rate_code(bill_data))
+    result = shift_curve(intercepts[0], slopes[0], model.codes, np.full(len(model.codes), usage[0, 0]),
+                         current_plan, steps)
+    result['catalogVersion'] = model.version
+    return result
+
+
+def analyze_interval_shift(timestamps, kwh, current_plan=None, territory=None, steps=DEFAULT_STEPS):
+    """Savings curve for shifting a fraction of each plan's own peak-window usage in an interval series"""
+    import interval_engine
+
+    engine = interval_engine.get_engine()
+    model = engine.tariffs
+    kwh = np.asarray(kwh, dtype=float)
+    timestamps = np.asarray(timestamps, dtype='datetime64[m]')
+    month, _, _ = interval_engine.time_features(timestamps)
+
+    # Monthly (months x P) peak and off-peak kWh, priced month by month like the interval engine does
+    month_onehot = np.eye(12)[month]
+    monthly_peak = ((engine.peak_mask(timestamps) * kwh) @ month_onehot).T
+    monthly_total = kwh @ month_onehot
+    days = np.unique(timestamps.astype('datetime64[D]'))
+    monthly_days = np.bincount(interval_engine.time_features(days.astype('datetime64[m]'))[0], minlength=12)
+    billed = np.flatnonzero(monthly_days)
+
+    intercepts, slopes = linear_costs(
+        model,
+        monthly_peak[billed],
+        monthly_total[billed, np.newaxis] - monthly_peak[billed],
+        days=monthly_days[billed],
+        months=billed,
+        territories=model.territory_indexes([territory] * len(billed))
+    )
+    current_plan = rate_catalog.get_catalog().resolver.canonical_code(current_plan) if current_plan else None
+    result = shift_curve(intercepts.sum(axis=0), slopes.sum(axis=0), model.codes, monthly_peak.sum(axis=0),
+                         current_plan, steps)
+    result['catalogVersion'] = model.version
+    return result
@@ -0,0 +1,288 @@
+import itertools
+import re
+
+# Characters OCR substitutes for digits
+OCR_DIGITS = {
+    'o': '0', 'O': '0', 'D': '0', 'C': '0', 'Q': '0',
+    'l': '1', 'I': '1', '|': '1',
+    'B': '8',
+}
+DECIMAL_SEPARATORS = '._,'
+
+# Plausible ranges and usual number of decimals for each kind of number on a PG&E bill
+NUMBER_KINDS = {
+    'usage': {'min': 0.0, 'max': 100000.0, 'decimals': range(0, 7), 'typical': 6},
+    'rate': {'min': 0.001, 'max': 2.0, 'decimals': range(1, 7), 'typical': 5},
+    'money': {'min': 0.0, 'max': 100000.0, 'decimals': [2], 'typical': 2},
+}
+
+# A number as OCR reads it: optional sign and $ (often read as s), then digits and look-alikes
+NUMBER_TOKEN = r"-?[\$sS]?-?\$?(?=[^\s]*\d)[\dOoDCQlI|B_.,']+"
+
+ENERGY_ROW_PATTERN = re.compile(
+    r"^(?P<label>[A-Za-z][A-Za-z \-']*?)?\s*(?P<usage>" + NUMBER_TOKEN + r")\s*kWh\s*@\s*(?P<rate>"
+    + NUMBER_TOKEN + r")(?:\s+(?P<total>" + NUMBER_TOKEN + r"))?"
+)
+LINE_ITEM_PATTERN = re.compile(r"^(?P<label>[A-Za-z][^\t]*?)\s+(?P<amount>" + NUMBER_TOKEN + r")\s*$")
+
+ROW_TOLERANCE = 0.02  # dollars between usage x rate and the printed total
+USAGE_TOLERANCE = 0.01  # kWh between summed rows and the printed total usage
+SECTION_TOLERANCE = 0.02  # dollars between summed line items and the section total
+
+
+def clean_numeric_token(token):
+    """Split an OCR'd number into its digits, the position of its decimal point and its sign"""
+    if token is None:
+        return None
+    token = token.strip().replace("'", '')
+    negative = token.startswith('-')
+    token = token.lstrip('-')
+
+    # A leading s or S in front of a number is a misread $
+    if token[:1] in ('$', 's', 'S'):
+        token = token[1:]
+    token = token.lstrip('-$')
+    negative = negative or token.startswith('-')
+
+    digits = ''
+    decimal_index = None
+    for char in token:
+        if char.isdigit():
+            digits += char
+        elif char in OCR_DIGITS:
+            digits += OCR_DIGITS[char]
+        elif char in DECIMAL_SEPARATORS:
+            # The last separator is the decimal point; earlier ones are thousands separators
+            decimal_index = len(digits)
+
+    if not digits:
+        return None
+    if decimal_index is not None and (decimal_index == len(digits) or decimal_index == 0 and len(digits) > 6):
+        decimal_index = None
+    return {'digits': digits, 'decimalIndex': decimal_index, 'negative': negative}
+
+
+def number_candidates(token, kind):
+    """Enumerate (value, penalty) readings of a token, one per plausible decimal placement"""
+    cleaned = clean_numeric_token(token)
+    if not cleaned:
+        return []
+
+    rules = NUMBER_KINDS[kind]
+    digits = cleaned['digits']
+    explicit = None if cleaned['decimalIndex'] is None else len(digits) - cleaned['decimalIndex']
+    sign = -1 if cleaned['negative'] else 1
+
+    placements = set(d for d in rules['decimals'] if d <= len(digits))
+    if explicit is not None:
+        placements.add(explicit)
+
+    candidates = []
+    for decimals in placements:
+        value = int(digits) / (10 ** decimals)
+        if not rules['min'] <= value <= rules['max']:
+            continue
+        if decimals == explicit:
+            penalty = 0.0
+        elif decimals == rules['typical']:
+            penalty = 0.25 if explicit is None else 0.5
+        else:
+            penalty = 0.75 if explicit is None else 1.0
+        candidates.append((round(sign * value, decimals), penalty))
+
+    return sorted(candidates, key=lambda candidate: candidate[1])
+
+
+def parse_number(token, kind):
+    """Return the most likely reading of a token, or None"""
+    candidates = number_candidates(token, kind)
+    return candidates[0][0] if candidates else None
+
+
+def row_candidates(usage_token, rate_token, total_token=None, limit=4):
+    """Rank usage/rate/total readings of one charge row by how well usage x rate matches the total"""
+    usages = number_candidates(usage_token, 'usage')
+    rates = number_candidates(rate_token, 'rate')
+    totals = number_candidates(total_token, 'money') if total_token else []
+
+    # Rates printed negative (baseline credits) keep their sign
+    cleaned_rate = clean_numeric_token(rate_token)
+    if cleaned_rate and cleaned_rate['negative']:
+        rates = [(-abs(rate), penalty) for rate, penalty in rates]
+
+    results = []
+    for (usage, usage_penalty), (rate, rate_penalty) in itertools.product(usages, rates):
+        computed = round(usage * rate, 2)
+        if totals:
+            for total, total_penalty in totals:
+                if rate < 0 and total > 0:
+                    total = -total
+                error = abs(computed - total)
+                if error > max(ROW_TOLERANCE, abs(total) * 0.002):
+                    continue
+                score = usage_penalty + rate_penalty + total_penalty + error
+                results.append({'kWh': usage, 'rate': rate, 'total': total, 'score': score, 'consistent': True})
+        else:
+            score = usage_penalty + rate_penalty
+            results.append({'kWh': usage, 'rate': rate, 'total': computed, 'score': score, 'consistent': False})
+
+    results.sort(key=lambda result: result['score'])
+    return results[:limit]
+
+
+def _row_kind(label):
+    label = (label or '').lower().replace('-', ' ')
+    if 'off' in label and 'peak' in label:
+        return 'offPeak'
+    if 'peak' in label:
+        return 'peak'
+    return 'other'
+
+
+def _energy_window(text):
+    """Return the lines from the Energy Charges header through the delivery charges total and what follows it"""
+    lines = [line.strip() for line in text.split('\n')]
+    start = next((i for i, line in enumerate(lines) if re.search(r'Energy\s*Charges', line)), None)
+    if start is None:
+        return [], []
+
+    end = next((i for i in range(start, len(lines)) if 'Total PG&E Electric Delivery Charges' in lines[i]), None)
+    if end is None:
+        return lines[start + 1:start + 40], []
+    return lines[start + 1:end + 1], lines[end + 1:end + 25]
+
+
+def _parse_rows(lines):
+    """Read one charge per line, as OCR produces for row-aligned bills"""
+    rows, line_items = [], []
+    section_total_token = None
+
+    for line in lines:
+        line = re.sub(r'\s+', ' ', line)
+        if 'Total PG&E Electric Delivery Charges' in line:
+            match = re.search(NUMBER_TOKEN + r'\s*$', line)
+            section_total_token = match.group(0) if match else None
+            continue
+
+        row_match = ENERGY_ROW_PATTERN.search(line)
+        if row_match:
+            rows.append({
+                'kind': _row_kind(row_match.group('label')),
+                'usage': row_match.group('usage'),
+                'rate': row_match.group('rate'),
+                'total': row_match.group('total')
+            })
+            continue
+
+        item_match = LINE_ITEM_PATTERN.search(line)
+        if item_match and not re.search(r'\d{2}/\d{2}/\d{4}', line):
+            amount = parse_number(item_match.group('amount'), 'money')
+            if amount is not None:
+                line_items.append(amount)
+
+    return rows, line_items, section_total_token
+
+
+def _parse_columns(lines, trailing_lines):
+    """Read charges that OCR split into columns: all usages, then the kWh units, then the rates, then the totals"""
+    usages, rates, amounts = [], [], []
+    for line in lines:
+        if re.fullmatch(NUMBER_TOKEN, line):
+            usages.append(line)
+        elif line.startswith('@'):
+            rates.append(line[1:].strip())
+
+    for line in trailing_lines:
+        if re.fullmatch(NUMBER_TOKEN, line):
+            amounts.append(line)
+
+    count = min(len(usages), len(rates))
+    if count == 0:
+        return [], None
+
+    # PG&E always lists peak before off-peak
+    kinds = ['peak', 'offPeak'] if count == 2 else ['other'] * count
+    rows = [{
+        'kind': kinds[i],
+        'usage': usages[i],
+        'rate': rates[i],
+        'total': amounts[i] if i < len(amounts) else None
+    } for i in range(count)]
+
+    # The section total is the last dollar amount in the column
+    dollar_amounts = [amount for amount in amounts[count:] if amount.lstrip('-')[:1] in ('$', 's', 'S')]
+    section_total_token = dollar_amounts[-1] if dollar_amounts else None
+    return rows, section_total_token
+
+
+def find_total_usage(text):
+    """Return the total kWh printed on the bill, if any"""
+    match = re.search(r'(?:Electric Usage This Period:|Total Usage)\s*(' + NUMBER_TOKEN + r')\s*kWh', text)
+    if not match:
+        return None
+    candidates = number_candidates(match.group(1), 'usage')
+    return candidates[0][0] if candidates else None
+
+
+def reconstruct_energy_charges(text):
+    """Rebuild OCR-mangled Energy Charges numbers by choosing decimal placements that make the bill add up"""
+    result = {
+        'peak': {},
+        'offPeak': {},
+        'other': [],
+        'sectionTotal': None,
+        'totalUsage': find_total_usage(text),
+        'consistent': False
+    }
+
+    window, trailing = _energy_window(text)
+    if not window:
+        return result
+
+    rows, line_items, section_total_token = _parse_rows(window)
+    if not rows:
+        rows, section_total_token = _parse_columns(window, trailing)
+        line_items = None  # Line item amounts can't be matched to labels in column layouts
+    if not rows:
+        return result
+
+    section_total = parse_number(section_total_token, 'money') if section_total_token else None
+    result['sectionTotal'] = section_total
+
+    ranked = [row_candidates(row['usage'], row['rate'], row['total']) for row in rows]
+    if not all(ranked):
+        return result
+
+    # Pick the combination of row readings that best satisfies the bill-level totals
+    best, best_score = None, None
+    for combination in itertools.product(*ranked):
+        score = sum(candidate['score'] for candidate in combination)
+
+        usage_sum = sum(candidate['kWh'] for row, candidate in zip(rows, combination) if row['kind'] != 'other')
+        if result['totalUsage']:
+            usage_error = abs(usage_sum - result['totalUsage'])
+            score += 0 if usage_error <= USAGE_TOLERANCE else 10 + usage_error / result['totalUsage']
+
+        if section_total is not None and line_items is not None:
+            parts_sum = sum(candidate['total'] for candidate in combination) + sum(line_items)
+            section_error = abs(parts_sum - section_total)
+            score += 0 if section_error <= SECTION_TOLERANCE else 10 + section_error / max(section_total, 1)
+
+        if best_score is None or score < best_score:
+            best, best_score = combination, score
+
+    for row, candidate in zip(rows, best):
+        values = {'kWh': candidate['kWh'], 'rate': candidate['rate'], 'total': candidate['total']}
+        if row['kind'] == 'other':
+            result['other'].append(values)
+        elif result[row['kind']]:
+            # Bills with a mid-period rate change list the same period twice
+            merged = result[row['kind']]
+            merged['kWh'] = round(merged['kWh'] + values['kWh'], 6)
+            merged['total'] = round(merged['total'] + values['total'], 2)
+            merged['rate'] = round(merged['total'] / merged['kWh'], 5) if merged['kWh'] else merged['rate']
+        else:
+            result[row['kind']] = values
+
+    result['consistent'] = all(candidate['consistent'] for candidate in best) and best_score < 10
+    return result
@@ -1,9 +1,12 @@
 import os
-from google.cloud import vision
-# Google Vision can handle PDFs directly
 from PIL import Image
 import io
 import json
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 from supabase import create_client, Client
@@ -11,20 +14,86 @@ import base64
 from datetime import datetime
 import re
 
-class PGEBillAnalyzer:
-    def __init__(self):
-        """Initialize the Google Cloud Vision client and Supabase client"""
+def _vision():
+    """Import Google Cloud Vision on first use; it is slow to load and only needed once a bill is scanned"""
+    # Google Vision can handle PDFs directly
+    from google.cloud import vision
+    return vision
+
+# Vision clients (each with its own gRPC channel) shared round-robin by concurrent requests
+VISION_POOL_SIZE = int(os.getenv("VISION_POOL_SIZE", "2"))
+
+# Threads running the blocking Vision and Supabase calls; this caps concurrent calls to both services
+ANALYZER_THREADS = int(os.getenv("ANALYZER_THREADS", "8"))
+
+# Seconds a Supabase health check result is reused, so frequent probes don't each query the database
+HEALTH_CHECK_SECONDS = int(os.getenv("HEALTH_CHECK_SECONDS", "30"))
+
+class AnalyzerClients:
+    """Vision and Supabase clients, and the threads that call them, created once and shared by every analyzer"""
+
+    def __init__(self, vision_clients, supabase: Client, threads=ANALYZER_THREADS):
+        self.vision_clients = vision_clients
+        self.supabase = supabase
+        self.threads = max(threads, 1)
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='bill-analyzer')
+        self._next_vision = itertools.cycle(vision_clients)
+        self._lock = threading.Lock()
+        self._health = None
+        self._health_checked_at = 0
+
+    @classmethod
+    def create(cls, vision_pool_size=VISION_POOL_SIZE, threads=ANALYZER_THREADS):
+        """Create the clients from the environment; raises ValueError without Supabase credentials"""
         load_dotenv()
         
-        # Initialize Google Vision
-        self.vision_client = vision.ImageAnnotatorClient()
-        
         # Initialize Supabase with service role key for admin access
         supabase_url = os.getenv("SUPABASE_URL")
         supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
         if not supabase_url or not supabase_key:
             raise ValueError("Supabase credentials not found in environment variables")
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+        supabase = create_client(supabase_url, supabase_key)
+        
+        vision = _vision()
+        vision_clients = [vision.ImageAnnotatorClient() for _ in range(max(vision_pool_size, 1))]
+        return cls(vision_clients, supabase, threads)
+
+    def vision_client(self):
+        """Return the next Vision client in turn"""
+        with self._lock:
+            return next(self._next_vision)
+
+    async def run(self, function, *args):
+        """Run a blocking client call on the shared threads without blocking the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+
+    async def health(self):
+        """Return {'vision': ..., 'supabase': ...} check results, each 'ok' or an error message"""
+        now = time.monotonic()
+        if self._health is None or now - self._health_checked_at > HEALTH_CHECK_SECONDS:
+            try:
+                await self.run(lambda: self.supabase.table('pge_bills').select('id').limit(1).execute())
+                supabase = 'ok'
+            except Exception as e:
+                supabase = f"error: {e}"
+            self._health = {'supabase': supabase}
+            self._health_checked_at = now
+        return dict(self._health, vision='ok' if self.vision_clients else 'error: no clients')
+
+    def close(self):
+        """Stop the threads and close the Vision channels"""
+        self.executor.shutdown(wait=False)
+        for client in self.vision_clients:
+            try:
+                client.transport.close()
+            except Exception as e:
+                print(f"Warning: Could not close Vision client: {e}")
+
+class PGEBillAnalyzer:
+    def __init__(self, clients: AnalyzerClients = None):
+        """Use shared Vision and Supabase clients, creating a set for this analyzer when none are given"""
+        self.clients = clients or AnalyzerClients.create()
+        self.supabase: Client = self.clients.supabase
 
     async def store_bill_in_supabase(self, pdf_path: str) -> str:
         """Store PDF bill in Supabase storage
@@ -45,10 +114,7 @@ class PGEBillAnalyzer:
             storage_path = f"bills/{filename}"
             
             # Upload to Supabase storage
-            response = self.supabase.storage.from_('bills').upload(
-                storage_path,
-                file_contents
-            )
+            response = await self.clients.run(self.supabase.storage.from_('bills').upload, storage_path, file_contents)
             
             print(f"Bill stored in Supabase: {storage_path}")
             return storage_path
@@ -129,7 +195,7 @@ class PGEBillAnalyzer:
             bill_data['processed_at'] = datetime.now().isoformat()
             
             # Insert into Supabase
-            response = self.supabase.table('pge_bills').insert(bill_data).execute()
+            response = await self.clients.run(self.supabase.table('pge_bills').insert(bill_data).execute)
             
             record_id = response.data[0]['id']
             print(f"Bill data stored in database with ID: {record_id}")
@@ -157,10 +223,10 @@ class PGEBillAnalyzer:
                 content = pdf_file.read()
             
             # Create image object directly from PDF
-            image = vision.Image(content=content)
+            image = _vision().Image(content=content)
 
             # Perform OCR
-            response = self.vision_client.document_text_detection(image=image)
+            response = await self.clients.run(self.clients.vision_client().document_text_detection, image)
             
             if response.error.message:
                 raise Exception(
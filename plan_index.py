@@ -0,0 +1,165 @@
+import bisect
+import threading
+
+import numpy as np
+
+import tariff_model
+
+MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec', 'Unknown')
+
+
+def lower_envelope(intercepts, slopes):
+    """Return (breakpoints, winners) of the lowest of the lines intercept + slope * f over 0 <= f <= 1
+
+    winners[k] is the cheapest line from breakpoints[k - 1] (or 0) up to breakpoints[k] (or 1).
+    """
+    intercepts = np.asarray(intercepts, dtype=float)
+    slopes = np.asarray(slopes, dtype=float)
+    if not len(intercepts):
+        return [], []
+
+    # Cheapest line at f = 0, preferring the flattest one on ties so it stays cheapest longest
+    current = int(np.lexsort((slopes, intercepts))[0])
+    fraction = 0.0
+    breakpoints, winners = [], [current]
+    while True:
+        # Only flatter lines can overtake the current one as f grows; take the one that does so first
+        flatter = np.flatnonzero(slopes < slopes[current])
+        if not flatter.size:
+            break
+        crossings = (intercepts[flatter] - intercepts[current]) / (slopes[current] - slopes[flatter])
+        ahead = crossings > fraction
+        if not ahead.any():
+            break
+        candidates = flatter[ahead]
+        crossings = crossings[ahead]
+        first = crossings.min()
+        if first >= 1:
+            break
+        # Of the lines crossing at the same point, the flattest one wins beyond it
+        tied = candidates[crossings == first]
+        current = int(tied[np.argmin(slopes[tied])])
+        fraction = float(first)
+        breakpoints.append(fraction)
+        winners.append(current)
+    return breakpoints, winners
+
+
+class PlanIndex:
+    """Lower envelope of plan cost per kWh as a function of peak share, one per month column of a tariff model
+
+    For a plain two-period plan the cost of a bill is total kWh * (off-peak rate + peak share *
+    (peak rate - off-peak rate)), so the cheapest plain plan depends only on the peak share and is found
+    by bisecting the envelope's breakpoints. Plans with tiers, baseline credits or daily charges add a
+    term that depends on total usage, baseline allowance and days, so they are priced directly and
+    compared against the envelope's winner.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.version = model.version
+        self.codes = model.codes
+
+        plan_index = np.arange(len(self.codes))
+        tiered = np.zeros(len(self.codes), dtype=bool)
+        tiered[model.tiered_plans] = True
+        adjusted = tiered | (model.baseline_credits != 0) | (model.daily_charges != 0)
+        self.plain_plans = np.flatnonzero(~adjusted)
+        self.adjusted_plans = np.flatnonzero(adjusted)
+
+        # (13 x P) per-kWh lines for every month column, including the unknown month
+        seasons = model.season_of_month.T
+        self.intercepts = model.off_peak_rates[plan_index, seasons]
+        self.slopes = model.peak_rates[plan_index, seasons] - self.intercepts
+
+        self.breakpoints = []
+        self.winners = []
+        for month in range(self.intercepts.shape[0]):
+            breakpoints, winners = lower_envelope(self.intercepts[month, self.plain_plans],
+                                                  self.slopes[month, self.plain_plans])
+            self.breakpoints.append(breakpoints)
+            self.winners.append([int(self.plain_plans[w]) for w in winners])
+
+    def envelope_plan(self, peak_fraction, month=tariff_model.UNKNOWN_MONTH):
+        """Return the index of the cheapest plain plan at a peak share in O(log plans), or None without plain plans"""
+        winners = self.winners[month]
+        if not winners:
+            return None
+        return winners[bisect.bisect_right(self.breakpoints[month], peak_fraction)]
+
+    def plan_cost(self, plan, peak_kwh, off_peak_kwh, days=tariff_model.DEFAULT_BILLING_DAYS,
+                  month=tariff_model.UNKNOWN_MONTH, territory=None):
+        """Price one bill under a single plan, matching TariffModel.evaluate"""
+        model = self.model
+        total_kwh = peak_kwh + off_peak_kwh
+        season = model.season_of_month[plan, month]
+        territory_row = model.default_territory if territory is None else territory
+        baseline_season = 0 if month + 1 in tariff_model.BASELINE_SUMMER_MONTHS else 1
+        allowance = model.allowances[territory_row, baseline_season] * days
+
+        if plan in model.tiered_plans:
+            scale = max(allowance, 1e-9)
+            in_tier = np.minimum(np.maximum(total_kwh - model.tier_lower[plan, season] * scale, 0),
+                                 model.tier_width[plan, season] * scale)
+            energy = float((in_tier * model.tier_rates[plan, season]).sum())
+        else:
+            energy = peak_kwh * model.peak_rates[plan, season] + off_peak_kwh * model.off_peak_rates[plan, season]
+
+        credit = model.baseline_credits[plan] * min(total_kwh, allowance)
+        return float(energy - credit + model.daily_charges[plan] * days)
+
+    def best_plan(self, peak_kwh, off_peak_kwh, days=tariff_model.DEFAULT_BILLING_DAYS,
+                  month=tariff_model.UNKNOWN_MONTH, territory=None):
+        """Return (plan code, cost) of the cheapest plan for one bill without pricing every plan"""
+        total_kwh = peak_kwh + off_peak_kwh
+        peak_fraction = peak_kwh / total_kwh if total_kwh > 0 else 0.0
+
+        candidates = list(self.adjusted_plans)
+        winner = self.envelope_plan(peak_fraction, month)
+        if winner is not None:
+            candidates.append(winner)
+        costs = [self.plan_cost(p, peak_kwh, off_peak_kwh, days, month, territory) for p in candidates]
+        best = int(np.argmin(costs))
+        return self.codes[candidates[best]], costs[best]
+
+    def describe(self, month=tariff_model.UNKNOWN_MONTH):
+        """Return the envelope for a month column as [{'plan', 'from', 'to'}] peak share ranges for display"""
+        edges = [0.0] + self.breakpoints[month] + [1.0]
+        return [
+            {'plan': self.codes[plan], 'from': round(edges[k], 4), 'to': round(edges[k + 1], 4)}
+            for k, plan in enumerate(self.winners[month])
+        ]
+
+    def to_dict(self):
+        """Return every month's envelope, plus the plans priced outside it"""
+        return {
+            'catalogVersion': self.version,
+            'months': {MONTH_NAMES[month]: self.describe(month) for month in range(len(self.winners))},
+            'adjustedPlans': [self.codes[p] for p in self.adjusted_plans]
+        }
+
+
+# Indexes kept at once, one per catalog version or rate epoch, before the cache is cleared
+MAX_PLAN_INDEXES = 32
+
+_indexes = {}
+_index_lock = threading.Lock()
+
+
+def index_for(model):
+    """Return the plan index for a tariff model, building it the first time its version is seen"""
+    index = _indexes.get(model.version)
+    if index is None:
+        with _index_lock:
+            index = _indexes.get(model.version)
+            if index is None:
+                if len(_indexes) >= MAX_PLAN_INDEXES:
+                    _indexes.clear()
+                index = PlanIndex(model)
+                _indexes[model.version] = index
+    return index
+
+
+def get_index():
+    """Return the plan index for the current catalog version, rebuilding it only when the catalog changes"""
+    return index_for(tariff_model.get_model())
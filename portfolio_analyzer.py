@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+import annual_analysis
+import rate_history
+import tariff_model
+
+SUMMARY_COLUMNS = ['source', 'customer', 'address', 'current_plan', 'best_plan',
+                   'current_cost', 'best_cost', 'monthly_savings', 'annual_best_plan', 'yearly_savings',
+                   'catalog_version']
+
+
+def iter_bill_sources(source):
+    """Yield (source id, path or record) for every extracted bill in a directory or a JSON Lines store, without listing it all first"""
+    if os.path.isdir(source):
+        stack = [source]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.endswith('_extracted_data.json'):
+                        yield entry.path, entry.path
+    else:
+        # One extracted bill per line
+        with open(source, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield f"{source}:{line_number}", line
+
+
+def iter_batches(items, batch_size):
+    """Group an iterator into lists of batch_size"""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_bill(item):
+    """Load a bill from a file path or a JSON line"""
+    if item.lstrip().startswith('{'):
+        return json.loads(item)
+    with open(item, 'r') as f:
+        return json.load(f)
+
+
+def analyze_batch(batch):
+    """Rank every plan for a batch of bills in vectorized calls; runs in a worker process
+
+    Like the single-bill analysis, each bill is priced at the rates in effect during its billing period, and
+    yearly savings come from its annual projection against the plan that is cheapest over that year.
+    """
+    bills, sources, errors = [], [], []
+    for source_id, item in batch:
+        try:
+            bill = load_bill(item)
+            if not isinstance(bill, dict) or 'error' in bill:
+                raise ValueError('no extracted data')
+            bills.append(bill)
+            sources.append(source_id)
+        except (OSError, ValueError) as e:
+            errors.append((source_id, str(e)))
+
+    rows = []
+    if bills:
+        ranking = rate_history.rank_bills(bills)
+        codes = ranking['codes']
+        annual = annual_analysis.project_bills(bills, tariff_model.get_model())
+        for i, bill in enumerate(bills):
+            monthly_savings = float(ranking['savings'][i])
+            if np.isnan(annual[i]).any():
+                # Without a billing period there is no month to project the year from
+                annual_best, yearly_savings = ranking['bestIndex'][i], monthly_savings * 12
+            else:
+                annual_best = int(np.argmin(annual[i]))
+                current = ranking['currentIndex'][i] if ranking['currentKnown'][i] else annual_best
+                yearly_savings = float(annual[i, current] - annual[i, annual_best])
+            rows.append({
+                'source': sources[i],
+                'customer': bill.get('Name') or '',
+                'address': bill.get('Address') or '',
+                'current_plan': codes[ranking['currentIndex'][i]] if ranking['currentKnown'][i] else '',
+                'best_plan': codes[ranking['bestIndex'][i]],
+                'current_cost': round(float(ranking['currentCost'][i]), 2),
+                'best_cost': round(float(ranking['bestCost'][i]), 2),
+                'monthly_savings': round(monthly_savings, 2),
+                'annual_best_plan': codes[annual_best],
+                'yearly_savings': round(yearly_savings, 2),
+                'catalog_version': ranking['catalogVersion']
+            })
+    return rows, errors
+
+
+def load_completed_sources(output_file):
+    """Return the sources already written to an existing summary, so a rerun can resume"""
+    if not os.path.exists(output_file):
+        return set()
+    with open(output_file, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames and reader.fieldnames != SUMMARY_COLUMNS:
+            raise ValueError(f"{output_file} has different columns from this version; write a new summary instead")
+        return {row['source'] for row in reader}
+
+
+def run_portfolio(source, output_file, workers=None, batch_size=500, resume=False):
+    """Analyze every bill under source in parallel and write one summary row per bill"""
+    completed = load_completed_sources(output_file) if resume else set()
+    if completed:
+        print(f"Resuming: {len(completed)} bills already in {output_file}")
+
+    pending = ((source_id, item) for source_id, item in iter_bill_sources(source) if source_id not in completed)
+    batches = iter_batches(pending, batch_size)
+    workers = workers or os.cpu_count() or 1
+
+    start = time.monotonic()
+    processed = failed = 0
+    append = resume and os.path.exists(output_file) and os.path.getsize(output_file) > 0
+    with open(output_file, 'a' if append else 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        if not append:
+            writer.writeheader()
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded number of batches in flight so huge corpora are streamed, not loaded
+            in_flight = set()
+            for batch in batches:
+                in_flight.add(executor.submit(analyze_batch, batch))
+                if len(in_flight) >= workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    processed, failed = _write_results(done, writer, f, processed, failed, start)
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                processed, failed = _write_results(done, writer, f, processed, failed, start)
+
+    elapsed = time.monotonic() - start
+    print(f"Analyzed {processed} bills ({failed} skipped) in {elapsed:.1f}s. Summary saved to {output_file}")
+    return processed, failed
+
+
+def _write_results(futures, writer, output, processed, failed, start):
+    for future in futures:
+        rows, errors = future.result()
+        writer.writerows(rows)
+        for source_id, error in errors:
+            print(f"Skipping {source_id}: {error}")
+        processed += len(rows)
+        failed += len(errors)
+    # Flush after every batch so an interrupted run can resume from what's on disk
+    output.flush()
+    elapsed = time.monotonic() - start
+    rate = processed / elapsed if elapsed else 0
+    print(f"Progress: {processed} bills analyzed, {failed} skipped ({rate:.0f} bills/s)")
+    return processed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rank rate plans for every extracted bill in a directory or JSON Lines store')
+    parser.add_argument('source', nargs='?', default='extracted_data',
+                        help='directory of *_extracted_data.json files (searched recursively) or a .jsonl file of bills')
+    parser.add_argument('--output', default='portfolio_summary.csv', help='summary CSV to write')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per core)')
+    parser.add_argument('--batch-size', type=int, default=500, help='bills priced per vectorized call')
+    parser.add_argument('--resume', action='store_true', help='skip bills already in the output file and append')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(f"Error: {args.source} not found.")
+        return
+
+    run_portfolio(args.source, args.output, args.workers, args.batch_size, args.resume)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,12 @@
 import os
 import json
+import argparse
 import requests
 import base64
-import fitz  # PyMuPDF
-import openai
 from dotenv import load_dotenv
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import llm_extraction
 
 # Import rate plan analyzer
 try:
@@ -20,10 +21,13 @@ load_dotenv()
 
 # Set up API keys
 ocr_space_api_key = os.getenv("OCR_SPACE_API_KEY", "K86742198888957")  # Default key or from env
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# OpenAI reads OPENAI_API_KEY from the environment when llm_extraction first imports it
 
-def extract_ocr_text(pdf_file):
-    """Extract text from a PDF file using OCR.space API"""
+# Bump whenever the extraction prompt, fields or patterns change so saved bills can be re-extracted
+EXTRACTOR_VERSION = 2
+
+def extract_ocr_text(pdf_file, on_page=None):
+    """Extract text from a PDF file using OCR.space API, calling on_page(page number, page count) after each page"""
     print(f"Processing PDF file: {pdf_file}")
     
     # Generate output filenames based on input PDF name
@@ -36,6 +40,9 @@ def extract_ocr_text(pdf_file):
         print(f"Error: PDF file {pdf_file} not found.")
         return None, None
     
+    # PyMuPDF is only loaded once a PDF is actually processed, keeping it out of web app startup
+    import fitz
+
     # Open the PDF
     pdf_document = fitz.open(pdf_file)
     page_count = pdf_document.page_count
@@ -82,6 +89,9 @@ def extract_ocr_text(pdf_file):
                 print(f"Error processing page {page_num + 1}: {error_msg}")
         except Exception as e:
             print(f"Exception processing page {page_num + 1}: {str(e)}")
+        
+        if on_page:
+            on_page(page_num + 1, page_count)
     
     # Close the PDF
     pdf_document.close()
@@ -97,7 +107,7 @@ def extract_ocr_text(pdf_file):
     print(f"OCR processing complete. Text saved to {text_output}")
     return text_output, json_output
 
-def extract_bill_data_with_openai(ocr_text_file, output_folder='extracted_data'):
+def extract_bill_data_with_openai(ocr_text_file, output_folder='extracted_data', on_field=None, client=None):
     """Extract specific bill data using OpenAI API"""
     print(f"Analyzing OCR text with OpenAI: {ocr_text_file}")
     
@@ -105,62 +115,19 @@ def extract_bill_data_with_openai(ocr_text_file, output_folder='extracted_data')
     with open(ocr_text_file, 'r', encoding='utf-8') as f:
         ocr_text = f.read()
     
-    # Create a prompt for OpenAI
-    prompt = f"""
-    Extract the following information from this PG&E bill OCR text. Return the results as a JSON object with these fields:
-    1. Name (the customer name)
-    2. Address (full service address including city, state, zip)
-    3. RateSchedule (the rate schedule code and description)
-    4. ElectricUsageThisPeriod (total kWh used in the billing period)
-    5. BillingDays (number of days in the billing period)
-    6. PeakUsage (peak usage in kWh)
-    7. PeakRate (the rate charged for peak usage, e.g. $0.49378/kWh)
-    8. PeakTotal (total amount charged for peak usage, e.g. $85.82)
-    9. OffPeakUsage (off-peak usage in kWh)
-    10. OffPeakRate (the rate charged for off-peak usage, e.g. $0.46378/kWh)
-    11. OffPeakTotal (total amount charged for off-peak usage, e.g. $224.97)
-    12. BillingPeriod (the billing period dates, e.g. "01/01/2025 - 01/31/2025")
-    13. TotalAmountDue (the total amount due on the bill)
-    
-    Look for the 'Energy Charges' section of the bill, which typically contains the peak and off-peak usage information.
-    If any field cannot be found, return null for that field.
-    
-    OCR Text:
-    {ocr_text}
-    """
-    
-    # Call OpenAI API
-    response = openai.chat.completions.create(
+    # Print each field as soon as the streamed response completes it
+    def report_field(name, value):
+        print(f"Received {name}: {value}")
+        if on_field:
+            on_field(name, value)
+    
+    # Stream a JSON-mode completion; malformed fields are retried individually
+    return llm_extraction.stream_bill_fields(
+        ocr_text,
         model="gpt-3.5-turbo",  # Using gpt-3.5-turbo which is more widely available
-        messages=[
-            {"role": "system", "content": "You are a utility bill data extraction assistant. Extract the requested information accurately from the OCR text of a PG&E bill. Return your response as a valid JSON object."},
-            {"role": "user", "content": prompt}
-        ],
-        temperature=0.0  # Use low temperature for more deterministic results
+        client=client,
+        on_field=report_field
     )
-    
-    # Extract and parse the response
-    result = response.choices[0].message.content
-    
-    # Print raw response for debugging
-    print("\nRaw OpenAI API Response:")
-    print(result)
-    
-    # Clean the response - remove markdown code block markers if present
-    cleaned_result = result
-    if result.startswith("```json") and result.endswith("```"):
-        cleaned_result = result[7:-3].strip()  # Remove ```json and ``` markers
-    elif result.startswith("```") and result.endswith("```"):
-        cleaned_result = result[3:-3].strip()  # Remove ``` markers
-    
-    # Parse JSON response
-    try:
-        parsed_result = json.loads(cleaned_result)
-        return parsed_result
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON response: {e}")
-        print(f"Cleaned result: {cleaned_result}")
-        return {"error": "Failed to parse API response"}
 
 def ensure_folders_exist():
     """Ensure all required folders exist"""
@@ -181,6 +148,89 @@ def is_bill_already_processed(pdf_filename):
     processed_bills = get_processed_bill_list()
     return os.path.basename(pdf_filename) in processed_bills
 
+def get_extractor_version(extracted_data_file):
+    """Return the extractor version a saved _extracted_data.json was produced with (0 if unstamped)"""
+    try:
+        with open(extracted_data_file, 'r') as f:
+            return json.load(f).get('ExtractorVersion', 0)
+    except (FileNotFoundError, json.JSONDecodeError, AttributeError):
+        return 0
+
+def print_extracted_data(extracted_data):
+    """Print the extracted bill fields"""
+    print("\nExtracted Information:")
+    print("=======================")
+    print(f"Name: {extracted_data.get('Name', 'Not found')}")
+    print(f"Address: {extracted_data.get('Address', 'Not found')}")
+    print(f"Rate Schedule: {extracted_data.get('RateSchedule', 'Not found')}")
+    print(f"Billing Period: {extracted_data.get('BillingPeriod', 'Not found')}")
+    print(f"Electric Usage This Period: {extracted_data.get('ElectricUsageThisPeriod', 'Not found')} kWh")
+    print(f"Billing Days: {extracted_data.get('BillingDays', 'Not found')}")
+    
+    print("\nEnergy Usage Details:")
+    print("=======================")
+    print(f"Peak Usage: {extracted_data.get('PeakUsage', 'Not found')} kWh")
+    print(f"Peak Rate: {extracted_data.get('PeakRate', 'Not found')}")
+    print(f"Peak Total: {extracted_data.get('PeakTotal', 'Not found')}")
+    print(f"Off-Peak Usage: {extracted_data.get('OffPeakUsage', 'Not found')} kWh")
+    print(f"Off-Peak Rate: {extracted_data.get('OffPeakRate', 'Not found')}")
+    print(f"Off-Peak Total: {extracted_data.get('OffPeakTotal', 'Not found')}")
+    print(f"\nTotal Amount Due: {extracted_data.get('TotalAmountDue', 'Not found')}")
+
+def analyze_extracted_data(extracted_data, base_name):
+    """Run rate plan analysis on extracted data and save it next to the extracted data"""
+    if not RATE_ANALYSIS_AVAILABLE:
+        return None
+    
+    try:
+        print("\nAnalyzing rate plans...")
+        analysis = rate_plan_analyzer.analyze_bill(extracted_data)
+        
+        # Save the analysis results
+        analysis_file = os.path.join('extracted_data', f"{base_name}_rate_analysis.json")
+        with open(analysis_file, 'w') as f:
+            json.dump(analysis, f, indent=4)
+        
+        print("\nRate Plan Analysis:")
+        print("====================")
+        print(f"Current Plan: {analysis['currentPlan']} - {analysis['currentPlanDescription']}")
+        print(f"Current Cost: ${analysis['currentCost']}")
+        print(f"Best Plan: {analysis['bestPlan']} - {analysis['bestPlanDescription']}")
+        print(f"Best Cost: ${analysis['bestCost']}")
+        print(f"Estimated Monthly Savings: ${analysis['monthlySavings']}")
+        print(f"Estimated Yearly Savings: ${analysis['yearlySavings']}")
+        print("\nRecommendation:")
+        print(analysis['recommendation'])
+        
+        print(f"\nAnalysis saved to: {analysis_file}")
+        return analysis
+    except Exception as e:
+        print(f"Error during rate plan analysis: {e}")
+        return None
+
+def save_extracted_data(extracted_data, base_name):
+    """Stamp extracted bill data with the extractor version and save it as <base_name>_extracted_data.json"""
+    extracted_data['ExtractorVersion'] = EXTRACTOR_VERSION
+    output_file = os.path.join('extracted_data', f"{base_name}_extracted_data.json")
+    with open(output_file, 'w') as f:
+        json.dump(extracted_data, f, indent=4)
+    return output_file
+
+def extract_and_analyze(ocr_text_file, base_name):
+    """Run the extraction and analysis stages on existing OCR text"""
+    extracted_data = extract_bill_data_with_openai(ocr_text_file)
+    if not extracted_data or 'error' in extracted_data:
+        # Keep any earlier extraction and its analysis; a failed run (often a transient API error) replaces neither
+        print(f"Extraction failed for {base_name}: {(extracted_data or {}).get('error', 'no data returned')}")
+        return extracted_data
+    output_file = save_extracted_data(extracted_data, base_name)
+    
+    print_extracted_data(extracted_data)
+    print(f"\nProcessing complete! Results saved to {output_file}")
+    
+    analyze_extracted_data(extracted_data, base_name)
+    return extracted_data
+
 def process_bill(pdf_file):
     """Process a bill from PDF to structured data in one go"""
     # Ensure all required folders exist
@@ -196,10 +246,7 @@ def process_bill(pdf_file):
         print("OCR text extraction failed. Cannot proceed.")
         return None
     
-    # Step 2: Analyze OCR text with OpenAI
-    extracted_data = extract_bill_data_with_openai(ocr_text_file)
-    
-    # Step 3: Move the processed PDF to the processed_bills folder
+    # Step 2: Move the processed PDF to the processed_bills folder
     processed_pdf_path = os.path.join('processed_bills', os.path.basename(pdf_file))
     try:
         import shutil
@@ -208,65 +255,71 @@ def process_bill(pdf_file):
     except Exception as e:
         print(f"Warning: Could not move PDF file: {e}")
     
-    # Generate output filename based on input PDF name
+    # Step 3: Extract bill data from the OCR text and analyze rate plans
     base_name = os.path.splitext(os.path.basename(pdf_file))[0]
-    output_file = os.path.join('extracted_data', f"{base_name}_extracted_data.json")
-    
-    # Save results to a JSON file
-    with open(output_file, 'w') as f:
-        json.dump(extracted_data, f, indent=4)
-    
-    # Print formatted results
-    print("\nExtracted Information:")
-    print("=======================")
-    print(f"Name: {extracted_data.get('Name', 'Not found')}")
-    print(f"Address: {extracted_data.get('Address', 'Not found')}")
-    print(f"Rate Schedule: {extracted_data.get('RateSchedule', 'Not found')}")
-    print(f"Billing Period: {extracted_data.get('BillingPeriod', 'Not found')}")
-    print(f"Electric Usage This Period: {extracted_data.get('ElectricUsageThisPeriod', 'Not found')} kWh")
-    print(f"Billing Days: {extracted_data.get('BillingDays', 'Not found')}")
-    
-    print("\nEnergy Usage Details:")
-    print("=======================")
-    print(f"Peak Usage: {extracted_data.get('PeakUsage', 'Not found')} kWh")
-    print(f"Peak Rate: {extracted_data.get('PeakRate', 'Not found')}")
-    print(f"Peak Total: {extracted_data.get('PeakTotal', 'Not found')}")
-    print(f"Off-Peak Usage: {extracted_data.get('OffPeakUsage', 'Not found')} kWh")
-    print(f"Off-Peak Rate: {extracted_data.get('OffPeakRate', 'Not found')}")
-    print(f"Off-Peak Total: {extracted_data.get('OffPeakTotal', 'Not found')}")
-    print(f"\nTotal Amount Due: {extracted_data.get('TotalAmountDue', 'Not found')}")
-    
-    print(f"\nProcessing complete! Results saved to {output_file}")
+    return extract_and_analyze(ocr_text_file, base_name)
+
+def find_stale_bills(force=False):
+    """Return base names of bills with cached OCR text whose extracted data is missing or from an older extractor"""
+    if not os.path.exists('ocr_output'):
+        return []
     
-    # Perform rate plan analysis if available
-    if RATE_ANALYSIS_AVAILABLE:
-        try:
-            print("\nAnalyzing rate plans...")
-            analysis = rate_plan_analyzer.analyze_bill_with_openai(extracted_data)
-            
-            # Save the analysis results
-            analysis_file = os.path.join('extracted_data', f"{base_name}_rate_analysis.json")
-            with open(analysis_file, 'w') as f:
-                json.dump(analysis, f, indent=4)
-            
-            print("\nRate Plan Analysis:")
-            print("====================")
-            print(f"Current Plan: {analysis['currentPlan']} - {analysis['currentPlanDescription']}")
-            print(f"Current Cost: ${analysis['currentCost']}")
-            print(f"Best Plan: {analysis['bestPlan']} - {analysis['bestPlanDescription']}")
-            print(f"Best Cost: ${analysis['bestCost']}")
-            print(f"Estimated Monthly Savings: ${analysis['monthlySavings']}")
-            print(f"Estimated Yearly Savings: ${analysis['yearlySavings']}")
-            print("\nRecommendation:")
-            print(analysis['recommendation'])
-            
-            print(f"\nAnalysis saved to: {analysis_file}")
-        except Exception as e:
-            print(f"Error during rate plan analysis: {e}")
+    stale = []
+    for file_name in sorted(os.listdir('ocr_output')):
+        if not file_name.endswith('_ocr_text.txt'):
+            continue
+        base_name = file_name[:-len('_ocr_text.txt')]
+        extracted_file = os.path.join('extracted_data', f"{base_name}_extracted_data.json")
+        if force or get_extractor_version(extracted_file) < EXTRACTOR_VERSION:
+            stale.append(base_name)
+    return stale
+
+def reextract_bill(base_name):
+    """Re-run extraction and analysis for one bill from its cached OCR text, without re-OCRing the PDF"""
+    ocr_text_file = os.path.join('ocr_output', f"{base_name}_ocr_text.txt")
+    print(f"Re-extracting {base_name} from {ocr_text_file}")
+    return extract_and_analyze(ocr_text_file, base_name)
+
+def reextract_stale_bills(max_workers=4, force=False):
+    """Re-extract every bill whose extractor version is stale, in parallel"""
+    ensure_folders_exist()
     
-    return extracted_data
+    stale_bills = find_stale_bills(force)
+    if not stale_bills:
+        print(f"All bills are up to date with extractor version {EXTRACTOR_VERSION}.")
+        return {}
+    
+    print(f"Re-extracting {len(stale_bills)} bills with extractor version {EXTRACTOR_VERSION} using {max_workers} workers.")
+    results = {}
+    # Extraction is dominated by API latency, so threads are enough to overlap the calls
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(reextract_bill, base_name): base_name for base_name in stale_bills}
+        for future in as_completed(futures):
+            base_name = futures[future]
+            try:
+                results[base_name] = future.result()
+            except Exception as e:
+                print(f"Error re-extracting {base_name}: {e}")
+                results[base_name] = {"error": str(e)}
+    
+    failed = [name for name, data in results.items() if not data or 'error' in data]
+    print(f"\nRe-extracted {len(results) - len(failed)}/{len(results)} bills.")
+    if failed:
+        print(f"Failed: {', '.join(sorted(failed))}")
+    return results
 
 def main():
+    parser = argparse.ArgumentParser(description='Process PG&E bills from bills_to_process')
+    parser.add_argument('--reextract', action='store_true',
+                        help='re-run extraction and analysis from cached OCR text for bills with a stale extractor version')
+    parser.add_argument('--force', action='store_true', help='with --reextract, re-extract every bill regardless of version')
+    parser.add_argument('--workers', type=int, default=4, help='number of bills to re-extract in parallel')
+    args = parser.parse_args()
+    
+    if args.reextract:
+        reextract_stale_bills(max_workers=args.workers, force=args.force)
+        return
+    
     # Ensure all required folders exist
     ensure_folders_exist()
     
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import rate_code_resolver
+
+RATE_PLANS_FILE = rate_code_resolver.RATE_PLANS_FILE
+
+# Seconds between checks of rate_plans.json for changes
+CHECK_INTERVAL = 2.0
+
+# Used when rate_plans.json can't be read and no earlier version is loaded
+FALLBACK_RATE_PLANS = {
+    "ETOUB": {
+        "name": "E-TOU-B",
+        "description": "Time-of-Use (4-9pm Peak)",
+        "season": "Winter",
+        "peakRate": 0.42,
+        "offPeakRate": 0.33,
+        "peakHours": "4pm-9pm",
+        "notes": "Winter TOU rate"
+    }
+}
+
+
+class CatalogSnapshot:
+    """One immutable version of the rate plan catalog with its indexes"""
+
+    def __init__(self, rate_plans, version, mtime=None, size=None):
+        self.plans = rate_plans
+        self.version = version
+        self.mtime = mtime
+        self.size = size
+        self.resolver = rate_code_resolver.RateCodeResolver(rate_plans)
+        # Plans that aren't aliases of another plan, in catalog order
+        self.canonical_plans = {
+            code: details for code, details in rate_plans.items()
+            if details.get('alias', code) == code or details.get('alias') not in rate_plans
+        }
+
+
+class RateCatalog:
+    """The rate plan catalog, loaded once and reloaded only when rate_plans.json changes"""
+
+    def __init__(self, path=RATE_PLANS_FILE, check_interval=CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._last_check = 0.0
+        self.refresh(force=True)
+
+    def refresh(self, force=False):
+        """Reload the catalog if the file's mtime or content hash changed; return the current snapshot"""
+        now = time.monotonic()
+        snapshot = self._snapshot
+        if not force and snapshot is not None and now - self._last_check < self.check_interval:
+            return snapshot
+
+        with self._lock:
+            self._last_check = now
+            try:
+                stat = os.stat(self.path)
+            except OSError as e:
+                if self._snapshot is None:
+                    print(f"Error loading rate plans: {e}")
+                    self._snapshot = CatalogSnapshot(FALLBACK_RATE_PLANS, 'fallback')
+                return self._snapshot
+
+            snapshot = self._snapshot
+            if snapshot is not None and (stat.st_mtime, stat.st_size) == (snapshot.mtime, snapshot.size):
+                return snapshot
+
+            try:
+                with open(self.path, 'rb') as f:
+                    raw = f.read()
+                version = hashlib.sha256(raw).hexdigest()[:12]
+                if snapshot is not None and version == snapshot.version:
+                    # Touched but not edited: keep the indexes, remember the new mtime
+                    snapshot.mtime, snapshot.size = stat.st_mtime, stat.st_size
+                    return snapshot
+                rate_plans = json.loads(raw.decode('utf-8'))
+            except (OSError, UnicodeDecodeError, json.JSONDecodeError) as e:
+                print(f"Error loading rate plans: {e}")
+                if self._snapshot is None:
+                    self._snapshot = CatalogSnapshot(FALLBACK_RATE_PLANS, 'fallback')
+                return self._snapshot
+
+            self._snapshot = CatalogSnapshot(rate_plans, version, stat.st_mtime, stat.st_size)
+            print(f"Loaded rate plan catalog version {version} ({len(rate_plans)} plans)")
+            return self._snapshot
+
+    @property
+    def version(self):
+        return self.refresh().version
+
+    @property
+    def plans(self):
+        return self.refresh().plans
+
+    @property
+    def canonical_plans(self):
+        return self.refresh().canonical_plans
+
+    @property
+    def resolver(self):
+        return self.refresh().resolver
+
+    def plan_details(self, rate_code):
+        """Return the canonical plan's details for a raw rate code, or None"""
+        return self.resolver.plan_details(rate_code)
+
+    def display_name(self, plan_code):
+        """Return the name a plan is shown under (E-TOU-B for ETOUB)"""
+        details = self.plans.get(plan_code, {})
+        return details.get('name', plan_code)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Return the shared catalog for rate_plans.json"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = RateCatalog()
+    return _catalog
@@ -0,0 +1,104 @@
+import os
+import re
+
+# Character sequences OCR commonly produces in place of the real ones, mapped to
+# a shared representative. Multi-character sequences are applied first.
+OCR_CONFUSIONS = [
+    ('IJ', 'U'),  # U split into two strokes (ETOIJ3)
+    ('LJ', 'U'),
+    ('I', 'U'),
+    ('0', 'O'),
+    ('J', 'B'),
+    ('3', 'B'),
+    ('8', 'B'),
+]
+
+# Match confidences by how the code was found
+EXACT_CONFIDENCE = 1.0
+ALIAS_CONFIDENCE = 0.95
+OCR_CONFIDENCE = 0.8
+
+# Lowest confidence canonical_code and plan_details accept as a match
+MIN_CONFIDENCE = float(os.getenv("RATE_CODE_MIN_CONFIDENCE", str(OCR_CONFIDENCE)))
+
+RATE_PLANS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rate_plans.json')
+
+
+def normalize_rate_code(rate_code):
+    """Uppercase a rate code and drop everything except letters and digits"""
+    return re.sub(r'[^A-Z0-9]', '', str(rate_code or '').upper())
+
+
+def ocr_skeleton(rate_code):
+    """Collapse characters OCR tends to confuse so misreads share a key with the real code"""
+    skeleton = normalize_rate_code(rate_code)
+    for source, target in OCR_CONFUSIONS:
+        skeleton = skeleton.replace(source, target)
+    return skeleton
+
+
+class RateCodeResolver:
+    """Map raw rate codes from bills onto canonical plan codes using indexes built once from the catalog"""
+
+    def __init__(self, rate_plans):
+        self.plans = rate_plans
+        self.exact = {}
+        self.ocr = {}
+        ambiguous = set()
+
+        for code, details in rate_plans.items():
+            canonical = details.get('alias', code)
+            if canonical not in rate_plans:
+                canonical = code
+            confidence = EXACT_CONFIDENCE if canonical == code else ALIAS_CONFIDENCE
+            self.exact[normalize_rate_code(code)] = (canonical, confidence)
+
+        for key, (canonical, _) in self.exact.items():
+            skeleton = ocr_skeleton(key)
+            if skeleton in self.ocr and self.ocr[skeleton] != canonical:
+                ambiguous.add(skeleton)
+            self.ocr[skeleton] = canonical
+
+        # Skeletons shared by two different plans can't tell them apart
+        for skeleton in ambiguous:
+            del self.ocr[skeleton]
+
+    def resolve(self, rate_code):
+        """Return {'code', 'confidence', 'matchType'} for a raw rate code"""
+        # Only the code itself, not the description that often follows it
+        raw = str(rate_code or '').strip().split()
+        normalized = normalize_rate_code(raw[0] if raw else '')
+
+        if normalized in self.exact:
+            canonical, confidence = self.exact[normalized]
+            match_type = 'exact' if confidence == EXACT_CONFIDENCE else 'alias'
+            return {'code': canonical, 'confidence': confidence, 'matchType': match_type}
+
+        skeleton = ocr_skeleton(normalized)
+        if skeleton in self.ocr:
+            return {'code': self.ocr[skeleton], 'confidence': OCR_CONFIDENCE, 'matchType': 'ocr'}
+
+        # No prefix fallback: punctuation noise is already dropped by normalizing, and a trailing
+        # letter or digit usually names a different schedule (E19 is not E-1)
+        return {'code': None, 'confidence': 0.0, 'matchType': None}
+
+    def canonical_code(self, rate_code, default=None, min_confidence=MIN_CONFIDENCE):
+        """Return just the canonical code, or default when nothing matches with at least min_confidence"""
+        match = self.resolve(rate_code)
+        return match['code'] if match['code'] and match['confidence'] >= min_confidence else default
+
+    def plan_details(self, rate_code, min_confidence=MIN_CONFIDENCE):
+        """Return the canonical plan's details, or None when nothing matches with at least min_confidence"""
+        code = self.canonical_code(rate_code, min_confidence=min_confidence)
+        return self.plans.get(code) if code else None
+
+
+def get_default_resolver():
+    """Return the resolver for the shared rate plan catalog"""
+    import rate_catalog  # Imported here because rate_catalog builds on this module
+    return rate_catalog.get_catalog().resolver
+
+
+def resolve_rate_code(rate_code):
+    """Resolve a raw rate code against the default catalog"""
+    return get_default_resolver().resolve(rate_code)
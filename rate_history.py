@@ -0,0 +1,232 @@
+import bisect
+import sys
+import threading
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import cost_engine
+import rate_catalog
+import tariff_model
+
+
+def parse_date(value):
+    """Parse 'YYYY-MM-DD' or 'MM/DD/YYYY' into a date, or None"""
+    for date_format in ('%Y-%m-%d', '%m/%d/%Y'):
+        try:
+            return datetime.strptime(str(value).strip(), date_format).date()
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def parse_billing_period(billing_period):
+    """Return (first day, last day) of a 'MM/DD/YYYY - MM/DD/YYYY' or ISO-dated billing period, or None"""
+    dates = [parse_date(text) for text in tariff_model.BILLING_DATE.findall(str(billing_period or ''))[:2]]
+    if len(dates) < 2 or None in dates or dates[1] < dates[0]:
+        return None
+    return dates[0], dates[1]
+
+
+def plan_versions(details):
+    """Return [(effective date, plan details)] for a plan, oldest first; history entries override the current fields"""
+    current = {key: value for key, value in details.items() if key != 'history'}
+    versions = []
+    for entry in details.get('history', []):
+        effective = parse_date(entry.get('effectiveFrom'))
+        if effective:
+            versions.append((effective, dict(current, **entry)))
+    versions.append((parse_date(details.get('effectiveFrom')) or date.min, current))
+    return sorted(versions, key=lambda version: version[0])
+
+
+class EffectiveDatedCatalog:
+    """Catalog versions indexed by effective date, with one compiled tariff model per rate epoch"""
+
+    def __init__(self, rate_plans, version=None, baselines=None):
+        self.version = version
+        self.codes = list(rate_plans)
+        self.baselines = baselines or tariff_model.load_baselines()
+        self.plan_versions = {code: plan_versions(details) for code, details in rate_plans.items()}
+
+        # Every date on which any plan changes starts a new epoch; epoch 0 runs from the beginning of time
+        change_dates = sorted({effective for versions in self.plan_versions.values()
+                               for effective, _ in versions if effective != date.min})
+        self.boundaries = [date.min] + change_dates
+        self._boundary_ordinals = [boundary.toordinal() for boundary in self.boundaries]
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def epoch_index(self, day):
+        """Return the epoch in effect on a day in O(log epochs)"""
+        return max(bisect.bisect_right(self._boundary_ordinals, day.toordinal()) - 1, 0)
+
+    def plans_at(self, epoch):
+        """Return {code: details} for every plan as it stood during an epoch"""
+        start = self.boundaries[epoch]
+        plans = {}
+        for code, versions in self.plan_versions.items():
+            # The latest version effective by the start of the epoch, or the oldest one for earlier dates
+            effective_dates = [effective for effective, _ in versions]
+            index = bisect.bisect_right(effective_dates, start) - 1
+            plans[code] = versions[max(index, 0)][1]
+        return plans
+
+    def model(self, epoch):
+        """Return the tariff model for an epoch, compiling it the first time it is needed"""
+        model = self._models.get(epoch)
+        if model is None:
+            with self._lock:
+                model = self._models.get(epoch)
+                if model is None:
+                    version = f"{self.version}@{self.boundaries[epoch].isoformat()}"
+                    model = tariff_model.TariffModel(self.plans_at(epoch), self.baselines, version)
+                    self._models[epoch] = model
+        return model
+
+    def segments(self, first_day, last_day):
+        """Split an inclusive date range at rate changes into [(epoch, first day, last day)]"""
+        segments = []
+        epoch = self.epoch_index(first_day)
+        segment_start = first_day
+        while True:
+            next_boundary = self.boundaries[epoch + 1] if epoch + 1 < len(self.boundaries) else None
+            if next_boundary is None or next_boundary > last_day:
+                segments.append((epoch, segment_start, last_day))
+                return segments
+            segments.append((epoch, segment_start, next_boundary - timedelta(days=1)))
+            segment_start = next_boundary
+            epoch += 1
+
+    def model_for_period(self, first_day, last_day):
+        """Return the tariff model for the epoch covering most of an inclusive date range"""
+        epoch, _, _ = max(self.segments(first_day, last_day), key=lambda segment: (segment[2] - segment[1]).days)
+        return self.model(epoch)
+
+    def evaluate_period(self, peak_kwh, off_peak_kwh, first_day, last_day, territory=None):
+        """Price one bill's usage under every plan with the rates in effect, prorated by day across rate changes"""
+        segments = self.segments(first_day, last_day)
+        total_days = (last_day - first_day).days + 1
+        territory_rows = None
+        result = None
+
+        for epoch, segment_start, segment_end in segments:
+            model = self.model(epoch)
+            if territory_rows is None:
+                territory_rows = model.territory_indexes([territory])
+            days = (segment_end - segment_start).days + 1
+            share = days / total_days
+            middle = segment_start + (segment_end - segment_start) / 2
+            costs = model.evaluate([peak_kwh * share], [off_peak_kwh * share], days=[days],
+                                   months=[middle.month - 1], territories=territory_rows)
+            if result is None:
+                result = {key: value for key, value in costs.items() if isinstance(value, np.ndarray)}
+            else:
+                for key in result:
+                    result[key] = result[key] + costs[key]
+
+        result['codes'] = self.codes
+        result['catalogVersion'] = self.version
+        result['rateVersions'] = [
+            {'effectiveFrom': self.boundaries[epoch].isoformat() if epoch else None,
+             'from': segment_start.isoformat(), 'to': segment_end.isoformat()}
+            for epoch, segment_start, segment_end in segments
+        ]
+        return result
+
+    def evaluate_bills(self, bills, fallback_model=None):
+        """Price extracted bills under every plan with the rates in effect during each one, prorated like evaluate_period
+
+        Bill segments are grouped by rate epoch so each epoch's model prices all of them in one call. Bills whose
+        billing period can't be read are priced by fallback_model, the current rates by default. Returns (N x P) totals.
+        """
+        usage = cost_engine.usage_matrix(bills)
+        totals = np.zeros((len(bills), len(self.codes)))
+        segments_by_epoch = {}
+        undated = []
+        for i, bill in enumerate(bills):
+            billing_period = parse_billing_period(bill.get('BillingPeriod'))
+            if not billing_period:
+                undated.append(i)
+                continue
+            total_days = (billing_period[1] - billing_period[0]).days + 1
+            for epoch, segment_start, segment_end in self.segments(*billing_period):
+                days = (segment_end - segment_start).days + 1
+                share = days / total_days
+                middle = segment_start + (segment_end - segment_start) / 2
+                segments_by_epoch.setdefault(epoch, []).append(
+                    (i, usage[i, 0] * share, usage[i, 1] * share, days, middle.month - 1, bill.get('BaselineTerritory'))
+                )
+
+        for epoch, segments in segments_by_epoch.items():
+            model = self.model(epoch)
+            rows, peak, off_peak, days, months, territories = zip(*segments)
+            costs = model.evaluate(peak, off_peak, days, months, model.territory_indexes(territories))['totalCost']
+            np.add.at(totals, list(rows), costs)
+
+        if undated:
+            model = fallback_model or tariff_model.get_model()
+            totals[undated] = model.evaluate_bills([bills[i] for i in undated])['totalCost']
+        return totals
+
+
+def rank_bills(bills):
+    """Price extracted bills at the rates in effect during each billing period and rank the plans for each bill"""
+    dated = get_dated_catalog()
+    model = tariff_model.get_model()
+    resolver = rate_catalog.get_catalog().resolver
+    index = {code: i for i, code in enumerate(dated.codes)}
+    current_plans = [index.get(resolver.canonical_code(cost_engine.rate_code(bill)), -1) for bill in bills]
+    result = cost_engine.rank_costs(dated.evaluate_bills(bills, model), current_plans)
+    result['codes'] = dated.codes
+    result['catalogVersion'] = dated.version
+    return result
+
+
+_dated_catalog = None
+_dated_catalog_lock = threading.Lock()
+
+
+def get_dated_catalog():
+    """Return the effective-dated catalog for the current catalog version, rebuilding it only when the catalog changes"""
+    global _dated_catalog
+    snapshot = rate_catalog.get_catalog().refresh()
+    dated = _dated_catalog
+    if dated is None or dated.version != snapshot.version:
+        with _dated_catalog_lock:
+            if _dated_catalog is None or _dated_catalog.version != snapshot.version:
+                _dated_catalog = EffectiveDatedCatalog(snapshot.canonical_plans, snapshot.version)
+            dated = _dated_catalog
+    return dated
+
+
+def check_date_formats():
+    """Return the billing periods whose bill-printed and ISO spellings price differently; empty when they all agree"""
+    mismatches = []
+    dated = get_dated_catalog()
+    for first_day in (date(2023, 12, 20), date(2024, 1, 15), date(2024, 6, 1), date(2024, 11, 4)):
+        last_day = first_day + timedelta(days=30)
+        printed = f"{first_day:%m/%d/%Y} - {last_day:%m/%d/%Y}"
+        iso = f"{first_day.isoformat()} - {last_day.isoformat()}"
+        periods = [parse_billing_period(printed), parse_billing_period(iso)]
+        months = [tariff_model.billing_month(printed), tariff_model.billing_month(iso)]
+        if None in periods or periods[0] != periods[1] or months[0] != months[1]:
+            mismatches.append(printed)
+            continue
+        costs = [dated.evaluate_period(120, 480, *period)['totalCost'] for period in periods]
+        if not np.allclose(costs[0], costs[1]):
+            mismatches.append(printed)
+    return mismatches
+
+
+def main():
+    mismatches = check_date_formats()
+    for billing_period in mismatches:
+        print(f"MM/DD/YYYY and YYYY-MM-DD spellings of {billing_period} price differently")
+    if not mismatches:
+        print("Bill-printed and ISO billing periods price identically.")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,21 +3,26 @@
 import os
 import json
 from datetime import datetime
-import openai
 from dotenv import load_dotenv
+import rate_catalog
+import cost_engine
+import tariff_model
+import recommendations
+import rate_history
+import scenario_simulator
+import plan_index
+import analysis_cache
+import annual_analysis
 
 # Load environment variables
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# Monte Carlo samples per EV/solar scenario run with each analysis
+SCENARIO_SAMPLES = int(os.getenv("SCENARIO_SAMPLES", "2000"))
 
 def load_rate_plans():
-    """Load rate plans from the JSON file"""
-    try:
-        with open('rate_plans.json', 'r') as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"Error loading rate plans: {e}")
-        return {}
+    """Return the rate plans from the shared catalog (reloaded only when rate_plans.json changes)"""
+    return rate_catalog.get_catalog().plans
 
 def calculate_cost_for_plan(rate_plan, peak_usage, off_peak_usage):
     """Calculate the cost for a specific rate plan"""
@@ -47,24 +52,42 @@ def analyze_rate_plans(bill_data):
         elif isinstance(rate_schedule, str):
             current_rate_code = rate_schedule.split()[0]  # Extract just the code part
             
-        # Clean up the rate code (handle OCR misreads)
-        if current_rate_code == 'ETOIJ3':
-            current_rate_code = 'ETOUB'
-            
-        # Load rate plans
-        rate_plans = load_rate_plans()
+        # Use one catalog version for the whole analysis
+        catalog = rate_catalog.get_catalog().refresh()
+        model = tariff_model.get_model()
         
-        # Calculate costs for each plan
+        # Clean up the rate code (handle aliases and OCR misreads like ETOIJ3)
+        current_rate_code = catalog.resolver.canonical_code(current_rate_code, current_rate_code)
+        
+        # Price every plan at once with its seasonal, tiered and fixed charges
+        # (aliases are priced as the plan they point to)
+        billing_period = rate_history.parse_billing_period(bill_data.get('BillingPeriod'))
+        if billing_period:
+            # Use the rates in effect during the billing period, prorated across any rate change
+            costs = rate_history.get_dated_catalog().evaluate_period(
+                peak_usage, off_peak_usage, billing_period[0], billing_period[1], bill_data.get('BaselineTerritory')
+            )
+        else:
+            costs = model.evaluate(
+                [peak_usage],
+                [off_peak_usage],
+                days=[cost_engine.parse_usage(bill_data.get('BillingDays')) or tariff_model.DEFAULT_BILLING_DAYS],
+                territories=model.territory_indexes([bill_data.get('BaselineTerritory')])
+            )
+        # The year under every plan at current rates, with the other months estimated from the seasonal profile
+        annual_costs = annual_analysis.yearly_costs(bill_data)
         plan_costs = []
-        for plan_code, plan_details in rate_plans.items():
-            # If this plan is an alias, skip it (we'll calculate the real plan)
-            if 'alias' in plan_details:
-                continue
-                
-            cost_data = calculate_cost_for_plan(plan_details, peak_usage, off_peak_usage)
-            cost_data['planCode'] = plan_code
-            cost_data['description'] = plan_details.get('description', '')
-            plan_costs.append(cost_data)
+        for i, plan_code in enumerate(model.codes):
+            plan_costs.append({
+                'planCode': plan_code,
+                'peakCost': round(float(costs['peakCost'][0, i]), 2),
+                'offPeakCost': round(float(costs['offPeakCost'][0, i]), 2),
+                'baselineCredit': round(float(costs['baselineCredit'][0, i]), 2),
+                'fixedCost': round(float(costs['fixedCost'][0, i]), 2),
+                'totalCost': round(float(costs['totalCost'][0, i]), 2),
+                'annualCost': annual_costs.get(plan_code),
+                'description': model.descriptions[i]
+            })
         
         # Sort plans by total cost (ascending)
         sorted_plans = sorted(plan_costs, key=lambda x: x['totalCost'])
@@ -85,25 +108,65 @@ def analyze_rate_plans(bill_data):
         
         # Calculate savings
         monthly_savings = 0
-        yearly_savings = 0
+        best_plan_yearly_savings = 0
         
         if current_plan and best_plan and current_plan != best_plan:
             monthly_savings = current_plan['totalCost'] - best_plan['totalCost']
-            yearly_savings = monthly_savings * 12
+            if annual_costs:
+                best_plan_yearly_savings = annual_costs[current_plan['planCode']] - annual_costs[best_plan['planCode']]
+            else:
+                # Without a billing period there is no month to project the year from
+                best_plan_yearly_savings = monthly_savings * 12
+        
+        # The cheapest plan over the projected year can differ from the cheapest for the billed month
+        # (seasons and tiers weigh differently across the year), so it is ranked on its own
+        annual_best_plan = best_plan
+        yearly_savings = best_plan_yearly_savings
+        if annual_costs and current_plan:
+            annual_best_code = min(model.codes, key=lambda code: annual_costs[code])
+            annual_best_plan = next(plan for plan in sorted_plans if plan['planCode'] == annual_best_code)
+            yearly_savings = max(annual_costs[current_plan['planCode']] - annual_costs[annual_best_code], 0)
+        
+        # Where the bill sits on the best-plan-by-peak-share envelope of the rates it was priced with, for the UI
+        month = tariff_model.billing_month(bill_data.get('BillingPeriod'))
+        month_column = month - 1 if month else tariff_model.UNKNOWN_MONTH
+        if billing_period:
+            envelope_model = rate_history.get_dated_catalog().model_for_period(*billing_period)
+            billing_days = (billing_period[1] - billing_period[0]).days + 1
+        else:
+            envelope_model = model
+            billing_days = cost_engine.parse_usage(bill_data.get('BillingDays')) or tariff_model.DEFAULT_BILLING_DAYS
+        envelope = plan_index.index_for(envelope_model)
+        # Only the winner is needed here, so look it up on the envelope instead of ranking every plan
+        envelope_best, _ = envelope.best_plan(peak_usage, off_peak_usage, billing_days, month_column,
+                                              envelope_model.territory_indexes([bill_data.get('BaselineTerritory')])[0])
+        total_usage = peak_usage + off_peak_usage
+        plan_envelope = {
+            'month': plan_index.MONTH_NAMES[month_column],
+            'peakFraction': round(peak_usage / total_usage, 4) if total_usage else 0,
+            'ranges': envelope.describe(month_column),
+            'bestPlan': envelope_best,
+            'catalogVersion': envelope_model.version
+        }
         
         return {
             'currentPlan': current_plan,
             'bestPlan': best_plan,
             'monthlySavings': round(monthly_savings, 2),
             'yearlySavings': round(yearly_savings, 2),
-            'allPlans': sorted_plans
+            'bestPlanYearlySavings': round(best_plan_yearly_savings, 2),
+            'annualBestPlan': annual_best_plan,
+            'allPlans': sorted_plans,
+            'catalogVersion': model.version,
+            'rateVersions': costs.get('rateVersions', []),
+            'planEnvelope': plan_envelope
         }
     except Exception as e:
         print(f"Error analyzing rate plans: {e}")
         return None
 
 def analyze_bill_with_openai(bill_data):
-    """Use OpenAI to analyze the bill data and provide recommendations"""
+    """Analyze the bill data and provide recommendations (with an optional cached OpenAI narrative)"""
     try:
         # Analyze rate plans
         analysis = analyze_rate_plans(bill_data)
@@ -118,36 +181,28 @@ def analyze_bill_with_openai(bill_data):
         best_plan = analysis.get('bestPlan', {})
         monthly_savings = analysis.get('monthlySavings', 0)
         yearly_savings = analysis.get('yearlySavings', 0)
+        annual_best_plan = analysis.get('annualBestPlan') or best_plan
         
-        # Create a prompt for OpenAI
-        prompt = f"""
-        Based on the following electricity usage data:
-        - Peak Usage: {bill_data.get('PeakUsage', 'N/A')} kWh
-        - Off-Peak Usage: {bill_data.get('OffPeakUsage', 'N/A')} kWh
-        - Current Rate Plan: {current_plan.get('planCode', 'Unknown')} - {current_plan.get('description', '')}
-        - Current Cost: ${current_plan.get('totalCost', 0)}
-        
-        The most cost-effective rate plan would be:
-        - Best Rate Plan: {best_plan.get('planCode', 'Unknown')} - {best_plan.get('description', '')}
-        - Best Plan Cost: ${best_plan.get('totalCost', 0)}
-        - Monthly Savings: ${monthly_savings}
-        - Yearly Savings: ${yearly_savings}
-        
-        Please provide a brief analysis of why this plan is better and any considerations the customer should be aware of when switching plans.
-        """
-        
-        # Call OpenAI API
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an energy consultant helping customers find the most cost-effective electricity rate plan."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=500
+        # Build the recommendation from the template library; the LLM narrative is optional and cached per template
+        recommendation, recommendation_key = recommendations.recommend(
+            current_plan,
+            best_plan,
+            monthly_savings,
+            analysis.get('bestPlanYearlySavings', 0),
+            cost_engine.parse_usage(bill_data.get('PeakUsage')),
+            cost_engine.parse_usage(bill_data.get('OffPeakUsage')),
+            annual_best_plan=annual_best_plan.get('planCode'),
+            annual_savings=yearly_savings
         )
         
-        # Extract the recommendation
-        recommendation = response.choices[0].message.content
+        # What-if EV and solar adoption, priced under every plan; seeded from the bill's memo key so the same
+        # bill always gets the same scenarios, whether it is analyzed fresh or served from the cache
+        try:
+            seed = int(analysis_cache.analysis_key(bill_data)[:16], 16)
+            scenarios = scenario_simulator.simulate_all(bill_data, samples=SCENARIO_SAMPLES, seed=seed)
+        except Exception as e:
+            print(f"Error simulating scenarios: {e}")
+            scenarios = {}
         
         # Return the complete analysis
         return {
@@ -159,8 +214,15 @@ def analyze_bill_with_openai(bill_data):
             "bestCost": best_plan.get('totalCost', 0),
             "monthlySavings": monthly_savings,
             "yearlySavings": yearly_savings,
+            "annualBestPlan": annual_best_plan.get('planCode', 'Unknown'),
+            "annualBestPlanDescription": annual_best_plan.get('description', ''),
             "recommendation": recommendation,
-            "allPlans": analysis.get('allPlans', [])
+            "recommendationKey": list(recommendation_key),
+            "allPlans": analysis.get('allPlans', []),
+            "scenarios": scenarios,
+            "planEnvelope": analysis.get('planEnvelope'),
+            "catalogVersion": analysis.get('catalogVersion'),
+            "rateVersions": analysis.get('rateVersions', [])
         }
     except Exception as e:
         print(f"Error analyzing bill with OpenAI: {e}")
@@ -168,6 +230,10 @@ def analyze_bill_with_openai(bill_data):
             "error": f"Analysis failed: {str(e)}"
         }
 
+def analyze_bill(bill_data):
+    """Analyze a bill, reusing the memoized analysis for identical usage, plan and catalog version"""
+    return analysis_cache.get_cache().get_or_compute(bill_data, analyze_bill_with_openai)
+
 def main():
     # Check if there are any processed bills
     extracted_data_folder = 'extracted_data'
@@ -175,21 +241,19 @@ def main():
         print(f"Error: {extracted_data_folder} directory not found.")
         return
         
-    json_files = [f for f in os.listdir(extracted_data_folder) if f.endswith('_extracted_data.json')]
+    # Find the most recently modified bill in a single directory pass
+    latest_entry = None
+    with os.scandir(extracted_data_folder) as entries:
+        for entry in entries:
+            if not entry.name.endswith('_extracted_data.json'):
+                continue
+            if latest_entry is None or entry.stat().st_mtime > latest_entry.stat().st_mtime:
+                latest_entry = entry
     
-    if not json_files:
+    if latest_entry is None:
         print(f"No processed bills found in {extracted_data_folder}.")
         return
-    
-    # Process the most recent bill
-    latest_file = json_files[0]
-    latest_time = os.path.getmtime(os.path.join(extracted_data_folder, latest_file))
-    
-    for file in json_files:
-        file_time = os.path.getmtime(os.path.join(extracted_data_folder, file))
-        if file_time > latest_time:
-            latest_time = file_time
-            latest_file = file
+    latest_file = latest_entry.name
     
     # Load the bill data
     bill_path = os.path.join(extracted_data_folder, latest_file)
@@ -200,7 +264,7 @@ def main():
             bill_data = json.load(f)
             
         # Analyze the bill
-        analysis = analyze_bill_with_openai(bill_data)
+        analysis = analyze_bill(bill_data)
         
         # Save the analysis
         base_name = os.path.splitext(latest_file)[0]
@@ -217,6 +281,7 @@ def main():
         print(f"Best Plan: {analysis['bestPlan']} - {analysis['bestPlanDescription']}")
         print(f"Best Cost: ${analysis['bestCost']}")
         print(f"Estimated Monthly Savings: ${analysis['monthlySavings']}")
+        print(f"Best Plan Over a Year: {analysis['annualBestPlan']}")
         print(f"Estimated Yearly Savings: ${analysis['yearlySavings']}")
         print("\nRecommendation:")
         print(analysis['recommendation'])
@@ -0,0 +1,173 @@
+import json
+import os
+import threading
+
+
+# Lower bounds of the monthly savings buckets, in dollars
+SAVINGS_BUCKETS = [(50, 'large'), (20, 'moderate'), (5, 'small'), (0.005, 'marginal'), (float('-inf'), 'none')]
+
+# Lower bounds of the peak share buckets, as a fraction of total usage
+PEAK_SHARE_BUCKETS = [(0.35, 'high'), (0.2, 'typical'), (0.0, 'low')]
+
+# Bump when the templates change so memoized analyses pick up the new text
+TEMPLATE_VERSION = 3
+
+SWITCH_TEMPLATES = {
+    'none': "You are already on the most cost-effective plan for your usage ({current_plan}, ${current_cost} this period).",
+    'marginal': ("{best_plan} ({best_description}) would have cost ${best_cost} instead of ${current_cost}, which is "
+                 "within a few dollars a month; switching is unlikely to be worth it."),
+    'small': ("Switching from {current_plan} to {best_plan} ({best_description}) would save a modest "
+              "${monthly_savings} a month, roughly ${yearly_savings} a year; it is worth it if the plan's hours "
+              "suit your routine."),
+    'moderate': ("Switching from {current_plan} to {best_plan} ({best_description}) is recommended: it would save "
+                 "about ${monthly_savings} a month, roughly ${yearly_savings} a year."),
+    'large': ("{best_plan} ({best_description}) is substantially cheaper for your usage: about ${monthly_savings} a "
+              "month less than {current_plan}, roughly ${yearly_savings} a year."),
+}
+
+# Added when a different plan than the billed month's cheapest comes out ahead over the projected year
+ANNUAL_TEMPLATE = ("Over a full year, with the other months estimated from typical seasonal usage, {annual_best_plan} "
+                   "is projected to be cheapest, about ${annual_savings} a year less than {current_plan}.")
+
+PEAK_SHARE_TEMPLATES = {
+    'high': ("{peak_share}% of your usage falls in the peak window, which is high; moving flexible loads such as "
+             "laundry, dishwashing and EV charging to off-peak hours would lower your bill on any time-of-use plan."),
+    'typical': ("{peak_share}% of your usage falls in the peak window, which is typical; shifting a little more "
+                "to off-peak hours would add to your savings."),
+    'low': ("Only {peak_share}% of your usage falls in the peak window, so time-of-use plans with cheap off-peak "
+            "rates suit you well."),
+}
+
+# Plan-specific considerations, keyed by the recommended plan
+PLAN_NOTES = {
+    'EV2A': "EV2-A is intended for customers who charge an electric vehicle at home; check eligibility before switching.",
+    'ETOUB': ("E-TOU-B is closed to new enrollment, so this saving is only available if you are already enrolled "
+              "on it; otherwise compare the next cheapest plan in the table."),
+    'ETOUD': "E-TOU-D moves the peak window earlier, to 3-8pm, which helps if much of your evening usage comes after 8pm.",
+    'E-1': "E-1 has no peak window, but usage above your baseline allowance is billed at the higher tier 2 rate.",
+}
+
+NARRATIVE_SYSTEM_PROMPT = ("You are an energy consultant helping customers find the most cost-effective electricity "
+                           "rate plan. Write two or three sentences of general guidance. Do not include dollar amounts.")
+
+NARRATIVE_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recommendation_narratives.json')
+
+
+def bucket(value, buckets):
+    """Return the label of the first bucket whose lower bound value reaches"""
+    return next(label for lower, label in buckets if value >= lower)
+
+
+def recommendation_key(current_plan, best_plan, monthly_savings, peak_share):
+    """Template key for a bill: (current plan, best plan, savings bucket, peak share bucket)"""
+    savings_bucket = 'none' if current_plan == best_plan else bucket(monthly_savings, SAVINGS_BUCKETS)
+    return (current_plan, best_plan, savings_bucket, bucket(peak_share, PEAK_SHARE_BUCKETS))
+
+
+def build_recommendation(current_plan, best_plan, monthly_savings, yearly_savings, peak_usage, off_peak_usage,
+                         annual_best_plan=None, annual_savings=0):
+    """Build the recommendation text locally from the template library"""
+    total_usage = peak_usage + off_peak_usage
+    peak_share = peak_usage / total_usage if total_usage else 0
+    key = recommendation_key(current_plan.get('planCode'), best_plan.get('planCode'), monthly_savings, peak_share)
+    _, best_code, savings_bucket, peak_bucket = key
+
+    values = {
+        'current_plan': current_plan.get('planCode', 'Unknown'),
+        'current_cost': f"{current_plan.get('totalCost', 0):.2f}",
+        'best_plan': best_code,
+        'best_description': best_plan.get('description', ''),
+        'best_cost': f"{best_plan.get('totalCost', 0):.2f}",
+        'monthly_savings': f"{monthly_savings:.2f}",
+        'yearly_savings': f"{yearly_savings:.2f}",
+        'peak_share': round(peak_share * 100),
+        'annual_best_plan': annual_best_plan,
+        'annual_savings': f"{annual_savings:.2f}",
+    }
+    paragraphs = [SWITCH_TEMPLATES[savings_bucket].format(**values)]
+    if annual_best_plan and annual_best_plan != best_code and annual_savings >= 0.005:
+        paragraphs.append(ANNUAL_TEMPLATE.format(**values))
+    paragraphs.append(PEAK_SHARE_TEMPLATES[peak_bucket].format(**values))
+    if savings_bucket != 'none' and best_code in PLAN_NOTES:
+        paragraphs.append(PLAN_NOTES[best_code])
+    return "\n\n".join(paragraphs), key
+
+
+class NarrativeCache:
+    """LLM narratives shared by every bill with the same template key, kept in memory and on disk"""
+
+    def __init__(self, cache_file=NARRATIVE_CACHE_FILE, model="gpt-4o"):
+        self.cache_file = cache_file
+        self.model = model
+        self._lock = threading.Lock()
+        self._narratives = None
+
+    def _load(self):
+        if self._narratives is None:
+            try:
+                with open(self.cache_file, 'r') as f:
+                    self._narratives = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                self._narratives = {}
+        return self._narratives
+
+    def get(self, key, client=None):
+        """Return the narrative for a template key, asking the LLM only the first time the key is seen"""
+        cache_key = "|".join(str(part) for part in key)
+        with self._lock:
+            narrative = self._load().get(cache_key)
+        if narrative is not None:
+            return narrative
+
+        current_plan, best_plan, savings_bucket, peak_bucket = key
+        prompt = (f"A customer on the {current_plan} plan would be best served by {best_plan}. Their potential "
+                  f"savings are {savings_bucket} and the share of their usage in the peak window is {peak_bucket}. "
+                  "Explain what the customer should consider before switching.")
+        try:
+            if client is None:
+                import openai
+                client = openai
+            response = client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": NARRATIVE_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                max_tokens=200
+            )
+            narrative = response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Error generating recommendation narrative: {e}")
+            return None
+
+        with self._lock:
+            narratives = self._load()
+            narratives[cache_key] = narrative
+            try:
+                with open(self.cache_file, 'w') as f:
+                    json.dump(narratives, f, indent=4)
+            except OSError as e:
+                print(f"Warning: Could not save recommendation narratives: {e}")
+        return narrative
+
+
+_narrative_cache = NarrativeCache()
+
+
+def narratives_enabled():
+    """LLM narratives are opt-in with RECOMMENDATION_NARRATIVES=1"""
+    return os.getenv("RECOMMENDATION_NARRATIVES", "").lower() in ("1", "true", "yes")
+
+
+def recommend(current_plan, best_plan, monthly_savings, yearly_savings, peak_usage, off_peak_usage,
+              with_narrative=None, client=None, annual_best_plan=None, annual_savings=0):
+    """Return (recommendation text, template key), appending the cached LLM narrative when enabled"""
+    text, key = build_recommendation(current_plan, best_plan, monthly_savings, yearly_savings, peak_usage, off_peak_usage,
+                                     annual_best_plan, annual_savings)
+    if with_narrative is None:
+        with_narrative = narratives_enabled()
+    if with_narrative:
+        narrative = _narrative_cache.get(key, client)
+        if narrative:
+            text = f"{text}\n\n{narrative}"
+    return text, key
@@ -0,0 +1,122 @@
+import numpy as np
+
+import cost_engine
+import rate_catalog
+import tariff_model
+
+DEFAULT_SAMPLES = 5000
+PERCENTILES = (10, 50, 90)
+
+# EV charging: monthly miles driven (lognormal), efficiency in kWh per mile, and how charging is timed
+EV_MONTHLY_MILES_MEDIAN = 900
+EV_MONTHLY_MILES_SIGMA = 0.4
+EV_KWH_PER_MILE = (0.25, 0.35)
+EV_SCHEDULED_SHARE = 0.7          # Owners who schedule charging overnight
+EV_SCHEDULED_PEAK_FRACTION = (1, 19)    # Beta parameters: about 5% of charging in the peak window
+EV_UNSCHEDULED_PEAK_FRACTION = (4, 6)   # Beta parameters: about 40% when plugging in after work
+
+# Solar: system size in kW, daily sun hours by month (Jan-Dec, Northern California) and system derate
+SOLAR_SIZE_KW = (4.0, 8.0)
+SOLAR_SUN_HOURS = np.array([3.0, 3.8, 4.9, 6.0, 6.8, 7.3, 7.4, 6.8, 5.9, 4.6, 3.4, 2.8])
+SOLAR_DERATE = (0.75, 0.85)
+SOLAR_PEAK_FRACTION = 0.08        # Share of production falling inside a 4-9pm peak window
+EXPORT_CREDIT_RATE = 0.05         # $/kWh credited for exported energy
+
+SCENARIOS = ('ev', 'solar', 'ev_solar')
+
+
+def sample_ev(rng, samples, days):
+    """Sample (peak kWh, off-peak kWh) added by home EV charging over a billing period"""
+    miles = EV_MONTHLY_MILES_MEDIAN * np.exp(rng.normal(0, EV_MONTHLY_MILES_SIGMA, samples)) * days / 30
+    kwh = miles * rng.uniform(*EV_KWH_PER_MILE, samples)
+    scheduled = rng.random(samples) < EV_SCHEDULED_SHARE
+    peak_fraction = np.where(scheduled,
+                             rng.beta(*EV_SCHEDULED_PEAK_FRACTION, samples),
+                             rng.beta(*EV_UNSCHEDULED_PEAK_FRACTION, samples))
+    return kwh * peak_fraction, kwh * (1 - peak_fraction)
+
+
+def sample_solar(rng, samples, days, month):
+    """Sample (peak kWh, off-peak kWh) produced by a rooftop solar system over a billing period"""
+    sun_hours = SOLAR_SUN_HOURS[month] if month is not None else SOLAR_SUN_HOURS.mean()
+    kwh = rng.uniform(*SOLAR_SIZE_KW, samples) * sun_hours * days * rng.uniform(*SOLAR_DERATE, samples)
+    return kwh * SOLAR_PEAK_FRACTION, kwh * (1 - SOLAR_PEAK_FRACTION)
+
+
+def scenario_usage(scenario, peak_kwh, off_peak_kwh, days, month, samples, rng):
+    """Return per-sample (peak kWh, off-peak kWh, exported kWh) arrays for a scenario"""
+    peak = np.full(samples, peak_kwh, dtype=float)
+    off_peak = np.full(samples, off_peak_kwh, dtype=float)
+
+    if scenario in ('ev', 'ev_solar'):
+        ev_peak, ev_off_peak = sample_ev(rng, samples, days)
+        peak += ev_peak
+        off_peak += ev_off_peak
+
+    exported = np.zeros(samples)
+    if scenario in ('solar', 'ev_solar'):
+        solar_peak, solar_off_peak = sample_solar(rng, samples, days, month)
+        # Production offsets usage in the same period; the surplus is exported
+        exported = np.maximum(solar_peak - peak, 0) + np.maximum(solar_off_peak - off_peak, 0)
+        peak = np.maximum(peak - solar_peak, 0)
+        off_peak = np.maximum(off_peak - solar_off_peak, 0)
+
+    return peak, off_peak, exported
+
+
+def simulate(bill_data, scenario='ev', samples=DEFAULT_SAMPLES, seed=None):
+    """Price thousands of sampled EV/solar scenarios for a bill under every plan and report percentile outcomes"""
+    if scenario not in SCENARIOS:
+        raise ValueError(f"Unknown scenario {scenario}; expected one of {', '.join(SCENARIOS)}")
+
+    rng = np.random.default_rng(seed)
+    usage = cost_engine.usage_matrix([bill_data])[0]
+    days = cost_engine.parse_usage(bill_data.get('BillingDays')) or tariff_model.DEFAULT_BILLING_DAYS
+    month = tariff_model.billing_month(bill_data.get('BillingPeriod'))
+    month_index = month - 1 if month else None
+
+    # Scenarios are forward-looking, so they are priced at the current rates
+    model = tariff_model.get_model()
+    territory = model.territory_indexes([bill_data.get('BaselineTerritory')])
+    month_column = month_index if month_index is not None else tariff_model.UNKNOWN_MONTH
+
+    today = model.evaluate([usage[0]], [usage[1]], days=[days], months=[month_column], territories=territory)['totalCost'][0]
+    peak, off_peak, exported = scenario_usage(scenario, usage[0], usage[1], days, month_index, samples, rng)
+    costs = model.evaluate(peak, off_peak, days=np.full(samples, days), months=np.full(samples, month_column),
+                           territories=np.repeat(territory, samples))['totalCost']
+    costs = costs - (exported * EXPORT_CREDIT_RATE)[:, np.newaxis]
+
+    resolver = rate_catalog.get_catalog().resolver
+    current_code = resolver.canonical_code(cost_engine.rate_code(bill_data))
+    current_index = model.codes.index(current_code) if current_code in model.codes else int(today.argmin())
+    ranking = cost_engine.rank_costs(costs, np.full(samples, current_index))
+
+    best_share = np.bincount(ranking['bestIndex'], minlength=len(model.codes)) / samples
+    plans = []
+    for i, code in enumerate(model.codes):
+        plans.append({
+            'planCode': code,
+            'costPercentiles': _percentiles(costs[:, i]),
+            'bestShare': round(float(best_share[i]), 4)
+        })
+
+    return {
+        'scenario': scenario,
+        'samples': samples,
+        'currentPlan': model.codes[current_index],
+        'currentCostToday': round(float(today[current_index]), 2),
+        'currentCostPercentiles': _percentiles(ranking['currentCost']),
+        'savingsPercentiles': _percentiles(ranking['savings']),
+        'mostOftenBest': model.codes[int(best_share.argmax())],
+        'plans': sorted(plans, key=lambda plan: -plan['bestShare']),
+        'catalogVersion': model.version
+    }
+
+
+def simulate_all(bill_data, samples=DEFAULT_SAMPLES, seed=None):
+    """Run every scenario for a bill"""
+    return {scenario: simulate(bill_data, scenario, samples, seed) for scenario in SCENARIOS}
+
+
+def _percentiles(values):
+    return {f"p{p}": round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
@@ -1,13 +1,30 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pge_bill_analyzer import PGEBillAnalyzer
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
+from pge_bill_analyzer import AnalyzerClients, PGEBillAnalyzer
 import tempfile
 import os
 import uvicorn
 from typing import Optional
 import json
 
-app = FastAPI(title="PG&E Bill Analyzer")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the Vision and Supabase clients once at startup and close them at shutdown"""
+    app.state.clients = None
+    app.state.startup_error = None
+    try:
+        app.state.clients = AnalyzerClients.create()
+    except Exception as e:
+        # Keep serving so /health can report why bills can't be analyzed
+        app.state.startup_error = str(e)
+        print(f"Error creating analyzer clients: {e}")
+    yield
+    if app.state.clients:
+        app.state.clients.close()
+
+app = FastAPI(title="PG&E Bill Analyzer", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -20,6 +37,7 @@ app.add_middleware(
 
 @app.post("/analyze-bill")
 async def analyze_bill(
+    request: Request,
     file: UploadFile = File(...),
     source: Optional[str] = None
 ):
@@ -37,6 +55,10 @@ async def analyze_bill(
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File must be a PDF")
     
+    clients = request.app.state.clients
+    if clients is None:
+        raise HTTPException(status_code=503, detail=f"Bill analysis is unavailable: {request.app.state.startup_error}")
+    
     try:
         # Save uploaded file temporarily
         with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as temp_file:
@@ -44,8 +66,8 @@ async def analyze_bill(
             temp_file.write(content)
             temp_path = temp_file.name
         
-        # Process the bill
-        analyzer = PGEBillAnalyzer()
+        # Process the bill with the clients shared across requests
+        analyzer = PGEBillAnalyzer(clients)
         result = await analyzer.process_bill(temp_path)
         
         # Clean up
@@ -60,9 +82,23 @@ async def analyze_bill(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/health")
-async def health_check():
-    """Health check endpoint"""
-    return {"status": "healthy"}
+async def health_check(request: Request):
+    """Health check endpoint: Vision and Supabase client status, with 503 when either is unusable"""
+    clients = request.app.state.clients
+    if clients is None:
+        return JSONResponse(status_code=503, content={"status": "unhealthy", "error": request.app.state.startup_error})
+    
+    checks = await clients.health()
+    healthy = all(result == 'ok' for result in checks.values())
+    return JSONResponse(
+        status_code=200 if healthy else 503,
+        content={
+            "status": "healthy" if healthy else "unhealthy",
+            "checks": checks,
+            "visionPoolSize": len(clients.vision_clients),
+            "analyzerThreads": clients.threads
+        }
+    )
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", "8080"))
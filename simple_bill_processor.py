@@ -8,40 +8,117 @@ import threading
 import shutil
 from flask import Flask, request, render_template, jsonify, send_from_directory
 import process_bill_complete
+import rate_plan_analyzer
+import rate_code_resolver
+import rate_catalog
+import analysis_pages
+import job_store
 
 app = Flask(__name__, template_folder='templates')
 
-# Ensure required folders exist
-for folder in ['bills_to_process', 'processed_bills', 'ocr_output', 'extracted_data', 'templates', 'static']:
-    if not os.path.exists(folder):
-        os.makedirs(folder)
+# Working folders; created when a bill arrives rather than at import, since the serverless entry point
+# imports this module on every cold start and its templates are static files
+WORK_FOLDERS = ['bills_to_process', 'processed_bills', 'ocr_output', 'extracted_data']
 
-# Global variables
-processing_status = {
-    'processing': False,
-    'message': 'No bills are being processed',
-    'current_file': None,
-    'step': None,
-    'success': True
-}
+def ensure_folders():
+    """Create the working folders that don't exist yet"""
+    for folder in WORK_FOLDERS:
+        os.makedirs(folder, exist_ok=True)
 
-last_processed_bill = None
+# Jobs and processed bills live in the job store, opened on first use; this app processes one bill at a time
+# for a single user. The serverless entry point keeps them in memory, since its instances share no disk.
+APP_USER = 'simple_bill_processor'
+_store_checked = False
 
-# Check if templates directory exists and create it if needed
-if not os.path.exists('templates'):
-    os.makedirs('templates')
-def process_bill(file_path):
-    """Process a single bill file"""
-    global processing_status, last_processed_bill
-    
+def get_store():
+    """Return the job store, failing any job left running by a process that stopped the first time it is used"""
+    global _store_checked
+    store = job_store.get_store()
+    if not _store_checked:
+        # Jobs here run on their own threads, so one whose thread is gone can only be failed, never retried
+        store.recover_stale_jobs(retry=False)
+        _store_checked = True
+    return store
+
+def current_status():
+    """Return the processing status of the most recent job, failing it first if its thread stopped sending heartbeats"""
+    store = get_store()
+    job = store.latest_job(APP_USER)
+    if job_store.is_stale(job):
+        store.recover_stale_jobs(retry=False)
+        job = store.latest_job(APP_USER)
+    return job_store.job_status(job)
+
+def get_rate_plan_table():
+    """Return {plan name: {'peak', 'off_peak', 'description'}} for every plan in the shared rate catalog"""
+    catalog = rate_catalog.get_catalog().refresh()
+    return {
+        details.get('name', code): {
+            'peak': details.get('peakRate', 0),
+            'off_peak': details.get('offPeakRate', 0),
+            'description': details.get('description', ''),
+            'code': code
+        }
+        for code, details in catalog.canonical_plans.items()
+    }
+
+def plan_cost_rows(billing_period, peak_usage, off_peak_usage, current_plan, rate_plans):
+    """Return the comparison table rows for every plan, priced by the tariff model like analyze_rate_plans
+
+    Monthly costs use the rates in effect during the billing period and yearly costs the annual projection,
+    so the table is ranked and savings are measured against the current plan on one basis.
+    """
+    codes = {rates['code']: name for name, rates in rate_plans.items()}
+    analysis = rate_plan_analyzer.analyze_rate_plans({
+        'BillingPeriod': billing_period,
+        'PeakUsage': peak_usage,
+        'OffPeakUsage': off_peak_usage,
+        'RateSchedule': rate_plans[current_plan]['code'] if current_plan in rate_plans else ''
+    })
+    if not analysis:
+        raise Exception("Could not price the rate plans")
+    costs = {}
+    for plan in analysis['allPlans']:
+        if plan['planCode'] in codes:
+            # Without a billing period there is no month to project the year from
+            yearly_cost = plan['annualCost'] if plan['annualCost'] is not None else plan['totalCost'] * 12
+            costs[codes[plan['planCode']]] = (plan['totalCost'], yearly_cost)
+
+    current_monthly, current_yearly = costs.get(current_plan, (None, None))
+    rows = []
+    for plan_name, (monthly_cost, yearly_cost) in costs.items():
+        rates = rate_plans[plan_name]
+        rows.append({
+            'name': plan_name,
+            'description': rates['description'],
+            'peakRate': rates['peak'],
+            'offPeakRate': rates['off_peak'],
+            'monthlyCost': round(monthly_cost, 2),
+            'yearlyCost': round(yearly_cost, 2),
+            'monthlySavings': round(current_monthly - monthly_cost, 2) if current_monthly is not None else 0,
+            'yearlySavings': round(current_yearly - yearly_cost, 2) if current_yearly is not None else 0
+        })
+    # Lowest monthly cost first
+    rows.sort(key=lambda row: row['monthlyCost'])
+    return rows
+
+def match_rate_plan_name(rate_plan, rate_plans, default='E-TOU-B'):
+    """Return the rate_plans key for a raw rate plan code, matching spelling variants and OCR misreads"""
+    plan_code = str(rate_plan or '').split()[0] if rate_plan else ''
+    if plan_code in rate_plans:
+        return plan_code
+    resolver = rate_catalog.get_catalog().resolver
+    canonical_code = resolver.canonical_code(plan_code)
+    return next((name for name in rate_plans if canonical_code and resolver.canonical_code(name) == canonical_code), default)
+
+def process_bill(file_path, job_id):
+    """Process a single bill file, recording each step on its job"""
     try:
         file_name = os.path.basename(file_path)
         print(f"Starting processing for {file_name}")
-        processing_status['current_file'] = file_name
         
         # Step 1: OCR Processing
-        processing_status['step'] = 'ocr'
-        processing_status['message'] = f'Extracting text from {file_name} using OCR...'
+        get_store().update_job(job_id, 'ocr', f'Extracting text from {file_name} using OCR...')
         
         # Ensure the file exists
         if not os.path.exists(file_path):
@@ -55,17 +132,18 @@ def process_bill(file_path):
         print(f"OCR completed for {file_name}, starting bill data analysis")
             
         # Step 2: Bill Data Analysis
-        processing_status['step'] = 'analyze'
-        processing_status['message'] = f'Analyzing bill data from {file_name}...'
+        get_store().update_job(job_id, 'analyze', f'Analyzing bill data from {file_name}...')
         
         # Extract bill data
         extracted_data = process_bill_complete.extract_bill_data_with_openai(ocr_text_file)
+        if not extracted_data or 'error' in extracted_data:
+            # Fail the job without touching any earlier extraction of the same file
+            raise Exception(f"Bill data extraction failed: {(extracted_data or {}).get('error', 'no data returned')}")
         
         print(f"Bill data analysis completed for {file_name}, starting rate plan analysis")
         
         # Step 3: Rate Plan Analysis
-        processing_status['step'] = 'rate_analysis'
-        processing_status['message'] = f'Analyzing rate plans for {file_name}...'
+        get_store().update_job(job_id, 'rate_analysis', f'Analyzing rate plans for {file_name}...')
         
         # Move the processed PDF to the processed_bills folder
         processed_pdf_path = os.path.join('processed_bills', file_name)
@@ -76,9 +154,7 @@ def process_bill(file_path):
         
         # Save extracted data
         base_name = os.path.splitext(file_name)[0]
-        output_file = os.path.join('extracted_data', f"{base_name}_extracted_data.json")
-        with open(output_file, 'w') as f:
-            json.dump(extracted_data, f, indent=4)
+        process_bill_complete.save_extracted_data(extracted_data, base_name)
         
         # Perform rate plan analysis
         analysis_result = None
@@ -135,53 +211,27 @@ def process_bill(file_path):
                 'totalCharge': float(extracted_data['totalCharge'])
             }
             
-            # Ensure rate plan is correctly identified (ETOUB instead of ETOIJ3 if needed)
+            # Ensure rate plan is correctly identified (ETOUB instead of OCR misreads like ETOIJ3)
             rate_plan = extracted_data.get('ratePlan', '')
-            if 'ETOIJ3' in rate_plan:
-                rate_plan = rate_plan.replace('ETOIJ3', 'ETOUB')
-                extracted_data['ratePlan'] = rate_plan
+            if rate_plan:
+                rate_code = rate_plan.split()[0]
+                canonical_code = rate_code_resolver.get_default_resolver().canonical_code(rate_code, rate_code)
+                extracted_data['ratePlan'] = rate_plan.replace(rate_code, canonical_code, 1)
             
-            # Define rate plans with their peak and off-peak rates
-            rate_plans = {
-                'E-1': {'peak': 0.31, 'off_peak': 0.31, 'description': 'Flat Rate (Tiered Pricing)'},
-                'E-TOU-B': {'peak': 0.42, 'off_peak': 0.33, 'description': 'Time-of-Use (4-9pm Peak)'},
-                'E-TOU-C': {'peak': 0.42, 'off_peak': 0.33, 'description': 'Time-of-Use (4-9pm Peak)'},
-                'E-TOU-D': {'peak': 0.40, 'off_peak': 0.32, 'description': 'Time-of-Use (3-8pm Peak)'},
-                'EV2-A': {'peak': 0.35, 'off_peak': 0.27, 'description': 'Time-of-Use (EV Owners)'}
-            }
+            # Peak and off-peak rates for every plan, from the shared catalog
+            rate_plans = get_rate_plan_table()
             
             # Calculate projected costs for each rate plan using actual usage
             peak_usage = energy_charges['peakUsage']
             off_peak_usage = energy_charges['offPeakUsage']
             current_total = energy_charges['totalCharge']
             
-            # Calculate costs for each plan
-            plan_costs = []
-            for plan_name, rates in rate_plans.items():
-                peak_cost = peak_usage * rates['peak']
-                off_peak_cost = off_peak_usage * rates['off_peak']
-                total_cost = peak_cost + off_peak_cost
-                monthly_savings = current_total - total_cost
-                yearly_savings = monthly_savings * 12
-                
-                plan_costs.append({
-                    'name': plan_name,
-                    'description': rates['description'],
-                    'peakRate': rates['peak'],
-                    'offPeakRate': rates['off_peak'],
-                    'monthlyCost': round(total_cost, 2),
-                    'yearlyCost': round(total_cost * 12, 2),
-                    'monthlySavings': round(monthly_savings, 2),
-                    'yearlySavings': round(yearly_savings, 2)
-                })
+            # Determine the current plan
+            # Match spelling variants (ETOUB vs E-TOU-B) before falling back to the default
+            current_plan = match_rate_plan_name(extracted_data.get('ratePlan', 'E-TOU-B'), rate_plans)
             
-            # Sort plans by monthly cost (lowest first)
-            plan_costs.sort(key=lambda x: x['monthlyCost'])
-            
-            # Determine current and best plans
-            current_plan = extracted_data.get('ratePlan', 'E-TOU-B').split()[0]  # Get just the plan code
-            if current_plan not in rate_plans:
-                current_plan = 'E-TOU-B'  # Default if not found
+            # Price every plan for the billed month and the projected year, cheapest month first
+            plan_costs = plan_cost_rows(extracted_data['billingPeriod'], peak_usage, off_peak_usage, current_plan, rate_plans)
                 
             best_plan = plan_costs[0]['name']  # Lowest cost plan
             
@@ -205,7 +255,7 @@ def process_bill(file_path):
             }
             
             # Also call the OpenAI analyzer for additional insights
-            openai_analysis = process_bill_complete.rate_plan_analyzer.analyze_bill_with_openai(extracted_data)
+            openai_analysis = process_bill_complete.rate_plan_analyzer.analyze_bill(extracted_data)
             if openai_analysis and 'recommendations' in openai_analysis:
                 analysis_result['recommendations'].extend(openai_analysis['recommendations'])
                 
@@ -222,12 +272,7 @@ def process_bill(file_path):
             print(f"Error during rate plan analysis: {e}")
         
         # Add to processed bills
-        bill_info = {
-            'filename': file_name,
-            'data': extracted_data,
-            'analysis': analysis_result
-        }
-        last_processed_bill = bill_info
+        get_store().add_bill(APP_USER, file_name, extracted_data, analysis_result, job_id)
         
         return True, "Bill processed successfully", analysis_result
     except Exception as e:
@@ -235,26 +280,17 @@ def process_bill(file_path):
         print(error_msg)
         return False, error_msg, None
 
-def process_bill_thread(file_path):
+def process_bill_thread(file_path, job_id):
     """Process a bill in a separate thread"""
-    global processing_status
-    
+    success, message = False, 'Bill was not processed'
     try:
-        # Ensure directories exist
-        os.makedirs('bills_to_process', exist_ok=True)
-        os.makedirs('processed_bills', exist_ok=True)
-        os.makedirs('extracted_data', exist_ok=True)
-        os.makedirs('ocr_output', exist_ok=True)
-        
-        # Set processing status
-        processing_status['processing'] = True
-        processing_status['step'] = 'init'
-        processing_status['message'] = 'Starting bill processing...'
+        get_store().update_job(job_id, 'init', 'Starting bill processing...')
         
         # Process the bill
         file_name = os.path.basename(file_path)
         print(f"Processing bill {file_name}")
-        success, message, _ = process_bill(file_path)
+        with job_store.heartbeat(get_store(), job_id):
+            success, message, _ = process_bill(file_path, job_id)
         
         # Remove the file from the processing folder
         try:
@@ -264,71 +300,34 @@ def process_bill_thread(file_path):
             print(f"Warning: Could not remove file from processing folder: {e}")
         
         if success:
-            processing_status['message'] = 'Bill processed successfully!'
-            processing_status['success'] = True
-        else:
-            processing_status['message'] = message
-            processing_status['success'] = False
+            message = 'Bill processed successfully!'
     except Exception as e:
-        error_msg = f'Error processing bill: {str(e)}'
-        print(error_msg)  # Print to console for debugging
-        processing_status['message'] = error_msg
-        processing_status['success'] = False
+        message = f'Error processing bill: {str(e)}'
+        print(message)  # Print to console for debugging
+        success = False
     finally:
-        processing_status['processing'] = False
-        processing_status['current_file'] = None
-        processing_status['step'] = None
+        get_store().finish_job(job_id, success, message)
 
-def process_manual_entry(entry_id, extracted_data):
+def process_manual_entry(entry_id, extracted_data, job_id):
     """Process manually entered bill data"""
-    global processing_status, last_processed_bill
-    
     try:
         # Make sure directories exist
         if not os.path.exists('extracted_data'):
             os.makedirs('extracted_data')
         
-        # Define rate plans with their peak and off-peak rates
-        rate_plans = {
-            'E-1': {'peak': 0.31, 'off_peak': 0.31, 'description': 'Flat Rate (Tiered Pricing)'},
-            'E-TOU-B': {'peak': 0.42, 'off_peak': 0.33, 'description': 'Time-of-Use (4-9pm Peak)'},
-            'E-TOU-C': {'peak': 0.42, 'off_peak': 0.33, 'description': 'Time-of-Use (4-9pm Peak)'},
-            'E-TOU-D': {'peak': 0.40, 'off_peak': 0.32, 'description': 'Time-of-Use (3-8pm Peak)'},
-            'EV2-A': {'peak': 0.35, 'off_peak': 0.27, 'description': 'Time-of-Use (EV Owners)'}
-        }
+        # Peak and off-peak rates for every plan, from the shared catalog
+        rate_plans = get_rate_plan_table()
         
         # Calculate projected costs for each rate plan using actual usage
         peak_usage = extracted_data['peakUsage']
         off_peak_usage = extracted_data['offPeakUsage']
         current_total = extracted_data['totalCharge']
         
-        # Calculate costs for each plan
-        plan_costs = []
-        for plan_name, rates in rate_plans.items():
-            peak_cost = peak_usage * rates['peak']
-            off_peak_cost = off_peak_usage * rates['off_peak']
-            total_cost = peak_cost + off_peak_cost
-            monthly_savings = current_total - total_cost
-            yearly_savings = monthly_savings * 12
-            
-            plan_costs.append({
-                'name': plan_name,
-                'description': rates['description'],
-                'peakRate': rates['peak'],
-                'offPeakRate': rates['off_peak'],
-                'monthlyCost': round(total_cost, 2),
-                'yearlyCost': round(total_cost * 12, 2),
-                'monthlySavings': round(monthly_savings, 2),
-                'yearlySavings': round(yearly_savings, 2)
-            })
-        
-        # Sort plans by monthly cost (lowest first)
-        plan_costs.sort(key=lambda x: x['monthlyCost'])
+        # Determine the current plan
+        current_plan = match_rate_plan_name(extracted_data.get('ratePlan', 'E-TOU-B'), rate_plans)
         
-        # Determine current and best plans
-        current_plan = extracted_data.get('ratePlan', 'E-TOU-B')
-        if current_plan not in rate_plans:
-            current_plan = 'E-TOU-B'  # Default if not found
+        # Price every plan for the billed month and the projected year, cheapest month first
+        plan_costs = plan_cost_rows(extracted_data.get('billingPeriod'), peak_usage, off_peak_usage, current_plan, rate_plans)
             
         best_plan = plan_costs[0]['name']  # Lowest cost plan
         
@@ -362,36 +361,30 @@ def process_manual_entry(entry_id, extracted_data):
         
         # Create a record for this manual entry
         filename = f"manual_{entry_id}"
-        last_processed_bill = {
-            'filename': filename,
-            'data': extracted_data,
-            'analysis': analysis_result
-        }
+        get_store().add_bill(APP_USER, filename, extracted_data, analysis_result, job_id)
         
         # Update status when complete
-        processing_status['processing'] = False
-        processing_status['message'] = 'Manual bill entry processed successfully'
-        processing_status['step'] = None
+        get_store().finish_job(job_id, True, 'Manual bill entry processed successfully')
         print(f"Processing completed for manual entry {entry_id}")
         
     except Exception as e:
         # Handle any errors
-        processing_status['processing'] = False
-        processing_status['success'] = False
-        processing_status['message'] = f'Error processing manual entry: {str(e)}'
-        processing_status['step'] = None
+        get_store().finish_job(job_id, False, f'Error processing manual entry: {str(e)}')
         print(f"Error processing manual entry: {str(e)}")
 
+def process_manual_entry_thread(entry_id, extracted_data, job_id):
+    """Process manually entered bill data in a separate thread"""
+    with job_store.heartbeat(get_store(), job_id):
+        process_manual_entry(entry_id, extracted_data, job_id)
+
 @app.route('/')
 def index():
     return render_template('tabbed_index.html')
 
 @app.route('/upload', methods=['POST'])
 def upload_files():
-    global processing_status
-    
     # Check if already processing
-    if processing_status['processing']:
+    if current_status()['processing']:
         return jsonify({
             'success': False,
             'message': 'A bill is already being processed. Please wait until processing is complete.'
@@ -417,11 +410,13 @@ def upload_files():
         })
     
     # Save the uploaded file to a temporary location
+    ensure_folders()
     temp_path = os.path.join('bills_to_process', bill.filename)
     bill.save(temp_path)
     
     # Start processing in a separate thread
-    processing_thread = threading.Thread(target=process_bill_thread, args=(temp_path,))
+    job_id = get_store().create_job(APP_USER, bill.filename, temp_path, state='running')
+    processing_thread = threading.Thread(target=process_bill_thread, args=(temp_path, job_id))
     processing_thread.daemon = True
     processing_thread.start()
     
@@ -432,13 +427,11 @@ def upload_files():
 
 @app.route('/processing-status')
 def get_processing_status():
-    return jsonify(processing_status)
+    return jsonify(current_status())
 
 @app.route('/manual-entry', methods=['POST'])
 def manual_entry():
-    global processing_status
-    
-    if processing_status['processing']:
+    if current_status()['processing']:
         return jsonify({
             'success': False,
             'message': 'A bill is already being processed. Please wait until it completes.'
@@ -484,18 +477,17 @@ def manual_entry():
     }
     
     # Save extracted data to file
+    ensure_folders()
     output_file = os.path.join('extracted_data', f"{entry_id}_extracted_data.json")
     with open(output_file, 'w') as f:
         json.dump(extracted_data, f, indent=4)
     
     # Set processing status for rate analysis
-    processing_status['processing'] = True
-    processing_status['current_file'] = f"Manual Entry {entry_id}"
-    processing_status['step'] = 'rate_analysis'
-    processing_status['message'] = 'Analyzing rate plans for manual entry...'
+    job_id = get_store().create_job(APP_USER, f"Manual Entry {entry_id}", state='running')
+    get_store().update_job(job_id, 'rate_analysis', 'Analyzing rate plans for manual entry...')
     
     # Start rate plan analysis in a separate thread
-    processing_thread = threading.Thread(target=process_manual_entry, args=(entry_id, extracted_data))
+    processing_thread = threading.Thread(target=process_manual_entry_thread, args=(entry_id, extracted_data, job_id))
     processing_thread.daemon = True
     processing_thread.start()
     
@@ -506,12 +498,8 @@ def manual_entry():
 
 @app.route('/bill-list')
 def get_bill_list():
-    global last_processed_bill
-    bills = []
-    
-    # If we have a last processed bill, show it
-    if last_processed_bill is not None:
-        bills.append(last_processed_bill)
+    # Show the last processed bill
+    bills = get_store().user_bills(APP_USER, limit=1)
     
     return jsonify({
         'bills': bills
@@ -527,99 +515,8 @@ def view_analysis(filename):
     analysis_file = os.path.join('extracted_data', f"{base_name}_rate_analysis.json")
     
     try:
-        with open(analysis_file, 'r') as f:
-            analysis = json.load(f)
-        
-        # Create a simple HTML to display the analysis
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Rate Plan Analysis for {filename}</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; padding: 20px; max-width: 800px; margin: 0 auto; }}
-                h1, h2 {{ color: #0066cc; }}
-                .card {{ background: #f9f9f9; border-radius: 5px; padding: 15px; margin-bottom: 20px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }}
-                .savings {{ color: #28a745; font-weight: bold; }}
-                table {{ width: 100%; border-collapse: collapse; }}
-                th, td {{ padding: 8px; text-align: left; border-bottom: 1px solid #ddd; }}
-                th {{ background-color: #f2f2f2; }}
-            </style>
-        </head>
-        <body>
-            <h1>Rate Plan Analysis for {filename}</h1>
-            
-            <div class="card">
-                <h2>Current Plan: {analysis['currentPlan']}</h2>
-                <p>Based on your usage patterns, the best plan for you is: <strong>{analysis['bestPlan']}</strong></p>
-                
-                <h3>Potential Savings</h3>
-                <p class="savings">Monthly: ${analysis['monthlySavings']}</p>
-                <p class="savings">Yearly: ${analysis['yearlySavings']}</p>
-            </div>
-            
-            <div class="card">
-                <h2>Rate Plan Comparison</h2>
-                <table>
-                    <tr>
-                        <th>Rate Plan</th>
-                        <th>Monthly Cost</th>
-                        <th>Yearly Cost</th>
-                        <th>Savings vs. Current</th>
-                    </tr>
-        """
-        
-        # Add each rate plan to the table
-        for plan in analysis['plans']:
-            savings = float(plan['monthlySavings']) if 'monthlySavings' in plan else 0
-            savings_class = 'savings' if savings > 0 else ''
-            
-            html += f"""
-                    <tr>
-                        <td>{plan['name']}</td>
-                        <td>${plan['monthlyCost']}</td>
-                        <td>${plan['yearlyCost']}</td>
-                        <td class="{savings_class}">${plan.get('monthlySavings', '0.00')}/month</td>
-                    </tr>
-            """
-        
-        html += """
-                </table>
-            </div>
-            
-            <div class="card">
-                <h2>Usage Analysis</h2>
-                <p>Your bill shows the following usage patterns:</p>
-                <ul>
-        """
-        
-        # Add usage analysis
-        if 'usageAnalysis' in analysis:
-            for point in analysis['usageAnalysis']:
-                html += f"<li>{point}</li>"
-        
-        html += """
-                </ul>
-            </div>
-            
-            <div class="card">
-                <h2>Recommendations</h2>
-                <ul>
-        """
-        
-        # Add recommendations
-        if 'recommendations' in analysis:
-            for rec in analysis['recommendations']:
-                html += f"<li>{rec}</li>"
-        
-        html += """
-                </ul>
-            </div>
-        </body>
-        </html>
-        """
-        
-        return html
+        # Rendered once per analysis content; unchanged pages are answered with 304
+        return analysis_pages.analysis_page(analysis_file, 'simple_analysis.html', filename=filename)
     except Exception as e:
         return f"<h1>Error</h1><p>Could not load analysis: {str(e)}</p>"
 
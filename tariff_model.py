@@ -0,0 +1,210 @@
+import json
+import os
+import re
+import threading
+from datetime import datetime
+
+import numpy as np
+
+import cost_engine
+import rate_catalog
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline_allowances.json')
+
+# Season columns in the compiled rate arrays; bills with an unknown month are priced as winter,
+# which is what the legacy top-level peakRate/offPeakRate describe
+SEASONS = ('summer', 'winter')
+DEFAULT_SEASON = SEASONS.index('winter')
+UNKNOWN_MONTH = 12
+
+# PG&E baseline seasons, used for baseline allowances regardless of plan
+BASELINE_SUMMER_MONTHS = (6, 7, 8, 9)
+
+DEFAULT_BILLING_DAYS = 30
+
+
+def load_baselines(baseline_file=BASELINE_FILE):
+    """Load daily baseline allowances as (territory codes, (territories x [summer, winter]) kWh/day, default index)"""
+    try:
+        with open(baseline_file, 'r') as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        print(f"Error loading baseline allowances: {e}")
+        data = {"defaultTerritory": "X", "territories": {"X": {"summer": 9.8, "winter": 9.7}}}
+
+    territories = list(data['territories'])
+    allowances = np.array([[data['territories'][t]['summer'], data['territories'][t]['winter']] for t in territories],
+                          dtype=float)
+    default_index = territories.index(data.get('defaultTerritory', territories[0]))
+    return territories, allowances, default_index
+
+
+def plan_seasons(details):
+    """Return {season: rules} for a plan; plans without a seasons block use their top-level rates all year"""
+    if details.get('seasons'):
+        return details['seasons']
+    legacy = {key: details[key] for key in ('peakRate', 'offPeakRate', 'tiers') if key in details}
+    return {
+        'summer': dict(legacy, months=list(BASELINE_SUMMER_MONTHS)),
+        'winter': dict(legacy, months=[m for m in range(1, 13) if m not in BASELINE_SUMMER_MONTHS])
+    }
+
+
+# Billing period dates as printed on bills (MM/DD/YYYY) or as entered in date inputs (YYYY-MM-DD)
+BILLING_DATE = re.compile(r'\d{4}-\d{1,2}-\d{1,2}|\d{1,2}/\d{1,2}/\d{4}')
+
+
+def parse_billing_date(text):
+    """Parse 'MM/DD/YYYY' or 'YYYY-MM-DD' into a datetime, or None"""
+    for date_format in ('%m/%d/%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def billing_month(billing_period):
+    """Return the month (1-12) at the middle of a 'MM/DD/YYYY - MM/DD/YYYY' or ISO-dated billing period, or None"""
+    parsed = [parse_billing_date(date) for date in BILLING_DATE.findall(str(billing_period or ''))[:2]]
+    if not parsed or None in parsed:
+        return None
+    return (parsed[0] + (parsed[-1] - parsed[0]) / 2).month
+
+
+class TariffModel:
+    """Seasonal, tiered and baseline-credit tariffs compiled into arrays and evaluated for many bills at once"""
+
+    def __init__(self, rate_plans, baselines=None, version=None):
+        self.version = version
+        self.codes = list(rate_plans)
+        self.descriptions = [details.get('description', '') for details in rate_plans.values()]
+        self.territories, self.allowances, self.default_territory = baselines or load_baselines()
+
+        compiled = [plan_seasons(details) for details in rate_plans.values()]
+        plan_count = len(self.codes)
+        tier_count = max([len(rules.get('tiers', [])) for seasons in compiled for rules in seasons.values()] + [1])
+
+        # (P x 13) season column for each month, with a final column for unknown months
+        self.season_of_month = np.full((plan_count, 13), DEFAULT_SEASON, dtype=int)
+        # (P x S) time-of-use rates and (P x S x T) tier starts and widths (fractions of the baseline allowance) and rates
+        self.peak_rates = np.zeros((plan_count, len(SEASONS)))
+        self.off_peak_rates = np.zeros((plan_count, len(SEASONS)))
+        self.tier_lower = np.zeros((plan_count, len(SEASONS), tier_count))
+        self.tier_width = np.full((plan_count, len(SEASONS), tier_count), np.inf)
+        self.tier_rates = np.zeros((plan_count, len(SEASONS), tier_count))
+
+        for p, seasons in enumerate(compiled):
+            for season, rules in seasons.items():
+                s = SEASONS.index(season) if season in SEASONS else None
+                if s is None:
+                    continue
+                for month in rules.get('months', []):
+                    self.season_of_month[p, month - 1] = s
+
+                tiers = rules.get('tiers')
+                if tiers:
+                    lower = 0.0
+                    for t, tier in enumerate(tiers):
+                        upper = np.inf if tier.get('upTo') is None else tier['upTo']
+                        self.tier_lower[p, s, t] = lower
+                        self.tier_width[p, s, t] = upper - lower
+                        self.tier_rates[p, s, t] = tier['rate']
+                        lower = upper
+                else:
+                    off_peak = rules.get('offPeakRate', 0) or 0
+                    self.off_peak_rates[p, s] = off_peak
+                    self.peak_rates[p, s] = rules.get('peakRate', off_peak) or 0
+
+        self.tiered_plans = np.flatnonzero(self.tier_rates.any(axis=(1, 2)))
+        self.baseline_credits = np.array([details.get('baselineCredit', 0) or 0 for details in rate_plans.values()])
+        self.daily_charges = np.array([details.get('dailyCharge', 0) or 0 for details in rate_plans.values()])
+
+    def territory_indexes(self, territories):
+        """Map baseline territory letters to allowance rows, using the default territory for unknown ones"""
+        index = {code: i for i, code in enumerate(self.territories)}
+        return np.array([index.get(str(t or '').strip().upper(), self.default_territory) for t in territories], dtype=int)
+
+    def evaluate(self, peak_kwh, off_peak_kwh, days=None, months=None, territories=None):
+        """Price N bills under every plan; usage may be (N,) or (N x P) when it differs by plan"""
+        peak_kwh = np.asarray(peak_kwh, dtype=float)
+        off_peak_kwh = np.asarray(off_peak_kwh, dtype=float)
+        if peak_kwh.ndim == 1:
+            peak_kwh = peak_kwh[:, np.newaxis]
+            off_peak_kwh = off_peak_kwh[:, np.newaxis]
+        count = peak_kwh.shape[0]
+
+        days = np.full(count, DEFAULT_BILLING_DAYS, dtype=float) if days is None else np.asarray(days, dtype=float)
+        months = np.full(count, UNKNOWN_MONTH, dtype=int) if months is None else np.asarray(months, dtype=int)
+        territory_rows = (np.full(count, self.default_territory, dtype=int) if territories is None
+                          else np.asarray(territories, dtype=int))
+
+        # (N x P) season column per bill and plan
+        plan_index = np.arange(len(self.codes))
+        seasons = self.season_of_month[plan_index[np.newaxis, :], months[:, np.newaxis]]
+
+        peak_cost = peak_kwh * self.peak_rates[plan_index, seasons]
+        off_peak_cost = off_peak_kwh * self.off_peak_rates[plan_index, seasons]
+
+        # Baseline allowance for the bill (unknown months use the winter allowance)
+        baseline_season = np.where(np.isin(months + 1, BASELINE_SUMMER_MONTHS), 0, 1)
+        allowance = (self.allowances[territory_rows, baseline_season] * days)[:, np.newaxis]
+        total_kwh = peak_kwh + off_peak_kwh
+
+        # Tiered energy, only for plans that have tiers: kWh in each tier's band of the allowance times its rate
+        tier_cost = np.zeros(total_kwh.shape[:1] + (len(self.codes),))
+        if self.tiered_plans.size:
+            tiered_seasons = seasons[:, self.tiered_plans]
+            tiered_allowance = np.maximum(allowance, 1e-9)[..., np.newaxis]
+            lower = self.tier_lower[self.tiered_plans, tiered_seasons] * tiered_allowance
+            width = self.tier_width[self.tiered_plans, tiered_seasons] * tiered_allowance
+            tiered_kwh = total_kwh[:, self.tiered_plans] if total_kwh.shape[1] > 1 else total_kwh
+            in_tier = np.minimum(np.maximum(tiered_kwh[..., np.newaxis] - lower, 0), width)
+            tier_cost[:, self.tiered_plans] = (in_tier * self.tier_rates[self.tiered_plans, tiered_seasons]).sum(axis=-1)
+
+        # Tiered plans don't distinguish peak from off-peak; split their energy cost by usage share
+        peak_share = np.divide(peak_kwh, total_kwh, out=np.zeros_like(total_kwh), where=total_kwh > 0)
+        peak_cost = peak_cost + tier_cost * peak_share
+        off_peak_cost = off_peak_cost + tier_cost * (1 - peak_share)
+
+        baseline_credit = self.baseline_credits * np.minimum(total_kwh, allowance)
+        fixed_cost = self.daily_charges * days[:, np.newaxis]
+
+        return {
+            'codes': self.codes,
+            'peakCost': peak_cost,
+            'offPeakCost': off_peak_cost,
+            'baselineCredit': baseline_credit,
+            'fixedCost': fixed_cost,
+            'totalCost': peak_cost + off_peak_cost - baseline_credit + fixed_cost,
+            'catalogVersion': self.version
+        }
+
+    def evaluate_bills(self, bills):
+        """Price extracted bill records under every plan"""
+        usage = cost_engine.usage_matrix(bills)
+        days = [cost_engine.parse_usage(bill.get('BillingDays')) or DEFAULT_BILLING_DAYS for bill in bills]
+        months = [(billing_month(bill.get('BillingPeriod')) or UNKNOWN_MONTH + 1) - 1 for bill in bills]
+        territories = self.territory_indexes([bill.get('BaselineTerritory') for bill in bills])
+        return self.evaluate(usage[:, 0], usage[:, 1], days, months, territories)
+
+
+_model = None
+_model_lock = threading.Lock()
+_baselines = None
+
+
+def get_model():
+    """Return a tariff model for the current catalog version, recompiling it only when the catalog changes"""
+    global _model, _baselines
+    snapshot = rate_catalog.get_catalog().refresh()
+    model = _model
+    if model is None or model.version != snapshot.version:
+        with _model_lock:
+            if _model is None or _model.version != snapshot.version:
+                if _baselines is None:
+                    _baselines = load_baselines()
+                _model = TariffModel(snapshot.canonical_plans, _baselines, snapshot.version)
+            model = _model
+    return model
+
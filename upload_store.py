@@ -0,0 +1,55 @@
+import hashlib
+import os
+import re
+import uuid
+
+# Largest single bill accepted, in bytes
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+
+# Largest upload request (several bills plus form overhead); larger requests are refused while being read
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(100 * 1024 * 1024)))
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+CONTENT_NAME = re.compile(r'^([0-9a-f]{64})\.pdf$')
+
+
+class UploadTooLarge(Exception):
+    """Raised when an uploaded file is larger than MAX_UPLOAD_BYTES"""
+
+
+def save_upload(stream, folder, max_bytes=MAX_UPLOAD_BYTES):
+    """Copy an uploaded file into folder under its SHA-256, hashing it as it's written; returns (hash, path, size)
+
+    The bytes go to a temporary file first and are renamed to <hash>.pdf once complete, so the same
+    content always lands at the same path and uploads with the same name never overwrite each other.
+    Raises UploadTooLarge, leaving nothing behind, as soon as more than max_bytes have arrived.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    temp_path = os.path.join(folder, f".upload-{uuid.uuid4().hex}.part")
+    try:
+        with open(temp_path, 'wb') as f:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"File is larger than {max_bytes / (1024 * 1024):g} MB")
+                digest.update(chunk)
+                f.write(chunk)
+        file_hash = digest.hexdigest()
+        path = os.path.join(folder, f"{file_hash}.pdf")
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return file_hash, path, size
+
+
+def content_hash(path):
+    """Return the SHA-256 a content-addressed upload is stored under, or None for any other path"""
+    match = CONTENT_NAME.match(os.path.basename(path))
+    return match.group(1) if match else None